@@ -1,37 +1,34 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from datetime import datetime
+import callback_data as cb
+from formatting import display_date
 
 # Главное меню админа
 admin_main_ilkb = InlineKeyboardMarkup(
     inline_keyboard=[
-        [InlineKeyboardButton(text="📆 Настроить расписание", callback_data="admin|schedule|0")],
-        [InlineKeyboardButton(text="💰 Изменить цену", callback_data="admin|price")],
-        [InlineKeyboardButton(text="📋 Записи", callback_data="admin|bookings")],
-        [InlineKeyboardButton(text="🔓 Разблокировать слот", callback_data="admin|unlock")],
+        [InlineKeyboardButton(text="📆 Настроить расписание", callback_data=cb.AdminMenu(action="schedule", page=0).pack())],
+        [InlineKeyboardButton(text="💰 Изменить цену", callback_data=cb.AdminMenu(action="price").pack())],
+        [InlineKeyboardButton(text="📋 Записи", callback_data=cb.AdminMenu(action="bookings").pack())],
+        [InlineKeyboardButton(text="🔓 Разблокировать слот", callback_data=cb.AdminMenu(action="unlock").pack())],
     ]
 )
 
 def build_dates_ilkb(date_list):
     rows = []
     for ds in date_list:
-        try:
-            disp = datetime.strptime(ds, "%Y-%m-%d").strftime("%d.%m.%Y")
-        except Exception:
-            disp = ds
-        rows.append([InlineKeyboardButton(text=disp, callback_data=f"sched_date|{ds}")])
+        rows.append([InlineKeyboardButton(text=display_date(ds), callback_data=cb.ScheduleDate(date=ds).pack())])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 def build_times_manage_ilkb(date_iso, times):
     rows = []
     for t, taken in times:
         if taken:
-            rows.append([InlineKeyboardButton(text=f"🔒 {t}", callback_data="noop")])
+            rows.append([InlineKeyboardButton(text=f"🔒 {t}", callback_data=cb.Noop().pack())])
         else:
-            rows.append([InlineKeyboardButton(text=f"❌ Удалить {t}", callback_data=f"delslot|{date_iso}|{t}")])
+            rows.append([InlineKeyboardButton(text=f"❌ Удалить {t}", callback_data=cb.DeleteSlot(date=date_iso, time=t).pack())])
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 def build_add_times_row(date_iso, candidate_times):
-    buttons = [[InlineKeyboardButton(text=f"➕ {t}", callback_data=f"addslot|{date_iso}|{t}")]
+    buttons = [[InlineKeyboardButton(text=f"➕ {t}", callback_data=cb.AddSlot(date=date_iso, time=t).pack())]
                for t in candidate_times]
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
@@ -41,9 +38,9 @@ def build_nav_row_for_dates(page_offset):
     return InlineKeyboardMarkup(
         inline_keyboard=[
             [
-                InlineKeyboardButton(text="⬅️ Назад", callback_data="admin|menu"),
-                InlineKeyboardButton(text="◀️ Неделя", callback_data=f"admin|schedule|{prev_offset}"),
-                InlineKeyboardButton(text="Неделя ▶️", callback_data=f"admin|schedule|{next_offset}"),
+                InlineKeyboardButton(text="⬅️ Назад", callback_data=cb.AdminMenu(action="menu").pack()),
+                InlineKeyboardButton(text="◀️ Неделя", callback_data=cb.AdminMenu(action="schedule", page=prev_offset).pack()),
+                InlineKeyboardButton(text="Неделя ▶️", callback_data=cb.AdminMenu(action="schedule", page=next_offset).pack()),
             ]
         ]
     )
@@ -52,14 +49,35 @@ def build_price_menu_ilkb(current_price):
     return InlineKeyboardMarkup(
         inline_keyboard=[
             [
-                InlineKeyboardButton(text="−50 ₽", callback_data="price|dec|50"),
-                InlineKeyboardButton(text="+50 ₽", callback_data="price|inc|50"),
+                InlineKeyboardButton(text="−50 ₽", callback_data=cb.PriceStep(action="dec", step=50).pack()),
+                InlineKeyboardButton(text="+50 ₽", callback_data=cb.PriceStep(action="inc", step=50).pack()),
             ],
-            [InlineKeyboardButton(text="↩️ В меню", callback_data="admin|menu")],
+            [InlineKeyboardButton(text="↩️ В меню", callback_data=cb.AdminMenu(action="menu").pack())],
         ]
     )
 
 def admin_back_menu_ilkb():
     return InlineKeyboardMarkup(
-        inline_keyboard=[[InlineKeyboardButton(text="↩️ В меню", callback_data="admin|menu")]]
-    )
\ No newline at end of file
+        inline_keyboard=[[InlineKeyboardButton(text="↩️ В меню", callback_data=cb.AdminMenu(action="menu").pack())]]
+    )
+
+
+def find_pages_ilkb(search_id: int, page: int, total_pages: int):
+    """◀️ / ▶️ buttons for /find results; None when everything fits on one page."""
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton(text="⬅️ Назад",
+                                            callback_data=cb.FindPage(search_id=search_id, page=page - 1).pack()))
+    if page < total_pages - 1:
+        buttons.append(InlineKeyboardButton(text="➡️ Далее",
+                                            callback_data=cb.FindPage(search_id=search_id, page=page + 1).pack()))
+    return InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+
+def broadcast_confirm_ilkb(broadcast_id: int):
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="📣 Отправить всем",
+                             callback_data=cb.BroadcastAction(action="send", broadcast_id=broadcast_id).pack()),
+        InlineKeyboardButton(text="Отмена",
+                             callback_data=cb.BroadcastAction(action="cancel", broadcast_id=broadcast_id).pack()),
+    ]])
@@ -0,0 +1,380 @@
+"""
+Load-test harness: replays synthetic Telegram updates through the real Dispatcher.
+
+The bot runs with the production routers against a temporary SQLite database and
+a fake Bot API session that records every call and simulates network latency.
+Each generated user walks one of the booking paths (manual questions, ready spread
+from the catalog, questions picked from a category), sends a receipt and is then
+confirmed or rejected by an admin in the admin group.
+
+Usage:
+    python benchmarks/bench_dispatcher.py --users 2000 --latency-ms 0 --seed 1
+
+The exit status is 1 when anything was logged at ERROR level during the run:
+a handler or query that failed does not show up in the timings.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from pathlib import Path
+
+ADMIN_ID = 1
+ADMIN_GROUP_ID = -1001000000001
+
+# config.py reads the environment at import time, so set it up before importing the bot
+_tmp_dir = tempfile.mkdtemp(prefix="taro_bench_")
+os.environ["BOT_TOKEN"] = "123456:BENCHMARK-fake-token"
+os.environ["ADMIN_IDS"] = str(ADMIN_ID)
+os.environ["ADMIN_GROUP_ID"] = str(ADMIN_GROUP_ID)
+os.environ["DB_PATH"] = os.path.join(_tmp_dir, "bench.db")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram.client.default import DefaultBotProperties  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.types import Chat, InlineKeyboardMarkup, Message, Update  # noqa: E402
+
+import config  # noqa: E402
+import database  # noqa: E402
+import db_profiler  # noqa: E402
+import local_time  # noqa: E402
+from bot import setup_routers  # noqa: E402
+from dedup import deduplicator  # noqa: E402
+
+
+class FakeSession(BaseSession):
+    """Bot API session that never touches the network.
+
+    Every request is counted, optionally delayed by `latency` seconds, and the
+    last inline keyboard sent to each chat is remembered so the harness can
+    "press" its buttons.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls = 0
+        self.calls_by_method = Counter()
+        self.markups = {}
+        self.admin_bookings = {}
+        self._message_id = 0
+
+    def _message(self, chat_id, text=None) -> Message:
+        self._message_id += 1
+        chat_type = "private" if isinstance(chat_id, int) and chat_id > 0 else "supergroup"
+        return Message(
+            message_id=self._message_id,
+            date=datetime.now(),
+            chat=Chat(id=chat_id or 0, type=chat_type),
+            text=text,
+        )
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls += 1
+        name = type(method).__name__
+        self.calls_by_method[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        chat_id = getattr(method, "chat_id", None)
+        markup = getattr(method, "reply_markup", None)
+        if chat_id is not None and isinstance(markup, InlineKeyboardMarkup):
+            self.markups[chat_id] = markup
+            if chat_id == ADMIN_GROUP_ID:
+                self._remember_admin_booking(getattr(method, "text", None) or "", markup)
+        if name == "SendMediaGroup":
+            return [self._message(chat_id) for _ in method.media]
+        if name in ("SendMessage", "SendPhoto", "SendDocument", "EditMessageText"):
+            return self._message(chat_id, getattr(method, "text", None))
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        raise NotImplementedError("FakeSession does not download files")
+        yield b""  # pragma: no cover
+
+    async def close(self):
+        pass
+
+    def _remember_admin_booking(self, text: str, markup: InlineKeyboardMarkup):
+        """Map the client's user id to the booking id shown in an admin-group review message."""
+        user = re.search(r"@user(\d+)", text)
+        for row in markup.inline_keyboard:
+            for button in row:
+                data = button.callback_data or ""
+                if user and data.startswith("confirm|"):
+                    self.admin_bookings[int(user.group(1))] = int(data.split("|", 1)[1])
+
+    def buttons(self, chat_id, prefix: str):
+        """callback_data of buttons in the last keyboard sent to chat_id starting with prefix."""
+        markup = self.markups.get(chat_id)
+        if markup is None:
+            return []
+        return [
+            button.callback_data
+            for row in markup.inline_keyboard
+            for button in row
+            if button.callback_data and button.callback_data.startswith(prefix)
+        ]
+
+
+class ErrorCounter(logging.Handler):
+    """Counts ERROR and CRITICAL records logged anywhere during the run, keeping the first few."""
+
+    def __init__(self, keep: int = 5):
+        super().__init__(logging.ERROR)
+        self.count = 0
+        self.keep = keep
+        self.first = []
+
+    def emit(self, record: logging.LogRecord):
+        self.count += 1
+        if len(self.first) < self.keep:
+            self.first.append(f"{record.name}: {record.getMessage()}")
+
+
+class Stats:
+    """Per-step latency, DB and Bot API counters."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.db_ops = Counter()
+        self.api_calls = Counter()
+
+    @property
+    def db_total(self) -> int:
+        # Statements executed so far, as counted by the query profiler
+        return db_profiler.profiler.total_calls()
+
+
+class Harness:
+    def __init__(self, dp: Dispatcher, bot: Bot, session: FakeSession, stats: Stats, rng: random.Random):
+        self.dp = dp
+        self.bot = bot
+        self.session = session
+        self.stats = stats
+        self.rng = rng
+        self._update_id = 0
+
+    def _next_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    async def _feed(self, step: str, payload: dict):
+        update = Update.model_validate({"update_id": self._next_id(), **payload}, context={"bot": self.bot})
+        db_before = self.stats.db_total
+        api_before = self.session.calls
+        started = time.perf_counter()
+        await self.dp.feed_update(self.bot, update)
+        self.stats.latencies[step].append(time.perf_counter() - started)
+        self.stats.db_ops[step] += self.stats.db_total - db_before
+        self.stats.api_calls[step] += self.session.calls - api_before
+
+    async def message(self, step: str, user_id: int, **content):
+        update_id = self._update_id + 1
+        await self._feed(step, {"message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            **content,
+        }})
+
+    async def callback(self, step: str, user_id: int, data: str, chat_id=None, text="..."):
+        chat_id = chat_id if chat_id is not None else user_id
+        update_id = self._update_id + 1
+        await self._feed(step, {"callback_query": {
+            "id": str(update_id),
+            "from": self._user(user_id),
+            "chat_instance": str(chat_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+                "text": text,
+            },
+        }})
+
+    async def press_first(self, step: str, user_id: int, prefix: str) -> bool:
+        buttons = self.session.buttons(user_id, prefix)
+        if not buttons:
+            return False
+        await self.callback(step, user_id, buttons[0])
+        return True
+
+    async def run_user(self, user_id: int):
+        """Drive one user through catalog browsing, the booking funnel and admin review."""
+        await self.message("start", user_id, text="/start")
+        path = self.rng.choice(("manual", "ready", "custom"))
+        if path == "manual":
+            await self.message("book", user_id, text="📅 Записаться")
+        else:
+            await self.message("catalog", user_id, text="📋 Выбрать вопрос / расклад")
+            if path == "ready":
+                await self.callback("catalog_type", user_id, "spread_type|ready")
+                await self.callback("catalog_category", user_id, self.rng.choice(("ready_cat|relations", "ready_cat|general")))
+                await self.press_first("catalog_spread", user_id, "ready|")
+                await self.press_first("catalog_book", user_id, "book_ready|")
+            else:
+                await self.callback("catalog_type", user_id, "spread_type|questions")
+                await self.press_first("catalog_category", user_id, "qcat|")
+                if self.rng.random() < 0.5:
+                    numbers = sorted(self.rng.sample(range(1, 16), self.rng.randint(1, 5)))
+                    await self.message("question_numbers", user_id, text=", ".join(map(str, numbers)))
+                else:
+                    # Tick questions on the paginated list instead of typing numbers
+                    for _ in range(self.rng.randint(1, 3)):
+                        toggles = self.session.buttons(user_id, "qtog|")
+                        await self.callback("question_toggle", user_id, self.rng.choice(toggles))
+                    await self.press_first("question_page", user_id, "qpage|")
+                await self.callback("catalog_book", user_id, "book_custom")
+
+        await self.message("story", user_id, text="Краткая история ситуации " * self.rng.randint(1, 8))
+        await self.message("participants", user_id, text="Иван, Мария")
+        for i in range(self.rng.randint(1, 3)):
+            await self.message("photo", user_id, photo=[
+                {"file_id": f"photo-{user_id}-{i}", "file_unique_id": f"u-{user_id}-{i}", "width": 640, "height": 480}
+            ])
+        await self.message("photos_done", user_id, text="Готово")
+        if path == "manual":
+            questions = "\n".join(f"Вопрос {i}?" for i in range(self.rng.randint(1, 6)))
+            await self.message("questions", user_id, text=questions)
+        await self.message("phone", user_id, contact={"phone_number": f"+7999{user_id:07d}", "first_name": f"User{user_id}"})
+        # Shown only with several readers; the first button is "any reader"
+        await self.press_first("select_reader", user_id, "reader|")
+        if not await self.press_first("select_date", user_id, "date|"):
+            return
+        if not await self.press_first("select_time", user_id, "time|"):
+            return
+        await self.message("payment_info", user_id, text="От User, карта 2202")
+        await self.message("receipt", user_id, photo=[
+            {"file_id": f"receipt-{user_id}", "file_unique_id": f"r-{user_id}", "width": 640, "height": 480}
+        ])
+        await self.message("my_bookings", user_id, text="📋 Мои записи")
+
+        booking_id = self.session.admin_bookings.get(user_id)
+        if booking_id is None:
+            return
+        action = "confirm" if self.rng.random() < 0.8 else "reject"
+        await self.callback(f"admin_{action}", ADMIN_ID, f"{action}|{booking_id}", chat_id=ADMIN_GROUP_ID,
+                            text=f"Запись #{booking_id}\nСтатус: Ожидает подтверждения оплаты")
+
+
+async def seed_slots(count: int, readers: int = 1):
+    """Insert `count` free slots per reader, 15 per day starting tomorrow."""
+    per_day = [f"{h:02d}:{m:02d}" for h in range(13, 18) for m in (0, 20, 40)]
+    day = datetime.now() + timedelta(days=1)
+    rows = []
+    while len(rows) < count:
+        rows.extend((day.strftime("%Y-%m-%d"), t, local_time.starts_at(day.strftime("%Y-%m-%d"), t)) for t in per_day)
+        day += timedelta(days=1)
+    reader_ids = [config.DEFAULT_READER_ID]
+    for reader in range(1, readers):
+        reader_ids.append(await database.add_reader(f"Reader {reader + 1}"))
+    async with database.transaction():
+        await database.db.executemany(
+            "INSERT OR IGNORE INTO slots (reader_id, date, time, starts_at, is_taken) VALUES (?, ?, ?, ?, 0)",
+            [(reader_id, *row) for reader_id in reader_ids for row in rows[:count]])
+
+
+def percentile(values, pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def report(stats: Stats, session: FakeSession, elapsed: float, errors: ErrorCounter):
+    all_latencies = [v for values in stats.latencies.values() for v in values]
+    total_updates = len(all_latencies)
+    total_db = stats.db_total
+    total_api = session.calls
+    print(f"updates:            {total_updates}")
+    print(f"wall time:          {elapsed:.2f} s")
+    print(f"updates/sec:        {total_updates / elapsed:.1f}")
+    print(f"handler p50:        {percentile(all_latencies, 50) * 1000:.2f} ms")
+    print(f"handler p99:        {percentile(all_latencies, 99) * 1000:.2f} ms")
+    print(f"DB ops/update:      {total_db / max(total_updates, 1):.2f}")
+    print(f"Bot API calls/upd:  {total_api / max(total_updates, 1):.2f}")
+    print()
+    # Per-step DB/API columns are exact only with --concurrency 1 (deltas overlap otherwise)
+    print(f"{'step':<20}{'count':>8}{'p50 ms':>10}{'p99 ms':>10}{'db/upd':>9}{'api/upd':>9}")
+    for step, values in stats.latencies.items():
+        n = len(values)
+        print(f"{step:<20}{n:>8}{percentile(values, 50) * 1000:>10.2f}{percentile(values, 99) * 1000:>10.2f}"
+              f"{stats.db_ops[step] / n:>9.2f}{stats.api_calls[step] / n:>9.2f}")
+    print()
+    print("Bot API calls by method:", dict(session.calls_by_method.most_common()))
+    print()
+    print("Top queries by cumulative time:")
+    for sql, entry in db_profiler.profiler.top(8):
+        print(f"  {entry.calls:>7} calls {entry.total_time * 1000:>9.1f} ms {entry.rows:>7} rows  {sql[:90]}")
+    print()
+    print(f"Errors logged: {errors.count}")
+    for line in errors.first:
+        print(f"  {line[:200]}")
+
+
+async def run(users: int, latency_ms: float, seed: int, concurrency: int, readers: int) -> int:
+    """Run the benchmark and print the report; returns the number of errors logged."""
+    errors = ErrorCounter()
+    logging.getLogger().addHandler(errors)
+    session = FakeSession(latency=latency_ms / 1000)
+    bot = Bot(token=config.BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode="HTML"))
+    config.bot = bot
+    dp = Dispatcher()
+    setup_routers(dp)
+
+    await database.init_db()
+    await deduplicator.load()
+    dp.update.outer_middleware(deduplicator)
+    deduplicator.start()
+    await seed_slots(users + 15, readers)
+    db_profiler.profiler.reset()
+
+    stats = Stats()
+    harness = Harness(dp, bot, session, stats, random.Random(seed))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(user_id: int):
+        async with semaphore:
+            await harness.run_user(user_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(1000 + i) for i in range(users)))
+    elapsed = time.perf_counter() - started
+
+    await deduplicator.stop()
+    report(stats, session, elapsed, errors)
+    await database.db.close()
+    return errors.count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="number of synthetic users")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="simulated Bot API latency per call")
+    parser.add_argument("--seed", type=int, default=1, help="random seed for user behaviour")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="users processed concurrently (1 keeps the run fully deterministic)")
+    parser.add_argument("--readers", type=int, default=1,
+                        help="readers with their own copy of the slots (>1 adds the reader choice step)")
+    args = parser.parse_args()
+    errors = asyncio.run(run(args.users, args.latency_ms, args.seed, args.concurrency, args.readers))
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
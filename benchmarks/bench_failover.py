@@ -0,0 +1,177 @@
+"""
+Leader-election failover check for running several bot processes on one database.
+
+Starts --instances worker processes that run leader.LeaderElector against one
+temporary SQLite file, then repeatedly kills the current leader with SIGKILL and
+measures how long the survivors take to elect a new one. Workers report
+"elected"/"demoted" events on stdout; the parent checks that two live workers are
+never leader at the same time and that every failover completes within twice the
+lease TTL, and exits with status 1 if either check fails.
+
+Usage:
+    python benchmarks/bench_failover.py --instances 4 --rounds 3 --ttl 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import queue
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK-fake-token")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+def emit(event: str):
+    print(json.dumps({"pid": os.getpid(), "event": event, "t": time.time()}), flush=True)
+
+
+async def worker(ttl: float):
+    import database
+    import leader
+
+    await database.init_db()
+    elector = leader.LeaderElector("scheduler", ttl)
+
+    async def on_elected():
+        emit("elected")
+
+    async def on_demoted():
+        emit("demoted")
+
+    emit("started")
+    await elector.start(on_elected=on_elected, on_demoted=on_demoted)
+    while True:
+        await asyncio.sleep(3600)
+
+
+def spawn(ttl: float, events: queue.Queue) -> subprocess.Popen:
+    proc = subprocess.Popen([sys.executable, __file__, "--worker", "--ttl", str(ttl)],
+                            stdout=subprocess.PIPE, text=True, env=os.environ.copy())
+
+    def pump():
+        for line in proc.stdout:
+            events.put(json.loads(line))
+
+    threading.Thread(target=pump, daemon=True).start()
+    return proc
+
+
+class Cluster:
+    """Tracks which live worker claims leadership and records violations."""
+
+    def __init__(self, ttl: float, instances: int):
+        self.ttl = ttl
+        self.events = queue.Queue()
+        self.procs = {}
+        for _ in range(instances):
+            proc = spawn(ttl, self.events)
+            self.procs[proc.pid] = proc
+        self.leaders = set()
+        self.violations = []
+
+    def _apply(self, event: dict):
+        pid = event["pid"]
+        if pid not in self.procs:
+            return  # late output of a killed worker
+        if event["event"] == "elected":
+            if self.leaders:
+                self.violations.append(f"{pid} elected while {sorted(self.leaders)} still leader")
+            self.leaders.add(pid)
+        elif event["event"] == "demoted":
+            self.leaders.discard(pid)
+
+    def wait_for_leader(self, timeout: float):
+        """Process events until some live worker is leader; returns (pid, event time) or (None, None)."""
+        deadline = time.time() + timeout
+        while not self.leaders:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None, None
+            try:
+                event = self.events.get(timeout=remaining)
+            except queue.Empty:
+                return None, None
+            self._apply(event)
+            if event["event"] == "elected" and event["pid"] in self.leaders:
+                return event["pid"], event["t"]
+        pid = next(iter(self.leaders))
+        return pid, time.time()
+
+    def drain(self, seconds: float):
+        """Keep checking events for a while (catches a second leader appearing)."""
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            try:
+                self._apply(self.events.get(timeout=max(deadline - time.time(), 0.01)))
+            except queue.Empty:
+                pass
+
+    def kill(self, pid: int) -> float:
+        self.procs.pop(pid).send_signal(signal.SIGKILL)
+        self.leaders.discard(pid)
+        return time.time()
+
+    def close(self):
+        for proc in self.procs.values():
+            proc.kill()
+
+
+def run(instances: int, rounds: int, ttl: float) -> int:
+    tmp_dir = tempfile.mkdtemp(prefix="taro_failover_")
+    os.environ["DB_PATH"] = os.path.join(tmp_dir, "failover.db")
+    cluster = Cluster(ttl, instances)
+    failures = []
+    try:
+        leader_pid, _ = cluster.wait_for_leader(timeout=10 + 2 * ttl)
+        if leader_pid is None:
+            print("no leader elected at startup")
+            return 1
+        print(f"{instances} instances, lease ttl {ttl}s; initial leader {leader_pid}\n")
+        print(f"{'round':<8}{'killed':>10}{'new leader':>12}{'takeover s':>12}")
+        for round_no in range(1, rounds + 1):
+            if len(cluster.procs) < 2:
+                break
+            cluster.drain(ttl)  # steady state: exactly one leader
+            killed_at = cluster.kill(leader_pid)
+            new_pid, elected_at = cluster.wait_for_leader(timeout=3 * ttl)
+            if new_pid is None:
+                failures.append(f"round {round_no}: no new leader within {3 * ttl}s")
+                break
+            takeover = elected_at - killed_at
+            print(f"{round_no:<8}{leader_pid:>10}{new_pid:>12}{takeover:>12.2f}")
+            if takeover > 2 * ttl:
+                failures.append(f"round {round_no}: takeover took {takeover:.2f}s (limit {2 * ttl}s)")
+            leader_pid = new_pid
+        cluster.drain(ttl)
+    finally:
+        cluster.close()
+    failures.extend(cluster.violations)
+    print()
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("OK" if not failures else f"{len(failures)} failure(s)")
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--instances", type=int, default=4, help="worker processes sharing the database")
+    parser.add_argument("--rounds", type=int, default=3, help="times the leader is killed")
+    parser.add_argument("--ttl", type=float, default=2.0, help="lease TTL in seconds")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        asyncio.run(worker(args.ttl))
+    else:
+        sys.exit(run(args.instances, args.rounds, args.ttl))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+Routing microbenchmark: per-update filter cost of the dict tables in routing.py
+against the previous style of one `F.data.startswith(...)` / lambda filter per handler.
+
+Both variants register the same routes (the bot's real callback prefixes and the
+admin commands from handlers/admin_handlers.py, optionally padded with synthetic
+prefixes via --extra) with no-op handlers on a router guarded by IsAdmin, as the
+admin router is. Events are propagated straight into the routers (no dispatcher,
+middlewares or FSM storage), so the numbers are filter and dispatch overhead only.
+
+Usage:
+    python benchmarks/bench_routing.py --events 5000 --extra 0
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+ADMIN_ID = 1
+
+# config.py reads the environment at import time, so set it up before importing the bot
+os.environ["BOT_TOKEN"] = "123456:BENCHMARK-fake-token"
+os.environ["ADMIN_IDS"] = str(ADMIN_ID)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from aiogram import F, Router  # noqa: E402
+from aiogram.filters.callback_data import CallbackData  # noqa: E402
+from aiogram.types import CallbackQuery, Chat, Message, User  # noqa: E402
+
+import callback_data as cb  # noqa: E402
+from filters import IsAdmin  # noqa: E402
+from handlers.admin_handlers import commands as admin_commands  # noqa: E402
+from routing import CallbackRoutes, TextRoutes  # noqa: E402
+
+COMMANDS = admin_commands.commands()
+
+
+async def _noop(*args, **kwargs):
+    return True
+
+
+def codecs(extra: int):
+    """The bot's CallbackData classes plus `extra` synthetic ones."""
+    classes = [obj for obj in vars(cb).values()
+               if isinstance(obj, type) and issubclass(obj, CallbackData) and obj is not CallbackData]
+    for i in range(extra):
+        classes.append(type(f"Extra{i}", (CallbackData,), {"__annotations__": {"value": int}},
+                            prefix=f"x{i}", sep=cb.SEP))
+    return classes
+
+
+def admin_router() -> Router:
+    """A router with the admin router's IsAdmin filters (see handlers/admin_handlers.py)."""
+    router = Router()
+    router.message.filter(IsAdmin())
+    router.callback_query.filter(IsAdmin())
+    return router
+
+
+def legacy_router(classes, commands):
+    router = admin_router()
+    for codec in classes:
+        prefix = codec.__prefix__
+        if codec.model_fields:
+            router.callback_query.register(_noop, F.data.startswith(f"{prefix}|"))
+        else:
+            router.callback_query.register(_noop, F.data == prefix)
+    for command in commands:
+        router.message.register(_noop, lambda msg, c=command: msg.text and msg.text.startswith(c))
+    return router
+
+
+def table_router(classes, commands):
+    router = admin_router()
+    callbacks = CallbackRoutes()
+    callbacks.attach(router.callback_query)
+    texts = TextRoutes()
+    texts.attach(router.message)
+    for codec in classes:
+        callbacks(codec)(_noop)
+    texts(*commands)(_noop)
+    return router
+
+
+def sample_data(codec) -> str:
+    values = {name: 1 if field.annotation in (int, Optional[int]) else "a"
+              for name, field in codec.model_fields.items()}
+    return codec(**values).pack()
+
+
+def callback_event(data: str) -> CallbackQuery:
+    return CallbackQuery(id="1", from_user=User(id=ADMIN_ID, is_bot=False, first_name="A"),
+                         chat_instance="1", data=data)
+
+
+def message_event(text: str, user_id: int) -> Message:
+    return Message(message_id=1, date=datetime.now(), chat=Chat(id=user_id, type="private"),
+                   from_user=User(id=user_id, is_bot=False, first_name="U"), text=text)
+
+
+async def measure(router: Router, kind: str, event, count: int) -> float:
+    """Mean microseconds per propagate_event() call (router filters included)."""
+    started = time.perf_counter()
+    for _ in range(count):
+        await router.propagate_event(kind, event, raw_state=None, event_from_user=event.from_user)
+    return (time.perf_counter() - started) / count * 1e6
+
+
+async def run(events: int, extra: int):
+    classes = codecs(extra)
+    routers = {"legacy": legacy_router(classes, COMMANDS), "table": table_router(classes, COMMANDS)}
+    cases = [
+        ("callback, first route", "callback_query", callback_event(sample_data(classes[0]))),
+        ("callback, last route", "callback_query", callback_event(sample_data(classes[-1]))),
+        ("callback, no route", "callback_query", callback_event("unknown|1")),
+        ("admin command, last", "message", message_event(COMMANDS[-1], ADMIN_ID)),
+        ("admin text, no route", "message", message_event("Краткая история ситуации", ADMIN_ID)),
+        ("user text vs admin cmds", "message", message_event("Краткая история ситуации", 42)),
+    ]
+    print(f"routes: {len(classes)} callback prefixes, {len(COMMANDS)} commands; {events} events per case\n")
+    print(f"{'case':<26}{'legacy us':>12}{'table us':>12}{'speedup':>10}")
+    for title, kind, event in cases:
+        timings = {}
+        for name, router in routers.items():
+            await measure(router, kind, event, min(events, 500))  # warm-up
+            timings[name] = await measure(router, kind, event, events)
+        print(f"{title:<26}{timings['legacy']:>12.2f}{timings['table']:>12.2f}"
+              f"{timings['legacy'] / timings['table']:>9.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=5000, help="events per case and variant")
+    parser.add_argument("--extra", type=int, default=0, help="synthetic callback prefixes added to the real ones")
+    args = parser.parse_args()
+    asyncio.run(run(args.events, args.extra))
+
+
+if __name__ == "__main__":
+    main()
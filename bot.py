@@ -4,18 +4,39 @@ import logging
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
 
+import broadcast
 import config
+from dedup import deduplicator
+from filters import InAdminGroup
 from handlers import user_handlers, admin_handlers
-from scheduler import scheduler
+from leader import elector
+from loop_monitor import HandlerTracker, monitor as loop_monitor
+from scheduler import (scheduler, archive_and_compact, backfill_daily_stats, expire_unpaid_bookings,
+                       resume_broadcasts, send_reminders, sweep_waitlist)
 import database
+import outbox
+from logging_setup import setup_logging
+
+def setup_routers(dp: Dispatcher):
+    """Register routers (the admin router only accepts admins, see filters.IsAdmin)."""
+    if config.ADMIN_BRANCH_FIRST:
+        # Admin branch first; client handlers never see the admin group
+        user_handlers.router.message.filter(~InAdminGroup())
+        user_handlers.router.callback_query.filter(~InAdminGroup())
+        dp.include_router(admin_handlers.router)
+        dp.include_router(user_handlers.router)
+    else:
+        dp.include_router(user_handlers.router)
+        dp.include_router(admin_handlers.router)
+    # Lets the loop lag watchdog name the handler that blocked the loop
+    tracker = HandlerTracker(loop_monitor)
+    for router in (user_handlers.router, admin_handlers.router):
+        router.message.middleware(tracker)
+        router.callback_query.middleware(tracker)
 
 async def main():
-    # Configure logging to file and console
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-        handlers=[logging.FileHandler("bot.log"), logging.StreamHandler()]
-    )
+    # Configure logging: handlers run in a listener thread, off the event loop
+    log_listener = setup_logging()
     # Initialize bot and dispatcher
     bot = Bot(
         token=config.BOT_TOKEN,
@@ -25,24 +46,56 @@ async def main():
     # Set global bot instance for use in other modules
     config.bot = bot
     # Register routers
-    dp.include_router(user_handlers.router)
-    dp.include_router(admin_handlers.router)
+    setup_routers(dp)
     # Initialize database
     await database.init_db()
-    # Start scheduler for background jobs
+    # Drop updates redelivered after a crash or restart before any handler sees them
+    await deduplicator.load()
+    dp.update.outer_middleware(deduplicator)
+    deduplicator.start()
+    # Start scheduler for background jobs; periodic ones only act in the leader process
+    scheduler.add_job(expire_unpaid_bookings, "interval", seconds=20, id="expire_unpaid_bookings",
+                      max_instances=1, coalesce=True)
+    scheduler.add_job(resume_broadcasts, "interval", seconds=10, id="resume_broadcasts", coalesce=True)
+    scheduler.add_job(archive_and_compact, "cron", hour=config.ARCHIVE_HOUR, id="archive_and_compact")
+    scheduler.add_job(send_reminders, "interval", seconds=config.REMINDER_SWEEP_SECONDS, id="send_reminders",
+                      max_instances=1, coalesce=True)
+    scheduler.add_job(sweep_waitlist, "interval", seconds=config.WAITLIST_SWEEP_SECONDS, id="sweep_waitlist",
+                      max_instances=1, coalesce=True)
     scheduler.start()
 
+    async def on_elected():
+        # One-off work for the new leader: backfill aggregates, continue interrupted broadcasts
+        scheduler.add_job(backfill_daily_stats, id="backfill_daily_stats", replace_existing=True)
+        await broadcast.resume_all()
+
+    async def on_demoted():
+        broadcast.suspend_all()
+
+    await elector.start(on_elected=on_elected, on_demoted=on_demoted)
+    # Booking notifications queued in the outbox table (delivered by the leader)
+    outbox_task = asyncio.create_task(outbox.run_dispatcher())
+    loop_monitor.start()
+
     # Shutdown handler for graceful cleanup
     @dp.shutdown()
     async def on_shutdown():
         logging.info("Shutting down...")
         scheduler.shutdown()
+        outbox_task.cancel()
+        loop_monitor.stop()
+        await deduplicator.stop()
+        await elector.stop()
         await bot.session.close()
         if database.db:
             await database.db.close()
 
     logging.info("Bot is starting polling...")
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        # Flush queued log records before exit
+        log_listener.stop()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -1,4 +1,5 @@
-from datetime import datetime
+import config
+from formatting import display_date
 
 
 def format_currency(amount: int) -> str:
@@ -26,7 +27,7 @@ def price_summary(num_questions: int, amount: int) -> str:
 
 def payment_instructions(amount: int, date_display: str, time_str: str) -> str:
     return (
-        f"Слот <b>{date_display} {time_str}</b> зарезервирован на 15 минут.\n"
+        f"Слот <b>{date_display} {time_str}</b> зарезервирован на {config.PAYMENT_TIMEOUT_MINUTES} минут.\n"
         f"Оплатите <b>{format_currency(amount)}</b> по реквизитам:\n"
         "Сбербанк: <code>2202 2061 5913 1163</code> (Сергей Александрович С.)\n"
         "Тинькофф: <code>2200 7017 1423 6749</code> (Арианна С.)\n\n"
@@ -49,10 +50,7 @@ def booking_details_admin(details: dict) -> str:
     num_q = details.get("num_questions") or 0
     amount = details.get("amount") or 0
 
-    try:
-        date_disp = datetime.strptime(date, "%Y-%m-%d").strftime("%d.%m.%Y") if date else ""
-    except Exception:
-        date_disp = date
+    date_disp = display_date(date)
 
     txt = (
         f"Запись #{details.get('id', '')}\n"
@@ -77,6 +75,18 @@ def receipt_received_ack() -> str:
     return "Чек получен. Ожидайте подтверждения администрации."
 
 
+def session_reminder(date_display: str, time_str: str, hour_before: bool, today: bool = False) -> str:
+    when = "через час" if hour_before else ("сегодня" if today else "завтра")
+    return f"🔔 Напоминание: ваша запись на расклад {when} — <b>{date_display} {time_str}</b>."
+
+
+def waitlist_offer(date_display: str, hold_minutes: int) -> str:
+    return (
+        f"🔔 Освободилось время на <b>{date_display}</b>!\n"
+        f"Вы первый в листе ожидания: в ближайшие {hold_minutes} мин. предложение не получит никто из очереди."
+    )
+
+
 def help_text() -> str:
     return (
         "<b>Как воспользоваться ботом</b>\n\n"
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+
+import config
+import database
+from rate_limiter import send_limiter
+
+logger = logging.getLogger(__name__)
+
+# Recipients are read by keyset pages of BATCH_SIZE user ids and progress is saved
+# after every page, so memory use does not depend on the number of users and a
+# restart re-sends at most one page.
+BATCH_SIZE = 100
+# Minimum seconds between edits of the progress message
+STATUS_EDIT_INTERVAL = 5.0
+# Attempts per recipient when Telegram asks to slow down
+SEND_ATTEMPTS = 3
+
+STATUS_TITLES = {
+    "running": "идёт",
+    "done": "завершена",
+    "stopped": "остановлена",
+}
+
+# Broadcasts are sent by the leader process (see leader.py); a broadcast started
+# in another process is picked up by the scheduler's resume_broadcasts job.
+
+# broadcast_id -> task sending it in this process
+_tasks = {}
+# Broadcasts to stop sending in this process; checked before every message
+_stop_requested = set()
+# Broadcasts handed over to a new leader: stop sending but keep them running in the DB
+_suspended = set()
+
+
+def progress_text(broadcast) -> str:
+    return (
+        f"📣 Рассылка #{broadcast.id}: {STATUS_TITLES.get(broadcast.status, broadcast.status)}\n"
+        f"Отправлено: {broadcast.sent} из ~{broadcast.total}\n"
+        f"Заблокировали бота: {broadcast.blocked}\n"
+        f"Ошибок: {broadcast.failed}"
+    )
+
+
+def start(broadcast_id: int):
+    """Start (or resume) sending a broadcast in the background."""
+    if broadcast_id not in _tasks:
+        _tasks[broadcast_id] = asyncio.create_task(_run(broadcast_id))
+
+
+async def stop(broadcast_id: int) -> bool:
+    """Stop a running broadcast (sent by any process); False if it is not running."""
+    if not await database.stop_broadcast(broadcast_id):
+        return False
+    if broadcast_id in _tasks:
+        _stop_requested.add(broadcast_id)
+    return True
+
+
+def suspend_all():
+    """Stop sending in this process without finishing the broadcasts (leadership lost)."""
+    _suspended.update(_tasks)
+
+
+async def resume_all():
+    """Start sending running broadcasts that this process is not sending yet."""
+    for broadcast in await database.get_running_broadcasts():
+        if broadcast.id not in _tasks:
+            logger.info(f"Resuming broadcast {broadcast.id} after user {broadcast.last_user_id}")
+            start(broadcast.id)
+
+
+async def _send(user_id: int, text: str) -> str:
+    """Send one message: "sent", "blocked" or "failed"."""
+    for _ in range(SEND_ATTEMPTS):
+        await send_limiter.acquire()
+        try:
+            await config.bot.send_message(user_id, text)
+            return "sent"
+        except TelegramForbiddenError:
+            return "blocked"
+        except TelegramRetryAfter as e:
+            logger.warning(f"Flood control during broadcast, waiting {e.retry_after}s")
+            await asyncio.sleep(e.retry_after)
+        except Exception as e:
+            logger.warning(f"Broadcast message to {user_id} failed: {e}", extra={"user_id": user_id})
+            return "failed"
+    return "failed"
+
+
+async def _edit_status(broadcast):
+    if not broadcast.status_message_id:
+        return
+    try:
+        await config.bot.edit_message_text(progress_text(broadcast), chat_id=broadcast.status_chat_id,
+                                           message_id=broadcast.status_message_id)
+    except Exception as e:
+        logger.debug(f"Failed to edit broadcast status message: {e}")
+
+
+async def _run(broadcast_id: int):
+    try:
+        broadcast = await database.get_broadcast(broadcast_id)
+        last_edit = 0.0
+        while True:
+            if broadcast_id in _stop_requested or broadcast_id in _suspended:
+                break
+            # Stopped from another process
+            if await database.get_broadcast_status(broadcast_id) != "running":
+                _stop_requested.add(broadcast_id)
+                break
+            user_ids = await database.next_broadcast_recipients(broadcast.last_user_id, BATCH_SIZE)
+            if not user_ids:
+                broadcast.status = "done"
+                break
+            sent = failed = 0
+            blocked = []
+            cursor = broadcast.last_user_id
+            for user_id in user_ids:
+                if broadcast_id in _stop_requested or broadcast_id in _suspended:
+                    break
+                result = await _send(user_id, broadcast.text)
+                if result == "sent":
+                    sent += 1
+                elif result == "blocked":
+                    blocked.append(user_id)
+                else:
+                    failed += 1
+                cursor = user_id
+            await database.save_broadcast_progress(broadcast_id, cursor, sent, failed, blocked)
+            broadcast.last_user_id = cursor
+            broadcast.sent += sent
+            broadcast.failed += failed
+            broadcast.blocked += len(blocked)
+            if time.monotonic() - last_edit >= STATUS_EDIT_INTERVAL:
+                await _edit_status(broadcast)
+                last_edit = time.monotonic()
+        if broadcast_id in _suspended:
+            logger.info(f"Broadcast {broadcast_id} handed over after user {broadcast.last_user_id}")
+            return
+        if broadcast_id in _stop_requested:
+            broadcast.status = "stopped"
+        await database.set_broadcast_status(broadcast_id, broadcast.status)
+        await _edit_status(broadcast)
+        logger.info(f"Broadcast {broadcast_id} {broadcast.status}: sent {broadcast.sent}, "
+                    f"blocked {broadcast.blocked}, failed {broadcast.failed}")
+    except Exception as e:
+        # Left in "running": it is resumed from the saved cursor on the next start
+        logger.exception(f"Broadcast {broadcast_id} interrupted: {e}")
+    finally:
+        _tasks.pop(broadcast_id, None)
+        _stop_requested.discard(broadcast_id)
+        _suspended.discard(broadcast_id)
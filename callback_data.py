@@ -0,0 +1,125 @@
+from typing import Optional
+
+from aiogram.filters.callback_data import CallbackData
+
+# Typed callback_data for every inline button. The wire format is the one the
+# bot has always used ("prefix|field|field"), so buttons in old messages still work.
+# Keyboards build data with .pack(); handlers receive the decoded object as
+# `callback_data` through the prefix tables in routing.py.
+
+SEP = "|"
+
+
+# --- Клиент: каталог вопросов и раскладов ---
+
+class SpreadType(CallbackData, prefix="spread_type", sep=SEP):
+    kind: str  # "questions" | "ready"
+
+
+class ReadyCategory(CallbackData, prefix="ready_cat", sep=SEP):
+    category: str
+
+
+class ReadySpread(CallbackData, prefix="ready", sep=SEP):
+    spread_id: str
+
+
+class BookReady(CallbackData, prefix="book_ready", sep=SEP):
+    spread_id: str
+
+
+class QuestionCategory(CallbackData, prefix="qcat", sep=SEP):
+    category: str
+
+
+class QuestionPage(CallbackData, prefix="qpage", sep=SEP):
+    category: str
+    page: int
+
+
+class QuestionToggle(CallbackData, prefix="qtog", sep=SEP):
+    category: str
+    page: int
+    number: int
+
+
+class BookCustom(CallbackData, prefix="book_custom", sep=SEP):
+    pass
+
+
+# --- Клиент: запись и отмена ---
+
+class PickReader(CallbackData, prefix="reader", sep=SEP):
+    reader_id: int  # 0 = any reader
+
+
+class PickDate(CallbackData, prefix="date", sep=SEP):
+    date: str  # YYYY-MM-DD
+
+
+class PickTime(CallbackData, prefix="time", sep=SEP):
+    slot_id: int
+
+
+class CancelBooking(CallbackData, prefix="cancel", sep=SEP):
+    booking_id: int
+
+
+class WaitlistJoin(CallbackData, prefix="wl_join", sep=SEP):
+    days: int  # subscribe to today .. today + days - 1
+
+
+class WaitlistBook(CallbackData, prefix="wl_book", sep=SEP):
+    date: str  # YYYY-MM-DD
+
+
+class WaitlistLeave(CallbackData, prefix="wl_leave", sep=SEP):
+    pass
+
+
+# --- Админ ---
+
+class AdminMenu(CallbackData, prefix="admin", sep=SEP):
+    action: str  # "menu" | "schedule" | "price" | "bookings" | "unlock"
+    page: Optional[int] = None
+
+
+class ScheduleDate(CallbackData, prefix="sched_date", sep=SEP):
+    date: str
+
+
+class AddSlot(CallbackData, prefix="addslot", sep=SEP):
+    date: str
+    time: str
+
+
+class DeleteSlot(CallbackData, prefix="delslot", sep=SEP):
+    date: str
+    time: str
+
+
+class PriceStep(CallbackData, prefix="price", sep=SEP):
+    action: str  # "inc" | "dec"
+    step: int
+
+
+class ConfirmPayment(CallbackData, prefix="confirm", sep=SEP):
+    booking_id: int
+
+
+class RejectPayment(CallbackData, prefix="reject", sep=SEP):
+    booking_id: int
+
+
+class FindPage(CallbackData, prefix="find", sep=SEP):
+    search_id: int  # key of the remembered /find query
+    page: int
+
+
+class BroadcastAction(CallbackData, prefix="bcast", sep=SEP):
+    action: str  # "send" | "cancel"
+    broadcast_id: int
+
+
+class Noop(CallbackData, prefix="noop", sep=SEP):
+    pass
@@ -10,8 +10,22 @@ if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN is not set in .env file")
 
 # List of admin user IDs (from environment, comma-separated)
-_admin_ids = os.getenv("ADMIN_IDS", "")
-ADMIN_IDS = [int(x) for x in _admin_ids.replace(" ", "").split(",") if x.isdigit() or (x and x[0] == '-' and x[1:].isdigit())]
+def _parse_admin_ids(raw: str) -> list:
+    return [int(x) for x in raw.replace(" ", "").split(",") if x.isdigit() or (x and x[0] == '-' and x[1:].isdigit())]
+
+ADMIN_IDS = _parse_admin_ids(os.getenv("ADMIN_IDS", ""))
+# Frozen copy for membership checks (filters.IsAdmin); rebuilt by reload_admins()
+ADMIN_ID_SET = frozenset(ADMIN_IDS)
+
+
+def reload_admins() -> frozenset:
+    """Re-read ADMIN_IDS from .env / the environment without restarting the bot."""
+    global ADMIN_IDS, ADMIN_ID_SET
+    load_dotenv(override=True)
+    ADMIN_IDS = _parse_admin_ids(os.getenv("ADMIN_IDS", ""))
+    ADMIN_ID_SET = frozenset(ADMIN_IDS)
+    return ADMIN_ID_SET
+
 
 # Telegram group chat ID for admin notifications
 ADMIN_GROUP_ID = os.getenv("ADMIN_GROUP_ID")
@@ -21,8 +35,77 @@ if ADMIN_GROUP_ID:
     except ValueError:
         raise ValueError("ADMIN_GROUP_ID must be an integer (Telegram chat ID)")
 
+# Route admins' updates through the admin router before the client router
+# (admin commands then work mid-booking, and the client router ignores the admin group)
+ADMIN_BRANCH_FIRST = os.getenv("ADMIN_BRANCH_FIRST", "").lower() in ("1", "true", "yes")
+
 # Database path (SQLite file)
 DB_PATH = os.getenv("DB_PATH", "bot.db")
+# Queries slower than this are logged together with their EXPLAIN QUERY PLAN
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "50"))
+
+# Logging: JSON lines in a rotating file, written from a background thread
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+# Rotate by time instead of size (e.g. "midnight"); empty means size-based rotation
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Per-subsystem log levels, e.g. "database=DEBUG,handlers.admin_handlers=WARNING"
+LOG_LEVELS = {
+    name.strip(): level.strip().upper()
+    for name, _, level in (item.partition("=") for item in os.getenv("LOG_LEVELS", "").split(","))
+    if name.strip() and level.strip()
+}
+
+# Timezone of slot dates and times (the texts say "МСК"); independent of the server's timezone
+TIMEZONE = os.getenv("TIMEZONE", "Europe/Moscow")
+
+# Slots belong to a reader (tarot reader). The first reader is created with this
+# name; more are added with /readers. Slot commands without a reader id use it.
+DEFAULT_READER_ID = 1
+DEFAULT_READER_NAME = os.getenv("DEFAULT_READER_NAME", "Таролог")
+
+# Unpaid bookings are cancelled and their slot freed after this many minutes
+PAYMENT_TIMEOUT_MINUTES = int(os.getenv("PAYMENT_TIMEOUT_MINUTES", "15"))
+
+# Several bot processes may share DB_PATH; background jobs run only in the one
+# holding the scheduler lease. A dead leader is replaced within about this many seconds.
+LEADER_LEASE_SECONDS = float(os.getenv("LEADER_LEASE_SECONDS", "15"))
+
+# Retention: finished bookings whose session was more than this many days ago are
+# moved to ARCHIVE_DB_PATH each night (0 disables archiving)
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_DB_PATH = os.getenv("ARCHIVE_DB_PATH", "archive.db")
+ARCHIVE_HOUR = int(os.getenv("ARCHIVE_HOUR", "4"))
+
+# Session reminders: a sweeper checks for due reminders every REMINDER_SWEEP_SECONDS
+# and sends at most REMINDER_BATCH per pass
+REMINDER_SWEEP_SECONDS = int(os.getenv("REMINDER_SWEEP_SECONDS", "60"))
+REMINDER_BATCH = int(os.getenv("REMINDER_BATCH", "500"))
+# Messages per second for background sending (Telegram allows about 30)
+SEND_RATE = float(os.getenv("SEND_RATE", "25"))
+
+# Waitlist: a freed slot is offered to one waitlisted user at a time, who gets
+# this many minutes to book it before the next one in line is notified
+WAITLIST_HOLD_MINUTES = int(os.getenv("WAITLIST_HOLD_MINUTES", "10"))
+# Seconds between leader sweeps that re-offer free slots whose wake-up job was lost or whose hold expired
+WAITLIST_SWEEP_SECONDS = int(os.getenv("WAITLIST_SWEEP_SECONDS", "60"))
+
+# Update deduplication: ids of processed updates are kept this many hours (Telegram
+# keeps undelivered updates for 24h); the newest DEDUP_MEMORY are also held in memory
+DEDUP_TTL_HOURS = int(os.getenv("DEDUP_TTL_HOURS", "48"))
+DEDUP_MEMORY = int(os.getenv("DEDUP_MEMORY", "20000"))
+# Seconds between batched writes of processed update ids (no database write per update)
+DEDUP_FLUSH_SECONDS = float(os.getenv("DEDUP_FLUSH_SECONDS", "1"))
+
+# Event loop lag above this is logged, with the blocking stack and handler (see loop_monitor.py)
+LOOP_LAG_WARN_MS = float(os.getenv("LOOP_LAG_WARN_MS", "200"))
+# Longest sampling profile /profile may take
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "60"))
+
+# Long admin listings are sent as several messages, at most one per this many seconds
+LISTING_SEND_INTERVAL = float(os.getenv("LISTING_SEND_INTERVAL", "1.0"))
 
 # Booking status constants
 STATUS_CREATED = "CREATED"
@@ -1,18 +1,52 @@
+import asyncio
 import json
 import logging
-from datetime import datetime
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
 
 import aiosqlite
 
 import config
+import local_time
+from db_profiler import ProfiledConnection
+from models import (booking_details_row, booking_event_row, booking_row, booking_summary_row, broadcast_row,
+                    daily_stats_row, outbox_row, reader_row, slot_row)
 
-# Global database connection
-db: aiosqlite.Connection = None
+logger = logging.getLogger(__name__)
+
+# Global database connection (profiled wrapper around aiosqlite.Connection)
+db: ProfiledConnection = None
+# False when SQLite is built without FTS5: /find is then unavailable
+SEARCH_AVAILABLE = False
+
+# All SQL below is written as constant strings so that sqlite3 reuses the
+# prepared statements from its per-connection cache instead of re-parsing them.
+STATEMENT_CACHE_SIZE = 256
+
+# Every task shares the one connection, and SQLite has one transaction per
+# connection: another task's COMMIT would commit our half-done statements and
+# its ROLLBACK would discard them. Writes therefore only happen in transaction().
+_write_lock = asyncio.Lock()
+
+@asynccontextmanager
+async def transaction():
+    """BEGIN IMMEDIATE ... COMMIT while holding the write lock; ROLLBACK if the block raises.
+    Not reentrant: code running inside must not open another transaction()."""
+    async with _write_lock:
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            await db.rollback()
+            raise
+        await db.commit()
 
 async def init_db():
     """Initialize the database: create tables if not exist, and ensure default settings."""
     global db
-    db = await aiosqlite.connect(config.DB_PATH)
+    db = ProfiledConnection(await aiosqlite.connect(config.DB_PATH, cached_statements=STATEMENT_CACHE_SIZE))
     # Enable foreign key constraints
     await db.execute("PRAGMA foreign_keys = ON")
     # Use row factory to get results as dict-like
@@ -26,14 +60,16 @@ async def init_db():
                 name TEXT,
                 phone TEXT
             )""")
+    # Tarot readers; every slot belongs to one (see config.DEFAULT_READER_ID)
     await db.execute(
-        """CREATE TABLE IF NOT EXISTS slots (
-                id       INTEGER PRIMARY KEY,
-                date     TEXT,
-                time     TEXT,
-                is_taken INTEGER DEFAULT 0,
-                UNIQUE(date, time)
+        """CREATE TABLE IF NOT EXISTS readers (
+                id     INTEGER PRIMARY KEY,
+                name   TEXT NOT NULL,
+                active INTEGER NOT NULL DEFAULT 1
             )""")
+    await db.execute("INSERT OR IGNORE INTO readers (id, name) VALUES (?, ?)",
+                     (config.DEFAULT_READER_ID, config.DEFAULT_READER_NAME))
+    await db.execute(_SLOTS_TABLE.format(name="slots"))
     await db.execute(
         """CREATE TABLE IF NOT EXISTS bookings (
                 id            INTEGER PRIMARY KEY,
@@ -52,28 +88,136 @@ async def init_db():
                 FOREIGN KEY(user_id) REFERENCES users(user_id),
                 FOREIGN KEY(slot_id) REFERENCES slots(id)
             )""")
+    # Slot -> booking lookups (active booking of a slot, pruning of past slots)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_slot_id ON bookings(slot_id)")
     await db.execute(
         """CREATE TABLE IF NOT EXISTS settings (
                 key   TEXT PRIMARY KEY,
                 value TEXT
             )""")
+    # Per-day counters maintained on every status transition (see _bump_daily_stats)
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS daily_stats (
+                day             TEXT PRIMARY KEY,   -- YYYY-MM-DD
+                created         INTEGER NOT NULL DEFAULT 0,
+                checking        INTEGER NOT NULL DEFAULT 0,
+                confirmed       INTEGER NOT NULL DEFAULT 0,
+                rejected        INTEGER NOT NULL DEFAULT 0,
+                cancelled       INTEGER NOT NULL DEFAULT 0,
+                timed_out       INTEGER NOT NULL DEFAULT 0,
+                revenue         INTEGER NOT NULL DEFAULT 0,
+                confirm_seconds INTEGER NOT NULL DEFAULT 0,
+                confirm_samples INTEGER NOT NULL DEFAULT 0
+            )""")
+    # Append-only log of status transitions, written in the same transaction as the change.
+    # AUTOINCREMENT keeps ids strictly increasing (never reused), so consumers can page by id.
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS booking_events (
+                id         INTEGER PRIMARY KEY AUTOINCREMENT,
+                booking_id INTEGER NOT NULL,
+                old_status TEXT,               -- NULL for the creation event
+                new_status TEXT NOT NULL,
+                actor      INTEGER,            -- Telegram id of the user/admin; NULL for the bot (timeouts)
+                created_at INTEGER NOT NULL    -- unix time
+            )""")
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_booking_events_booking ON booking_events(booking_id, id)")
+    # Users waiting for a free slot on a date; id gives the FIFO order within a date
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS waitlist (
+                id          INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id     INTEGER NOT NULL,
+                date        TEXT NOT NULL,     -- YYYY-MM-DD
+                created_at  INTEGER NOT NULL,
+                notified_at INTEGER,           -- when a free slot was last offered to this user
+                UNIQUE(user_id, date)
+            )""")
+    # Release handling reads one date: the waiting queue (notified_at IS NULL, by id) and active holds
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_waitlist_date ON waitlist(date, notified_at, id)")
+    # Transactional outbox: notifications written with the status change, delivered by outbox.py
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS outbox (
+                id              INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id         INTEGER NOT NULL,
+                edit_message_id INTEGER,             -- edit this message instead of sending a new one
+                text            TEXT NOT NULL,
+                status          TEXT NOT NULL DEFAULT 'pending',   -- pending | sent | dead
+                attempts        INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                created_at      INTEGER NOT NULL
+            )""")
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox(next_attempt_at) WHERE status = 'pending'")
+    # Named leases for leader election between bot processes (see leader.py)
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS leases (
+                name       TEXT PRIMARY KEY,
+                holder     TEXT NOT NULL,
+                expires_at REAL NOT NULL    -- unix time
+            )""")
+    # Admin broadcasts; last_user_id is the keyset cursor a running broadcast resumes from
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS broadcasts (
+                id           INTEGER PRIMARY KEY,
+                text         TEXT NOT NULL,       -- HTML
+                created_by   INTEGER,
+                created_at   INTEGER NOT NULL,
+                status       TEXT NOT NULL,       -- draft | running | done | stopped
+                total        INTEGER NOT NULL DEFAULT 0,
+                last_user_id INTEGER NOT NULL DEFAULT 0,
+                sent         INTEGER NOT NULL DEFAULT 0,
+                failed       INTEGER NOT NULL DEFAULT 0,
+                blocked      INTEGER NOT NULL DEFAULT 0,
+                status_chat_id    INTEGER,        -- progress message edited while sending
+                status_message_id INTEGER
+            )""")
+    # Keys of updates already handled ("u<update_id>", "c<callback_query_id>"), see dedup.py
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS processed_updates (
+                key     TEXT PRIMARY KEY,
+                seen_at INTEGER NOT NULL
+            ) WITHOUT ROWID""")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_processed_updates_seen ON processed_updates(seen_at)")
+    # Last event id processed by each named consumer of booking_events
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS event_offsets (
+                consumer TEXT PRIMARY KEY,
+                last_id  INTEGER NOT NULL
+            )""")
     # Insert default price if not set
     cur = await db.execute("SELECT value FROM settings WHERE key='price_per_question'")
     row = await cur.fetchone()
     if row is None:
         default_price = 350  # default price per question
         await db.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", ("price_per_question", str(default_price)))
-        logging.info(f"Default price_per_question set to {default_price}")
+        logger.info(f"Default price_per_question set to {default_price}")
     await db.commit()
 
-    # Ensure cache columns exist in bookings table for historical slot data
-    for column in ("slot_date_cache", "slot_time_cache"):
+    # Ensure columns added after the first release exist in older databases
+    for table, column, column_type in (("bookings", "slot_date_cache", "TEXT"), ("bookings", "slot_time_cache", "TEXT"),
+                                       ("bookings", "created_at", "INTEGER"),
+                                       ("bookings", "reminder_stage", "INTEGER NOT NULL DEFAULT 0"),
+                                       ("bookings", "starts_at", "INTEGER"), ("slots", "starts_at", "INTEGER"),
+                                       ("bookings", "reader_id", "INTEGER"),
+                                       ("users", "blocked_at", "INTEGER")):
         try:
-            await db.execute(f"ALTER TABLE bookings ADD COLUMN {column} TEXT")
-            logging.info(f"Added missing column {column} to bookings table")
+            await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+            logger.info(f"Added missing column {column} to {table} table")
         except aiosqlite.OperationalError as e:
             if "duplicate column name" not in str(e).lower():
                 raise
+    await _migrate_slots_to_readers()
+    await db.execute(
+        "UPDATE bookings SET reader_id = COALESCE((SELECT reader_id FROM slots WHERE slots.id = bookings.slot_id), ?) "
+        "WHERE reader_id IS NULL", (config.DEFAULT_READER_ID,))
+    # Free times of a date across all readers (the "any reader" choice, waitlist counts)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_slots_date ON slots(date, time)")
+    # starts_at (UTC epoch of the session) drives every range scan and sort over slots and bookings
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_slots_starts_at ON slots(starts_at)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_starts_at ON bookings(starts_at)")
+    # Upcoming bookings of one status (reminder sweeper, archiving); replaces the text-date index
+    await db.execute("DROP INDEX IF EXISTS idx_bookings_status_date")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_status_starts ON bookings(status, starts_at)")
     # Populate cache columns for existing rows when missing
     await db.execute(
         """UPDATE bookings
@@ -91,8 +235,57 @@ async def init_db():
            WHERE slot_id IS NOT NULL AND (slot_time_cache IS NULL OR slot_time_cache = '')
         """
     )
+    await _backfill_starts_at()
+    await _setup_search()
     await db.commit()
 
+_SLOTS_TABLE = """CREATE TABLE IF NOT EXISTS {name} (
+        id        INTEGER PRIMARY KEY,
+        reader_id INTEGER NOT NULL DEFAULT 1 REFERENCES readers(id),
+        date      TEXT,
+        time      TEXT,
+        is_taken  INTEGER DEFAULT 0,
+        starts_at INTEGER,
+        UNIQUE(reader_id, date, time)
+    )"""
+
+async def _migrate_slots_to_readers():
+    """Rebuild an old slots table (UNIQUE(date, time), no reader) for per-reader calendars.
+    SQLite cannot change a table constraint in place, so the rows are copied into a new table."""
+    cur = await db.execute("SELECT 1 FROM pragma_table_info('slots') WHERE name = 'reader_id'")
+    if await cur.fetchone():
+        return
+    await db.commit()
+    await db.execute("PRAGMA foreign_keys = OFF")  # no effect inside a transaction
+    try:
+        await db.execute("BEGIN")
+        await db.execute(_SLOTS_TABLE.format(name="slots_new"))
+        await db.execute(
+            "INSERT INTO slots_new (id, reader_id, date, time, is_taken, starts_at) "
+            "SELECT id, ?, date, time, is_taken, starts_at FROM slots", (config.DEFAULT_READER_ID,))
+        await db.execute("DROP TABLE slots")
+        await db.execute("ALTER TABLE slots_new RENAME TO slots")
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        raise
+    finally:
+        await db.execute("PRAGMA foreign_keys = ON")
+    logger.info("Slots table rebuilt with reader_id")
+
+async def _backfill_starts_at():
+    """Fill starts_at for rows written before the column existed (local date/time -> epoch)."""
+    for table, date_column, time_column in (("slots", "date", "time"),
+                                            ("bookings", "slot_date_cache", "slot_time_cache")):
+        cur = await db.execute(
+            f"SELECT id, {date_column}, {time_column} FROM {table} "
+            f"WHERE starts_at IS NULL AND {date_column} IS NOT NULL")
+        rows = [(local_time.starts_at(day, hour), row_id) for row_id, day, hour in await cur.fetchall()]
+        rows = [row for row in rows if row[0] is not None]
+        if rows:
+            await db.executemany(f"UPDATE {table} SET starts_at=? WHERE id=?", rows)
+            logger.info(f"Filled starts_at for {len(rows)} row(s) of {table}")
+
 async def get_price():
     """Get current price per question."""
     cur = await db.execute("SELECT value FROM settings WHERE key='price_per_question'")
@@ -104,109 +297,204 @@ async def get_price():
             return int(float(row[0]) if row[0] else 0)
     return 0
 
+async def set_price(new_price: int):
+    """Set price per question."""
+    async with transaction():
+        await db.execute("UPDATE settings SET value=? WHERE key='price_per_question'", (str(new_price),))
+
 async def get_or_create_user(user_id: int, username: str, name: str):
-    """Insert or update a user (without changing phone if already present)."""
-    await db.execute(
-        "INSERT INTO users (user_id, username, name, phone) VALUES (?, ?, ?, ?) "
-        "ON CONFLICT(user_id) DO UPDATE SET username=excluded.username, name=excluded.name",
-        (user_id, username or "", name or "", None)
-    )
-    await db.commit()
+    """Insert or update a user (without changing phone if already present).
+    A user who writes to the bot again is no longer considered to have blocked it."""
+    async with transaction():
+        await db.execute(
+            "INSERT INTO users (user_id, username, name, phone) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET username=excluded.username, name=excluded.name, blocked_at=NULL",
+            (user_id, username or "", name or "", None)
+        )
 
 async def update_user_phone(user_id: int, phone: str):
     """Update user's phone number."""
-    await db.execute("UPDATE users SET phone=? WHERE user_id=?", (phone, user_id))
-    await db.commit()
+    async with transaction():
+        await db.execute("UPDATE users SET phone=? WHERE user_id=?", (phone, user_id))
+
+async def get_readers(active_only: bool = True):
+    """Readers ordered by id (only those taking bookings unless active_only is False)."""
+    query = "SELECT id, name, active FROM readers"
+    if active_only:
+        query += " WHERE active=1"
+    cur = await db.execute(query + " ORDER BY id")
+    cur.row_factory = reader_row
+    return await cur.fetchall()
+
+async def get_reader(reader_id: int):
+    cur = await db.execute("SELECT id, name, active FROM readers WHERE id=?", (reader_id,))
+    cur.row_factory = reader_row
+    return await cur.fetchone()
+
+async def add_reader(name: str) -> int:
+    """Add a reader and return their id."""
+    async with transaction():
+        cur = await db.execute("INSERT INTO readers (name) VALUES (?)", (name,))
+    logger.info(f"Added reader {cur.lastrowid} {name}")
+    return cur.lastrowid
 
-async def add_slot(date: str, time: str):
-    """Add a new available slot (date in YYYY-MM-DD, time in HH:MM). Return True if added, False if already exists."""
+async def set_reader_active(reader_id: int, active: bool) -> bool:
+    """Switch a reader's free slots on or off for clients; existing bookings are kept. False if no such reader."""
+    async with transaction():
+        cur = await db.execute("UPDATE readers SET active=? WHERE id=?", (int(active), reader_id))
+    return cur.rowcount > 0
+
+async def add_slot(date: str, time: str, reader_id: int = config.DEFAULT_READER_ID):
+    """Add a new available slot (date in YYYY-MM-DD, time in HH:MM) for a reader.
+    Return True if added, False if it already exists or the reader is unknown."""
     try:
-        await db.execute("INSERT INTO slots (date, time, is_taken) VALUES (?, ?, 0)", (date, time))
-        await db.commit()
-        logging.info(f"Added slot {date} {time}")
-        return True
+        async with transaction():
+            await db.execute("INSERT INTO slots (reader_id, date, time, starts_at, is_taken) VALUES (?, ?, ?, ?, 0)",
+                             (reader_id, date, time, local_time.starts_at(date, time)))
     except aiosqlite.IntegrityError:
-        # slot already exists
+        # slot already exists (or no such reader)
         return False
+    logger.info(f"Added slot {date} {time}")
+    return True
+
+async def get_slot(slot_id: int):
+    """Get a slot by ID, or None."""
+    cur = await db.execute("SELECT id, date, time, is_taken, reader_id FROM slots WHERE id=?", (slot_id,))
+    cur.row_factory = slot_row
+    return await cur.fetchone()
+
+async def get_slot_by_datetime(date: str, time: str, reader_id: int = config.DEFAULT_READER_ID):
+    """Get a reader's slot by date (YYYY-MM-DD) and time (HH:MM), or None."""
+    cur = await db.execute("SELECT id, date, time, is_taken, reader_id FROM slots WHERE reader_id=? AND date=? AND time=?",
+                           (reader_id, date, time))
+    cur.row_factory = slot_row
+    return await cur.fetchone()
 
-async def remove_slot(date: str, time: str):
-    """Remove a slot by date and time if it is free.
+async def get_slots_for_date(date: str, reader_id: int = config.DEFAULT_READER_ID):
+    """Get all slots (free and taken) of a reader on a date ordered by time."""
+    cur = await db.execute("SELECT id, date, time, is_taken, reader_id FROM slots WHERE reader_id=? AND date=? ORDER BY time",
+                           (reader_id, date))
+    cur.row_factory = slot_row
+    return await cur.fetchall()
+
+async def release_slot(slot_id: int):
+    """Mark a slot as free."""
+    async with transaction():
+        await db.execute("UPDATE slots SET is_taken=0 WHERE id=?", (slot_id,))
+
+async def remove_slot(date: str, time: str, reader_id: int = config.DEFAULT_READER_ID):
+    """Remove a reader's slot by date and time if it is free.
     Return 1 if removed, 0 if not found, -1 if there are active bookings."""
-    cur = await db.execute("SELECT id, is_taken FROM slots WHERE date=? AND time=?", (date, time))
-    row = await cur.fetchone()
-    if row is None:
-        return 0  # not found
-    slot_id = row["id"]
-    # Check if there are bookings referencing this slot
-    cur_books = await db.execute("SELECT id, status FROM bookings WHERE slot_id=?", (slot_id,))
-    bookings = await cur_books.fetchall()
     active_statuses = {
         config.STATUS_CREATED,
         config.STATUS_WAITING_PAYMENT,
         config.STATUS_CHECKING,
         config.STATUS_CONFIRMED
     }
-    has_active = any(rec["status"] in active_statuses for rec in bookings)
-    if row["is_taken"] != 0 or has_active:
-        return -1  # slot is taken or has active booking (cannot remove)
-    if bookings:
-        # Detach cancelled/rejected bookings from the slot but keep cached date/time
-        await db.execute("UPDATE bookings SET slot_id=NULL WHERE slot_id=?", (slot_id,))
-    await db.execute("DELETE FROM slots WHERE id=?", (slot_id,))
-    await db.commit()
-    logging.info(f"Removed slot {date} {time}")
+    # Checked and deleted in one transaction, so a reservation cannot slip in between
+    async with transaction():
+        cur = await db.execute("SELECT id, is_taken FROM slots WHERE reader_id=? AND date=? AND time=?",
+                               (reader_id, date, time))
+        row = await cur.fetchone()
+        if row is None:
+            return 0  # not found
+        slot_id = row["id"]
+        # Check if there are bookings referencing this slot
+        cur_books = await db.execute("SELECT id, status FROM bookings WHERE slot_id=?", (slot_id,))
+        bookings = await cur_books.fetchall()
+        has_active = any(rec["status"] in active_statuses for rec in bookings)
+        if row["is_taken"] != 0 or has_active:
+            return -1  # slot is taken or has active booking (cannot remove)
+        if bookings:
+            # Detach cancelled/rejected bookings from the slot but keep cached date/time
+            await db.execute("UPDATE bookings SET slot_id=NULL WHERE slot_id=?", (slot_id,))
+        await db.execute("DELETE FROM slots WHERE id=?", (slot_id,))
+    logger.info(f"Removed slot {date} {time}")
     return 1
 
-async def reserve_slot_and_create_booking(user_id: int, slot_id: int, story: str, participants: str, photo_ids: list, questions: str, num_questions: int, amount: int):
-    """Reserve a slot (if available) and create a booking entry. Returns booking_id or None if slot already taken."""
+async def reserve_slot_and_create_booking(user_id: int, slot_id: int, story: str, participants: str, photo_ids: list, questions: str, num_questions: int, amount: int,
+                                          any_reader: bool = False):
+    """Reserve a slot (if available) and create a booking entry. Returns booking_id or None if slot already taken.
+    With any_reader, a taken slot falls back to another active reader's free slot at the same date and time."""
     try:
-        await db.execute("BEGIN")
-        slot_cur = await db.execute("SELECT date, time FROM slots WHERE id=?", (slot_id,))
-        slot_row = await slot_cur.fetchone()
-        if slot_row is None:
-            await db.execute("ROLLBACK")
-            return None
-        cur = await db.execute("UPDATE slots SET is_taken=1 WHERE id=? AND is_taken=0", (slot_id,))
-        if cur.rowcount == 0:
-            await db.execute("ROLLBACK")
-            return None
-        photos_json = json.dumps(photo_ids) if photo_ids is not None else json.dumps([])
-        await db.execute(
-            "INSERT INTO bookings (user_id, slot_id, story, participants, photos, questions, num_questions, amount, status, admin_message_id, slot_date_cache, slot_time_cache) "
-            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            (user_id, slot_id, story, participants, photos_json, questions, num_questions, amount, config.STATUS_WAITING_PAYMENT, None, slot_row["date"], slot_row["time"])
-        )
-        # Get last inserted booking id
-        cur2 = await db.execute("SELECT last_insert_rowid()")
-        row = await cur2.fetchone()
-        booking_id = row[0] if row else None
-        await db.execute("COMMIT")
-        logging.info(f"Created booking {booking_id} for user {user_id} on slot {slot_id}")
-        return booking_id
+        async with transaction():
+            slot_cur = await db.execute("SELECT date, time, starts_at, reader_id FROM slots WHERE id=?", (slot_id,))
+            slot_row = await slot_cur.fetchone()
+            if slot_row is None:
+                return None
+            reader_id = slot_row["reader_id"]
+            cur = await db.execute("UPDATE slots SET is_taken=1 WHERE id=? AND is_taken=0", (slot_id,))
+            if cur.rowcount == 0:
+                other = None
+                if any_reader:
+                    cur = await db.execute(
+                        "UPDATE slots SET is_taken=1 WHERE id = (SELECT id FROM slots WHERE date=? AND time=? AND is_taken=0 "
+                        f"AND {_ACTIVE_READER} ORDER BY id LIMIT 1) RETURNING id, reader_id",
+                        (slot_row["date"], slot_row["time"]))
+                    other = await cur.fetchone()
+                if other is None:
+                    return None
+                slot_id, reader_id = other["id"], other["reader_id"]
+            photos_json = json.dumps(photo_ids) if photo_ids is not None else json.dumps([])
+            cur = await db.execute(
+                "INSERT INTO bookings (user_id, slot_id, reader_id, story, participants, photos, questions, num_questions, amount, status, admin_message_id, slot_date_cache, slot_time_cache, starts_at, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (user_id, slot_id, reader_id, story, participants, photos_json, questions, num_questions, amount, config.STATUS_WAITING_PAYMENT, None, slot_row["date"], slot_row["time"], slot_row["starts_at"], int(time.time()))
+            )
+            booking_id = cur.lastrowid
+            await _log_event(booking_id, None, config.STATUS_WAITING_PAYMENT, user_id)
+            # The user got a slot: drop their waitlist subscriptions (and any hold they had)
+            await db.execute("DELETE FROM waitlist WHERE user_id=?", (user_id,))
+            await _bump_daily_stats(_today(), created=1)
     except Exception as e:
-        logging.exception(f"Error in reserve_slot_and_create_booking: {e}")
-        try:
-            await db.execute("ROLLBACK")
-        except:
-            pass
+        logger.exception(f"Error in reserve_slot_and_create_booking: {e}", extra={"user_id": user_id, "slot_id": slot_id})
         return None
+    logger.info(f"Created booking {booking_id} for user {user_id} on slot {slot_id}",
+                extra={"booking_id": booking_id, "user_id": user_id, "slot_id": slot_id})
+    return booking_id
 
-async def get_free_dates():
-    """Get a list of dates (YYYY-MM-DD) that have at least one free slot."""
-    today = datetime.now().strftime("%Y-%m-%d")
-    cur = await db.execute("SELECT DISTINCT date FROM slots WHERE is_taken=0 AND date >= ? ORDER BY date", (today,))
+# Slots of readers that are not switched off; free-slot listings for "any reader" merge these
+_ACTIVE_READER = "reader_id IN (SELECT id FROM readers WHERE active=1)"
+
+async def get_free_dates(reader_id: Optional[int] = None):
+    """Get a list of dates (YYYY-MM-DD) that have at least one free slot that has not started yet,
+    of one reader or, with reader_id None, of any active reader."""
+    if reader_id is None:
+        cur = await db.execute(f"SELECT DISTINCT date FROM slots WHERE is_taken=0 AND starts_at > ? AND {_ACTIVE_READER} "
+                               "ORDER BY date", (int(time.time()),))
+    else:
+        cur = await db.execute("SELECT DISTINCT date FROM slots WHERE reader_id=? AND is_taken=0 AND starts_at > ? ORDER BY date",
+                               (reader_id, int(time.time())))
     rows = await cur.fetchall()
     return [row["date"] for row in rows]
 
-async def get_free_times(date: str):
-    """Get list of (slot_id, time) for free slots on a given date."""
-    cur = await db.execute("SELECT id, time FROM slots WHERE date=? AND is_taken=0 ORDER BY time", (date,))
+async def get_free_times(date: str, reader_id: Optional[int] = None):
+    """Get list of (slot_id, time) for free slots on a given date that have not started yet.
+    With reader_id None each time appears once, represented by one of the readers' free slots."""
+    if reader_id is None:
+        cur = await db.execute(f"SELECT min(id) AS id, time FROM slots WHERE date=? AND is_taken=0 AND starts_at > ? "
+                               f"AND {_ACTIVE_READER} GROUP BY time ORDER BY time", (date, int(time.time())))
+    else:
+        cur = await db.execute("SELECT id, time FROM slots WHERE reader_id=? AND date=? AND is_taken=0 AND starts_at > ? ORDER BY time",
+                               (reader_id, date, int(time.time())))
     rows = await cur.fetchall()
     return [(row["id"], row["time"]) for row in rows]
 
 async def get_booking_by_id(booking_id: int):
     """Get a booking record by ID."""
-    cur = await db.execute("SELECT * FROM bookings WHERE id=?", (booking_id,))
+    cur = await db.execute(
+        "SELECT id, user_id, slot_id, status, admin_message_id, slot_date_cache, slot_time_cache "
+        "FROM bookings WHERE id=?", (booking_id,))
+    cur.row_factory = booking_row
+    return await cur.fetchone()
+
+async def get_active_booking_for_slot(slot_id: int):
+    """Get the booking holding a slot (any status except cancelled/rejected), or None."""
+    cur = await db.execute(
+        "SELECT id, user_id, slot_id, status, admin_message_id, slot_date_cache, slot_time_cache "
+        "FROM bookings WHERE slot_id=? AND status NOT IN (?, ?)",
+        (slot_id, config.STATUS_CANCELLED, config.STATUS_REJECTED))
+    cur.row_factory = booking_row
     return await cur.fetchone()
 
 async def get_booking_details(booking_id: int):
@@ -215,48 +503,720 @@ async def get_booking_details(booking_id: int):
                       u.name as user_name, u.username as username, u.phone as phone,
                       COALESCE(s.date, b.slot_date_cache) as date,
                       COALESCE(s.time, b.slot_time_cache) as time,
-                      b.user_id
+                      b.user_id, b.slot_id, b.reader_id, r.name
                FROM bookings b 
                JOIN users u ON b.user_id = u.user_id
                LEFT JOIN slots s ON b.slot_id = s.id
+               LEFT JOIN readers r ON b.reader_id = r.id
                WHERE b.id = ?"""
     cur = await db.execute(query, (booking_id,))
+    cur.row_factory = booking_details_row
     return await cur.fetchone()
 
-async def update_booking_status(booking_id: int, new_status: str):
-    """Update booking status."""
+async def _set_status(booking_id: int, new_status: str, actor: int = None, timed_out: bool = False):
+    """Change a booking's status, log the event and update daily_stats (inside the caller's transaction()).
+    Every status transition goes through here, so the log and aggregates stay in step with bookings."""
+    cur = await db.execute("SELECT status, amount, created_at FROM bookings WHERE id=?", (booking_id,))
+    row = await cur.fetchone()
+    if row is None:
+        return
+    old_status, amount, created_at = row
     await db.execute("UPDATE bookings SET status=? WHERE id=?", (new_status, booking_id))
-    await db.commit()
+    if old_status == new_status:
+        return
+    await _log_event(booking_id, old_status, new_status, actor)
+    now = int(time.time())
+    if new_status == config.STATUS_CHECKING:
+        await _bump_daily_stats(_today(), checking=1)
+    elif new_status == config.STATUS_CONFIRMED:
+        timed = created_at is not None
+        await _bump_daily_stats(_today(), confirmed=1, revenue=amount or 0,
+                                confirm_seconds=now - created_at if timed else 0, confirm_samples=int(timed))
+    elif new_status == config.STATUS_REJECTED:
+        await _bump_daily_stats(_today(), rejected=1)
+    elif new_status == config.STATUS_CANCELLED:
+        await _bump_daily_stats(_today(), cancelled=1, timed_out=int(timed_out))
+
+async def update_booking_status(booking_id: int, new_status: str, actor: int = None, notify: list = ()):
+    """Update booking status; actor is the Telegram id of who made the change (None for the bot).
+    notify: outbox.message()/edit() notifications committed together with the change."""
+    async with transaction():
+        await _set_status(booking_id, new_status, actor)
+        await _enqueue(notify)
+
+async def release_booking(booking_id: int, new_status: str, slot_id: int = None, actor: int = None,
+                          timed_out: bool = False, notify: list = ()):
+    """Set a final status (cancelled/rejected) on a booking and free its slot in one transaction.
+    timed_out marks a cancellation by the payment timeout (counted separately in daily_stats);
+    notify: outbox notifications committed in the same transaction."""
+    async with transaction():
+        await _set_status(booking_id, new_status, actor, timed_out)
+        await _enqueue(notify)
+        if slot_id is not None:
+            await db.execute("UPDATE slots SET is_taken=0 WHERE id=?", (slot_id,))
 
 async def set_booking_admin_message_id(booking_id: int, message_id: int):
     """Store the admin group message ID associated with a booking."""
-    await db.execute("UPDATE bookings SET admin_message_id=? WHERE id=?", (message_id, booking_id))
-    await db.commit()
+    async with transaction():
+        await db.execute("UPDATE bookings SET admin_message_id=? WHERE id=?", (message_id, booking_id))
 
 async def get_user_bookings(user_id: int):
     """Get list of upcoming bookings for a user (excluding cancelled/rejected)."""
-    today = datetime.now().strftime("%Y-%m-%d")
-    query = """SELECT b.id, b.status, s.date, s.time 
-               FROM bookings b JOIN slots s ON b.slot_id = s.id
-               WHERE b.user_id = ? AND b.status NOT IN (?, ?) AND s.date >= ?
-               ORDER BY s.date, s.time"""
-    cur = await db.execute(query, (user_id, config.STATUS_CANCELLED, config.STATUS_REJECTED, today))
+    query = """SELECT id, status, slot_date_cache, slot_time_cache
+               FROM bookings
+               WHERE user_id = ? AND status NOT IN (?, ?) AND starts_at >= ?
+               ORDER BY starts_at"""
+    cur = await db.execute(query, (user_id, config.STATUS_CANCELLED, config.STATUS_REJECTED,
+                                   local_time.day_start(local_time.today())))
+    cur.row_factory = booking_summary_row
     return await cur.fetchall()
 
-async def get_all_slots():
-    """Get all slots (date, time, is_taken) from today onward."""
-    today = datetime.now().strftime("%Y-%m-%d")
-    cur = await db.execute("SELECT date, time, is_taken FROM slots WHERE date >= ? ORDER BY date, time", (today,))
-    return await cur.fetchall()
+_UPCOMING_SLOTS_QUERY = ("SELECT id, date, time, is_taken, reader_id FROM slots WHERE starts_at >= ? "
+                         "ORDER BY starts_at, reader_id")
+
+_ALL_BOOKINGS_QUERY = """SELECT b.id, b.status,
+                      COALESCE(s.date, b.slot_date_cache) AS date,
+                      COALESCE(s.time, b.slot_time_cache) AS time,
+                      u.name as user_name, u.username as username
+               FROM bookings b 
+               JOIN users u ON b.user_id = u.user_id
+               LEFT JOIN slots s ON b.slot_id = s.id
+               ORDER BY b.starts_at, b.id"""
+
+async def _iter_batches(query: str, params: tuple, row_factory, batch_size: int):
+    """Run a query and yield its rows in lists of at most batch_size (bounded memory)."""
+    cur = await db.execute(query, params)
+    cur.row_factory = row_factory
+    try:
+        while True:
+            rows = await cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+    finally:
+        await cur.close()
+
+def iter_all_slots(batch_size: int = 200):
+    """Slots (date, time, is_taken, reader) from today onward, yielded in batches."""
+    return _iter_batches(_UPCOMING_SLOTS_QUERY, (local_time.day_start(local_time.today()),), slot_row, batch_size)
 
 async def get_all_bookings():
     """Get all bookings joined with user info."""
-    query = """SELECT COALESCE(s.date, b.slot_date_cache) AS date,
+    cur = await db.execute(_ALL_BOOKINGS_QUERY)
+    cur.row_factory = booking_summary_row
+    return await cur.fetchall()
+
+def iter_all_bookings(batch_size: int = 200):
+    """Same rows as get_all_bookings, yielded in batches."""
+    return _iter_batches(_ALL_BOOKINGS_QUERY, (), booking_summary_row, batch_size)
+
+def iter_bookings_export(batch_size: int = 500):
+    """Yield all bookings joined with users as lists of plain tuples, batch_size rows at a time.
+    Columns: id, status, date, time, user_id, name, username, phone, num_questions, amount,
+    story, participants, questions."""
+    query = """SELECT b.id, b.status,
+                      COALESCE(s.date, b.slot_date_cache) AS date,
                       COALESCE(s.time, b.slot_time_cache) AS time,
-                      b.status, u.name as user_name, u.username as username
-               FROM bookings b 
+                      b.user_id, u.name, u.username, u.phone,
+                      b.num_questions, b.amount, b.story, b.participants, b.questions
+               FROM bookings b
                JOIN users u ON b.user_id = u.user_id
                LEFT JOIN slots s ON b.slot_id = s.id
-               ORDER BY COALESCE(s.date, b.slot_date_cache), COALESCE(s.time, b.slot_time_cache)"""
-    cur = await db.execute(query)
+               ORDER BY b.id"""
+    return _iter_batches(query, (), None, batch_size)
+
+# ---- Daily aggregates ----
+
+def _today() -> str:
+    return local_time.today_iso()
+
+_DAILY_STATS_UPSERT = """INSERT INTO daily_stats (day, created, checking, confirmed, rejected, cancelled, timed_out,
+                                                 revenue, confirm_seconds, confirm_samples)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(day) DO UPDATE SET
+        created = created + excluded.created,
+        checking = checking + excluded.checking,
+        confirmed = confirmed + excluded.confirmed,
+        rejected = rejected + excluded.rejected,
+        cancelled = cancelled + excluded.cancelled,
+        timed_out = timed_out + excluded.timed_out,
+        revenue = revenue + excluded.revenue,
+        confirm_seconds = confirm_seconds + excluded.confirm_seconds,
+        confirm_samples = confirm_samples + excluded.confirm_samples"""
+
+async def _bump_daily_stats(day: str, created=0, checking=0, confirmed=0, rejected=0, cancelled=0,
+                            timed_out=0, revenue=0, confirm_seconds=0, confirm_samples=0):
+    """Add to one day's counters (inside the caller's transaction())."""
+    await db.execute(_DAILY_STATS_UPSERT, (day, created, checking, confirmed, rejected, cancelled,
+                                           timed_out, revenue, confirm_seconds, confirm_samples))
+
+async def get_daily_stats(date_from: str, date_to: str):
+    """Per-day aggregates for an inclusive YYYY-MM-DD range, oldest first."""
+    cur = await db.execute(
+        "SELECT day, created, checking, confirmed, rejected, cancelled, timed_out, revenue, confirm_seconds, confirm_samples "
+        "FROM daily_stats WHERE day BETWEEN ? AND ? ORDER BY day", (date_from, date_to))
+    cur.row_factory = daily_stats_row
+    return await cur.fetchall()
+
+async def daily_stats_missing() -> bool:
+    """True when there are bookings but no aggregates yet (fresh table on an existing database)."""
+    cur = await db.execute(
+        "SELECT EXISTS(SELECT 1 FROM bookings) AND NOT EXISTS(SELECT 1 FROM daily_stats)")
+    row = await cur.fetchone()
+    return bool(row[0])
+
+async def rebuild_daily_stats(batch_size: int = 1000, archive_path: str = config.ARCHIVE_DB_PATH) -> int:
+    """Backfill daily_stats from bookings in one streaming pass; returns the number of days added.
+
+    Historic rows have no transition times, so each booking is counted on its
+    creation day (the slot date for rows older than created_at) by its final
+    status, and payment timeouts cannot be told apart from cancellations.
+    Only days without a daily_stats row are written: days already counted by
+    _set_status keep their exact transition days, timeouts and confirm times.
+    Bookings moved to the archive database (archive_old_bookings) are read
+    from there too, so their days keep their counts.
+    """
+    query = "SELECT status, amount, created_at, slot_date_cache FROM bookings"
+    attached = False
+    if archive_path and os.path.exists(archive_path):
+        # Own alias: the nightly archiving job attaches the same file as "archive"
+        async with _write_lock:
+            await db.execute("ATTACH DATABASE ? AS stats_archive", (archive_path,))
+        attached = True
+        cur = await db.execute("SELECT 1 FROM stats_archive.sqlite_master WHERE type='table' AND name='bookings'")
+        if await cur.fetchone():
+            query += " UNION ALL SELECT status, amount, created_at, slot_date_cache FROM stats_archive.bookings"
+    try:
+        days, count = await _count_daily_stats(query, batch_size)
+    finally:
+        if attached:
+            async with _write_lock:
+                await db.execute("DETACH DATABASE stats_archive")
+    async with transaction():
+        cur = await db.execute("SELECT day FROM daily_stats")
+        counted = {row[0] for row in await cur.fetchall()}
+        added = [(day, *counters) for day, counters in days.items() if day not in counted]
+        await db.executemany(_DAILY_STATS_UPSERT, added)
+    logger.info(f"Backfilled daily_stats for {len(added)} of {len(days)} days from {count} bookings")
+    return len(added)
+
+async def _count_daily_stats(query: str, batch_size: int):
+    """Per-day counters (in _DAILY_STATS_UPSERT order) of the (status, amount, created_at, date) rows of query."""
+    days = {}
+    count = 0
+    async for rows in _iter_batches(query, (), None, batch_size):
+        for status, amount, created_at, day in rows:
+            if created_at is not None:
+                day = local_time.from_epoch(created_at).date().isoformat()
+            if not day:
+                continue
+            counters = days.get(day)
+            if counters is None:
+                counters = days[day] = [0] * 9
+            counters[0] += 1
+            if status in (config.STATUS_CHECKING, config.STATUS_CONFIRMED, config.STATUS_REJECTED):
+                counters[1] += 1
+            if status == config.STATUS_CONFIRMED:
+                counters[2] += 1
+                counters[6] += amount or 0
+            elif status == config.STATUS_REJECTED:
+                counters[3] += 1
+            elif status == config.STATUS_CANCELLED:
+                counters[4] += 1
+        count += len(rows)
+    return days, count
+
+# ---- Booking event log ----
+
+async def _log_event(booking_id: int, old_status, new_status: str, actor):
+    """Append a status transition to booking_events (inside the caller's transaction())."""
+    await db.execute(
+        "INSERT INTO booking_events (booking_id, old_status, new_status, actor, created_at) VALUES (?, ?, ?, ?, ?)",
+        (booking_id, old_status, new_status, actor, int(time.time())))
+
+async def read_events(after_id: int = 0, limit: int = 100):
+    """Events with id > after_id, oldest first. Pass the last id seen to get the next page."""
+    cur = await db.execute(
+        "SELECT id, booking_id, old_status, new_status, actor, created_at "
+        "FROM booking_events WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit))
+    cur.row_factory = booking_event_row
+    return await cur.fetchall()
+
+async def get_booking_events(booking_id: int):
+    """Full status history of one booking, oldest first."""
+    cur = await db.execute(
+        "SELECT id, booking_id, old_status, new_status, actor, created_at "
+        "FROM booking_events WHERE booking_id=? ORDER BY id", (booking_id,))
+    cur.row_factory = booking_event_row
+    return await cur.fetchall()
+
+async def get_event_offset(consumer: str) -> int:
+    """Last event id committed by a consumer (0 if it has not read anything yet)."""
+    cur = await db.execute("SELECT last_id FROM event_offsets WHERE consumer=?", (consumer,))
+    row = await cur.fetchone()
+    return row[0] if row else 0
+
+async def commit_event_offset(consumer: str, last_id: int):
+    """Remember that a consumer has processed every event up to last_id (never moves backwards)."""
+    async with transaction():
+        await db.execute(
+            "INSERT INTO event_offsets (consumer, last_id) VALUES (?, ?) "
+            "ON CONFLICT(consumer) DO UPDATE SET last_id = max(last_id, excluded.last_id)",
+            (consumer, last_id))
+
+# ---- Retention: archive finished bookings, prune past slots ----
+
+# Columns copied to the archive; the archive table mirrors them plus archived_at
+_ARCHIVE_COLUMNS = ("id, user_id, slot_id, story, participants, photos, questions, num_questions, amount, "
+                    "status, admin_message_id, slot_date_cache, slot_time_cache, starts_at, reader_id, created_at")
+
+_ARCHIVE_BATCH = """SELECT id FROM bookings
+    WHERE status IN (?, ?, ?) AND starts_at < ?
+    ORDER BY id LIMIT ?"""
+
+async def archive_old_bookings(older_than_days: int, archive_path: str, batch_size: int = 500) -> int:
+    """Move finished bookings whose session was more than older_than_days ago to the archive DB.
+
+    Confirmed, cancelled and rejected bookings are copied to `bookings` in the
+    SQLite file at archive_path and deleted here, one batch per transaction so
+    that handlers are never blocked for long. Returns the number of bookings moved.
+    """
+    cutoff = local_time.days_ago_start(older_than_days)
+    params = (config.STATUS_CONFIRMED, config.STATUS_CANCELLED, config.STATUS_REJECTED, cutoff, batch_size)
+    # ATTACH and DETACH fail inside a transaction: run them while no one else can hold one
+    async with _write_lock:
+        await db.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+    try:
+        async with transaction():
+            await db.execute(
+                """CREATE TABLE IF NOT EXISTS archive.bookings (
+                    id            INTEGER PRIMARY KEY,
+                    user_id       INTEGER,
+                    slot_id       INTEGER,
+                    story         TEXT,
+                    participants  TEXT,
+                    photos        TEXT,
+                    questions     TEXT,
+                    num_questions INTEGER,
+                    amount        INTEGER,
+                    status        TEXT,
+                    admin_message_id INTEGER,
+                    slot_date_cache TEXT,
+                    slot_time_cache TEXT,
+                    created_at    INTEGER,
+                    archived_at   INTEGER,
+                    starts_at     INTEGER,
+                    reader_id     INTEGER
+                )""")
+            for column in ("starts_at", "reader_id"):
+                cur = await db.execute("SELECT 1 FROM pragma_table_info('bookings', 'archive') WHERE name=?", (column,))
+                if await cur.fetchone() is None:
+                    await db.execute(f"ALTER TABLE archive.bookings ADD COLUMN {column} INTEGER")
+        moved = 0
+        while True:
+            async with transaction():
+                # Both statements select the same batch: nothing else writes in between
+                cur = await db.execute(
+                    f"INSERT INTO archive.bookings ({_ARCHIVE_COLUMNS}, archived_at) "
+                    f"SELECT {_ARCHIVE_COLUMNS}, ? FROM bookings WHERE id IN ({_ARCHIVE_BATCH})",
+                    (int(time.time()), *params))
+                if cur.rowcount > 0:
+                    await db.execute(f"DELETE FROM bookings WHERE id IN ({_ARCHIVE_BATCH})", params)
+            if cur.rowcount <= 0:
+                break
+            moved += cur.rowcount
+    finally:
+        async with _write_lock:
+            await db.execute("DETACH DATABASE archive")
+    if moved:
+        logger.info(f"Archived {moved} bookings older than {local_time.from_epoch(cutoff):%Y-%m-%d} to {archive_path}")
+    return moved
+
+async def prune_past_slots() -> int:
+    """Delete slots dated before today that no booking refers to any more. Returns the count."""
+    async with transaction():
+        cur = await db.execute(
+            "DELETE FROM slots WHERE starts_at < ? "
+            "AND NOT EXISTS (SELECT 1 FROM bookings WHERE bookings.slot_id = slots.id)",
+            (local_time.day_start(local_time.today()),))
+    if cur.rowcount:
+        logger.info(f"Pruned {cur.rowcount} past slots")
+    return cur.rowcount
+
+async def incremental_vacuum() -> int:
+    """Return free pages to the OS; returns the number of pages released.
+
+    Incremental vacuum needs auto_vacuum=INCREMENTAL, which only takes effect
+    after a full VACUUM: the first call on an old database does that once.
+    """
+    cur = await db.execute("PRAGMA auto_vacuum")
+    mode = (await cur.fetchone())[0]
+    cur = await db.execute("PRAGMA freelist_count")
+    free_pages = (await cur.fetchone())[0]
+    # VACUUM cannot run inside a transaction: hold the lock so no one has one open
+    async with _write_lock:
+        if mode != 2:
+            await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            await db.execute("VACUUM")
+            logger.info("Switched database to auto_vacuum=INCREMENTAL (full VACUUM)")
+            return free_pages
+        if free_pages:
+            cur = await db.execute("PRAGMA incremental_vacuum")
+            await cur.fetchall()  # the pragma frees pages as its rows are stepped through
+    return free_pages
+
+# ---- Session reminders ----
+
+# reminder_stage: 0 - nothing sent, 1 - day-before reminder sent, 2 - hour-before reminder sent (or skipped)
+REMINDER_DAY = 1
+REMINDER_HOUR = 2
+
+_DUE_REMINDERS_QUERY = """SELECT id, user_id, slot_date_cache, slot_time_cache, starts_at, reminder_stage FROM bookings
+    WHERE status = ? AND starts_at BETWEEN ? AND ?
+      AND ((reminder_stage < 1 AND starts_at <= ?) OR (reminder_stage < 2 AND starts_at <= ?))
+    ORDER BY starts_at
+    LIMIT ?"""
+
+async def get_due_reminders(now: int, limit: int):
+    """Confirmed bookings due a reminder: (id, user_id, date, time, starts_at, stage) tuples.
+
+    A booking is due the day-before reminder 24h before its session and the
+    hour-before one 1h before; sessions that started earlier today are returned
+    too, so that the caller can mark them done.
+    """
+    day_ahead = now + 24 * 3600
+    cur = await db.execute(_DUE_REMINDERS_QUERY, (
+        config.STATUS_CONFIRMED, local_time.day_start(local_time.today()), day_ahead,
+        day_ahead, now + 3600, limit))
+    cur.row_factory = None
     return await cur.fetchall()
+
+async def mark_reminders_sent(updates: list):
+    """Store reminder stages for a batch of bookings: [(stage, booking_id), ...], one transaction."""
+    if not updates:
+        return
+    async with transaction():
+        await db.executemany("UPDATE bookings SET reminder_stage=? WHERE id=? AND reminder_stage < ?",
+                             [(stage, booking_id, stage) for stage, booking_id in updates])
+
+# ---- Waitlist ----
+
+async def join_waitlist(user_id: int, dates: list):
+    """Subscribe a user to free-slot notifications for the given YYYY-MM-DD dates.
+    Re-subscribing keeps the user's place in line and makes them eligible for a new offer."""
+    now = int(time.time())
+    async with transaction():
+        await db.executemany(
+            "INSERT INTO waitlist (user_id, date, created_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(user_id, date) DO UPDATE SET notified_at = NULL",
+            [(user_id, day, now) for day in dates])
+
+async def leave_waitlist(user_id: int) -> int:
+    """Remove all of a user's subscriptions; returns how many there were."""
+    async with transaction():
+        cur = await db.execute("DELETE FROM waitlist WHERE user_id=?", (user_id,))
+    return cur.rowcount
+
+async def claim_waitlist_offers(date: str, now: int, hold_seconds: int) -> tuple:
+    """Pick the users to offer free slots on date to and mark them notified, in one transaction.
+
+    Every free slot not covered by an active hold (notified within hold_seconds)
+    goes to the next user in line. Returns (user_ids, holds, oldest hold's
+    notified_at); two processes claiming the same date never pick the same user.
+    """
+    async with transaction():
+        cur = await db.execute(
+            f"SELECT count(*) FROM slots WHERE date=? AND is_taken=0 AND starts_at > ? AND {_ACTIVE_READER}",
+            (date, now))
+        free = (await cur.fetchone())[0]
+        if free == 0:
+            return [], 0, None
+        cur = await db.execute(
+            "SELECT count(*), min(notified_at) FROM waitlist WHERE date=? AND notified_at >= ?",
+            (date, now - hold_seconds))
+        holds, oldest_hold = await cur.fetchone()
+        if free <= holds:
+            return [], holds, oldest_hold
+        cur = await db.execute(
+            "SELECT user_id FROM waitlist WHERE date=? AND notified_at IS NULL ORDER BY id LIMIT ?",
+            (date, free - holds))
+        user_ids = [row[0] for row in await cur.fetchall()]
+        await db.executemany("UPDATE waitlist SET notified_at=? WHERE date=? AND user_id=?",
+                             [(now, date, user_id) for user_id in user_ids])
+    return user_ids, holds, oldest_hold
+
+async def get_waitlist_dates_to_offer() -> list:
+    """Upcoming dates with users still waiting in line and a free slot to offer (waitlist sweep)."""
+    cur = await db.execute(
+        f"""SELECT DISTINCT w.date FROM waitlist w
+            WHERE w.notified_at IS NULL AND w.date >= ?
+              AND EXISTS (SELECT 1 FROM slots s WHERE s.date = w.date AND s.is_taken = 0
+                          AND s.starts_at > ? AND s.{_ACTIVE_READER})
+            ORDER BY w.date""",
+        (local_time.today_iso(), int(time.time())))
+    return [row[0] for row in await cur.fetchall()]
+
+async def prune_waitlist() -> int:
+    """Delete subscriptions for dates that have passed."""
+    async with transaction():
+        cur = await db.execute("DELETE FROM waitlist WHERE date < ?", (local_time.today_iso(),))
+    return cur.rowcount
+
+# ---- Broadcasts ----
+
+_BROADCAST_COLUMNS = ("id, text, created_by, status, total, last_user_id, sent, failed, blocked, "
+                      "status_chat_id, status_message_id")
+
+async def create_broadcast(text: str, created_by: int) -> int:
+    """Store a broadcast draft; it is sent after start_broadcast()."""
+    async with transaction():
+        cur = await db.execute(
+            "INSERT INTO broadcasts (text, created_by, created_at, status) VALUES (?, ?, ?, 'draft')",
+            (text, created_by, int(time.time())))
+    return cur.lastrowid
+
+async def get_broadcast(broadcast_id: int):
+    cur = await db.execute(f"SELECT {_BROADCAST_COLUMNS} FROM broadcasts WHERE id=?", (broadcast_id,))
+    cur.row_factory = broadcast_row
+    return await cur.fetchone()
+
+async def get_running_broadcasts():
+    cur = await db.execute(f"SELECT {_BROADCAST_COLUMNS} FROM broadcasts WHERE status='running' ORDER BY id")
+    cur.row_factory = broadcast_row
+    return await cur.fetchall()
+
+async def start_broadcast(broadcast_id: int, status_chat_id: int, status_message_id: int) -> bool:
+    """Move a draft to running; False if it is not a draft any more (already started or cancelled)."""
+    async with transaction():
+        cur = await db.execute(
+            "UPDATE broadcasts SET status='running', status_chat_id=?, status_message_id=?, "
+            "total=(SELECT count(*) FROM users WHERE blocked_at IS NULL) WHERE id=? AND status='draft'",
+            (status_chat_id, status_message_id, broadcast_id))
+    return cur.rowcount == 1
+
+async def set_broadcast_status(broadcast_id: int, status: str):
+    async with transaction():
+        await db.execute("UPDATE broadcasts SET status=? WHERE id=?", (status, broadcast_id))
+
+async def delete_broadcast_draft(broadcast_id: int) -> bool:
+    async with transaction():
+        cur = await db.execute("DELETE FROM broadcasts WHERE id=? AND status='draft'", (broadcast_id,))
+    return cur.rowcount == 1
+
+async def next_broadcast_recipients(after_user_id: int, limit: int) -> list:
+    """Next user ids after the cursor, skipping users who blocked the bot (keyset paging on the primary key)."""
+    cur = await db.execute(
+        "SELECT user_id FROM users WHERE user_id > ? AND blocked_at IS NULL ORDER BY user_id LIMIT ?",
+        (after_user_id, limit))
+    return [row[0] for row in await cur.fetchall()]
+
+async def save_broadcast_progress(broadcast_id: int, last_user_id: int, sent: int, failed: int, blocked_ids: list):
+    """Advance the cursor, add to the counters and flag blocked users, in one transaction."""
+    now = int(time.time())
+    async with transaction():
+        await db.executemany("UPDATE users SET blocked_at=? WHERE user_id=?", [(now, user_id) for user_id in blocked_ids])
+        await db.execute(
+            "UPDATE broadcasts SET last_user_id=?, sent=sent+?, failed=failed+?, blocked=blocked+? WHERE id=?",
+            (last_user_id, sent, failed, len(blocked_ids), broadcast_id))
+
+async def get_broadcast_status(broadcast_id: int):
+    cur = await db.execute("SELECT status FROM broadcasts WHERE id=?", (broadcast_id,))
+    row = await cur.fetchone()
+    return row[0] if row else None
+
+async def stop_broadcast(broadcast_id: int) -> bool:
+    """Mark a running broadcast stopped; the instance sending it notices before its next page."""
+    async with transaction():
+        cur = await db.execute("UPDATE broadcasts SET status='stopped' WHERE id=? AND status='running'", (broadcast_id,))
+    return cur.rowcount == 1
+
+# ---- Payment timeouts ----
+
+async def get_expired_unpaid_bookings(created_before: int) -> list:
+    """Ids of bookings still waiting for payment that were created before the given unix time.
+    Bookings made before created_at was recorded have no creation time and count as expired."""
+    cur = await db.execute(
+        "SELECT id FROM bookings WHERE status=? AND (created_at <= ? OR created_at IS NULL) ORDER BY id",
+        (config.STATUS_WAITING_PAYMENT, created_before))
+    return [row[0] for row in await cur.fetchall()]
+
+# ---- Leases ----
+
+async def acquire_lease(name: str, holder: str, now: float, expires_at: float) -> bool:
+    """Take or renew a lease; True if `holder` owns it until expires_at.
+    It can only be taken over from another holder once that holder's lease has expired."""
+    async with transaction():
+        cur = await db.execute(
+            "INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET holder=excluded.holder, expires_at=excluded.expires_at "
+            "WHERE leases.holder = excluded.holder OR leases.expires_at < ?",
+            (name, holder, expires_at, now))
+    return cur.rowcount == 1
+
+async def release_lease(name: str, holder: str):
+    async with transaction():
+        await db.execute("DELETE FROM leases WHERE name=? AND holder=?", (name, holder))
+
+# ---- Full-text search (admin /find) ----
+
+# One FTS5 row per booking (rowid = booking id) with its client's name, username
+# and phone next to the booking texts. Triggers keep it in step with bookings
+# and users, so archived and deleted bookings leave the index with their row.
+# unicode61 does not fold "ё" into "е", so the indexed text and queries are folded here.
+
+def _yo(expr: str) -> str:
+    return f"replace(replace({expr}, 'ё', 'е'), 'Ё', 'Е')"
+
+_SEARCH_COLUMNS = "rowid, name, username, phone, story, participants, questions"
+
+def _search_values(booking: str, user: str) -> str:
+    """SELECT list of one booking_search row from booking and user column prefixes."""
+    return (f"{booking}id, {_yo(user + 'name')}, {_yo(user + 'username')}, {user}phone, {_yo(booking + 'story')}, "
+            f"{_yo(booking + 'participants')}, {_yo(booking + 'questions')}")
+
+# Recreated on every start (see _setup_search), so changes here reach existing databases
+_SEARCH_TRIGGERS = {
+    "booking_search_insert": f"""CREATE TRIGGER booking_search_insert AFTER INSERT ON bookings BEGIN
+        INSERT INTO booking_search ({_SEARCH_COLUMNS})
+        SELECT {_search_values("new.", "")} FROM users WHERE user_id = new.user_id;
+    END""",
+    "booking_search_update": f"""CREATE TRIGGER booking_search_update AFTER UPDATE OF story, participants, questions, user_id
+        ON bookings BEGIN
+        DELETE FROM booking_search WHERE rowid = old.id;
+        INSERT INTO booking_search ({_SEARCH_COLUMNS})
+        SELECT {_search_values("new.", "")} FROM users WHERE user_id = new.user_id;
+    END""",
+    "booking_search_delete": """CREATE TRIGGER booking_search_delete AFTER DELETE ON bookings BEGIN
+        DELETE FROM booking_search WHERE rowid = old.id;
+    END""",
+    # get_or_create_user rewrites name/username on every /start: only real changes touch the index
+    "booking_search_user": f"""CREATE TRIGGER booking_search_user AFTER UPDATE OF name, username, phone ON users
+        WHEN old.name IS NOT new.name OR old.username IS NOT new.username OR old.phone IS NOT new.phone BEGIN
+        UPDATE booking_search SET name = {_yo("new.name")}, username = {_yo("new.username")}, phone = new.phone
+        WHERE rowid IN (SELECT id FROM bookings WHERE user_id = new.user_id);
+    END""",
+}
+
+async def _setup_search():
+    """Create the booking_search index and its triggers; fill it once for existing bookings."""
+    global SEARCH_AVAILABLE
+    try:
+        await db.execute(
+            """CREATE VIRTUAL TABLE IF NOT EXISTS booking_search USING fts5(
+                    name, username, phone, story, participants, questions,
+                    tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')""")
+    except aiosqlite.OperationalError as e:
+        logger.warning(f"Full-text search disabled, SQLite has no FTS5: {e}")
+        return
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_user_id ON bookings(user_id)")
+    for name, trigger in _SEARCH_TRIGGERS.items():
+        await db.execute(f"DROP TRIGGER IF EXISTS {name}")
+        await db.execute(trigger)
+    # Usernames were indexed unfolded before: fold the few that contain "ё"
+    await db.execute(
+        f"UPDATE booking_search SET username = {_yo('username')} WHERE rowid IN "
+        "(SELECT b.id FROM users u JOIN bookings b ON b.user_id = u.user_id WHERE u.username GLOB '*[ёЁ]*')")
+    cur = await db.execute(
+        "SELECT EXISTS(SELECT 1 FROM bookings) AND NOT EXISTS(SELECT 1 FROM booking_search)")
+    if (await cur.fetchone())[0]:
+        cur = await db.execute(
+            f"INSERT INTO booking_search ({_SEARCH_COLUMNS}) SELECT {_search_values('b.', 'u.')} "
+            "FROM bookings b JOIN users u ON u.user_id = b.user_id")
+        logger.info(f"Indexed {cur.rowcount} bookings for full-text search")
+    SEARCH_AVAILABLE = True
+
+def search_query(text: str) -> str:
+    """FTS5 MATCH expression for free text: every word must occur, as a word prefix."""
+    text = text.replace("ё", "е").replace("Ё", "Е")
+    words = "".join(ch if ch.isalnum() else " " for ch in text).split()
+    return " ".join(f'"{word}"*' for word in words)
+
+# Matched text in snippets is wrapped in these markers (escaped to HTML by the caller)
+SNIPPET_START, SNIPPET_END = "\x02", "\x03"
+
+# Ranked and cut to one page inside the index; only that page is joined with bookings and users
+_SEARCH_QUERY = """SELECT b.id, b.status, b.slot_date_cache, b.slot_time_cache, u.name, u.username
+    FROM (SELECT rowid, bm25(booking_search, 5.0, 5.0, 5.0, 1.0, 1.0, 1.0) AS score
+          FROM booking_search WHERE booking_search MATCH ?
+          ORDER BY score LIMIT ? OFFSET ?) AS m
+    JOIN bookings b ON b.id = m.rowid
+    JOIN users u ON u.user_id = b.user_id
+    ORDER BY m.score"""
+
+# Snippets for the page only: inside the ranking query they would be built for every match
+_SNIPPETS_QUERY = f"""SELECT rowid, snippet(booking_search, -1, '{SNIPPET_START}', '{SNIPPET_END}', '…', 10)
+    FROM booking_search WHERE booking_search MATCH ? AND rowid IN (SELECT value FROM json_each(?))"""
+
+async def search_bookings(text: str, limit: int, offset: int = 0):
+    """Bookings matching free text, best first: (total, [(BookingSummary, snippet), ...]).
+    Client name, username and phone weigh more than the booking texts."""
+    query = search_query(text)
+    if not query:
+        return 0, []
+    cur = await db.execute("SELECT count(*) FROM booking_search WHERE booking_search MATCH ?", (query,))
+    total = (await cur.fetchone())[0]
+    if not total:
+        return 0, []
+    cur = await db.execute(_SEARCH_QUERY, (query, limit, offset))
+    cur.row_factory = booking_summary_row
+    records = await cur.fetchall()
+    cur = await db.execute(_SNIPPETS_QUERY, (query, json.dumps([record.id for record in records])))
+    snippets = dict(await cur.fetchall())
+    return total, [(record, snippets.get(record.id, "")) for record in records]
+
+# ---- Processed updates ----
+
+async def mark_updates_processed(keys: list, now: int):
+    """Record a batch of handled update keys (see dedup.py)."""
+    async with transaction():
+        await db.executemany("INSERT OR IGNORE INTO processed_updates (key, seen_at) VALUES (?, ?)",
+                             [(key, now) for key in keys])
+
+async def recent_processed_updates(limit: int) -> list:
+    """Newest recorded update keys, oldest first."""
+    cur = await db.execute(
+        "SELECT key FROM (SELECT key, seen_at FROM processed_updates ORDER BY seen_at DESC LIMIT ?) ORDER BY seen_at",
+        (limit,))
+    return [row[0] for row in await cur.fetchall()]
+
+async def prune_processed_updates(before: int) -> int:
+    async with transaction():
+        cur = await db.execute("DELETE FROM processed_updates WHERE seen_at < ?", (before,))
+    return cur.rowcount
+
+# ---- Outbox ----
+
+async def _enqueue(notifications):
+    """Add (chat_id, edit_message_id, text) notifications to the outbox (inside the caller's transaction()).
+    Empty entries (e.g. no admin group configured) are skipped."""
+    rows = [item for item in notifications if item]
+    if not rows:
+        return
+    now = time.time()
+    await db.executemany(
+        "INSERT INTO outbox (chat_id, edit_message_id, text, next_attempt_at, created_at) VALUES (?, ?, ?, ?, ?)",
+        [(chat_id, message_id, text, now, int(now)) for chat_id, message_id, text in rows])
+
+async def get_due_outbox(now: float, limit: int):
+    """Pending notifications whose next attempt is due, oldest first."""
+    cur = await db.execute(
+        "SELECT id, chat_id, edit_message_id, text, attempts FROM outbox "
+        "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY id LIMIT ?", (now, limit))
+    cur.row_factory = outbox_row
+    return await cur.fetchall()
+
+async def finish_outbox(sent_ids: list, dead_ids: list, retries: list):
+    """Record a delivery batch in one transaction.
+    retries are (id, next_attempt_at, attempted) with attempted 0 for rows postponed without a try."""
+    async with transaction():
+        await db.executemany("UPDATE outbox SET status='sent', attempts=attempts+1 WHERE id=?", [(i,) for i in sent_ids])
+        await db.executemany("UPDATE outbox SET status='dead', attempts=attempts+1 WHERE id=?", [(i,) for i in dead_ids])
+        await db.executemany("UPDATE outbox SET attempts=attempts+?, next_attempt_at=? WHERE id=?",
+                             [(attempted, next_at, i) for i, next_at, attempted in retries])
+
+async def prune_outbox(older_than_days: int = 7) -> int:
+    """Delete delivered and dead notifications older than the given number of days."""
+    async with transaction():
+        cur = await db.execute("DELETE FROM outbox WHERE status != 'pending' AND created_at < ?",
+                               (int(time.time()) - older_than_days * 86400,))
+    return cur.rowcount
@@ -0,0 +1,202 @@
+import logging
+import re
+import time
+from functools import lru_cache
+
+import aiosqlite
+
+import config
+
+logger = logging.getLogger(__name__)
+
+_COMMENT_RE = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST_RE = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_SPACE_RE = re.compile(r"\s+")
+
+# Statements that have a query plan worth explaining
+_EXPLAINABLE = {"SELECT", "UPDATE", "DELETE", "INSERT", "REPLACE", "WITH"}
+# Statements whose cursor.rowcount is not a count of affected rows
+_READS = {"SELECT", "WITH", "PRAGMA", "EXPLAIN"}
+
+
+@lru_cache(maxsize=512)
+def fingerprint(sql: str) -> str:
+    """Normalize SQL so that calls differing only in literals share one entry."""
+    text = _COMMENT_RE.sub(" ", sql)
+    text = _STRING_RE.sub("?", text)
+    text = _NUMBER_RE.sub("?", text)
+    text = _IN_LIST_RE.sub("(...)", text)
+    return _SPACE_RE.sub(" ", text).strip()
+
+
+@lru_cache(maxsize=512)
+def _verb(sql: str) -> str:
+    """Leading SQL keyword, upper-cased ("SELECT", "UPDATE", ...)."""
+    parts = sql.split(None, 1)
+    return parts[0].upper() if parts else ""
+
+
+class QueryStats:
+    """Aggregated counters for one SQL fingerprint."""
+    __slots__ = ("calls", "total_time", "max_time", "rows", "plan")
+
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.rows = 0
+        self.plan = None
+
+
+class QueryProfiler:
+    """Collects per-fingerprint statistics and logs slow queries with their plan."""
+
+    def __init__(self, slow_threshold_ms: float):
+        self.slow_threshold = slow_threshold_ms / 1000
+        self.stats = {}
+
+    def _entry(self, sql: str) -> QueryStats:
+        key = fingerprint(sql)
+        entry = self.stats.get(key)
+        if entry is None:
+            entry = self.stats[key] = QueryStats()
+        return entry
+
+    def total_calls(self) -> int:
+        return sum(entry.calls for entry in self.stats.values())
+
+    def reset(self):
+        self.stats.clear()
+
+    def top(self, limit: int = 10):
+        """Return (fingerprint, stats) pairs ordered by cumulative time."""
+        return sorted(self.stats.items(), key=lambda item: item[1].total_time, reverse=True)[:limit]
+
+
+profiler = QueryProfiler(config.SLOW_QUERY_MS)
+
+
+class ProfiledCursor:
+    """Cursor proxy that adds fetch time and fetched rows to the query's stats."""
+
+    def __init__(self, cursor: aiosqlite.Cursor, connection: "ProfiledConnection", sql: str, parameters, entry: QueryStats):
+        self._cursor = cursor
+        self._connection = connection
+        self._sql = sql
+        self._parameters = parameters
+        self._entry = entry
+
+    @property
+    def row_factory(self):
+        return self._cursor.row_factory
+
+    @row_factory.setter
+    def row_factory(self, factory):
+        self._cursor.row_factory = factory
+
+    async def _timed_fetch(self, fetch, *args):
+        started = time.perf_counter()
+        result = await fetch(*args)
+        elapsed = time.perf_counter() - started
+        self._entry.total_time += elapsed
+        if isinstance(result, list):
+            self._entry.rows += len(result)
+        elif result is not None:
+            self._entry.rows += 1
+        await self._connection._check_slow(self._sql, self._parameters, self._entry, elapsed)
+        return result
+
+    async def fetchone(self):
+        return await self._timed_fetch(self._cursor.fetchone)
+
+    async def fetchall(self):
+        return await self._timed_fetch(self._cursor.fetchall)
+
+    async def fetchmany(self, size=None):
+        if size is None:
+            return await self._timed_fetch(self._cursor.fetchmany)
+        return await self._timed_fetch(self._cursor.fetchmany, size)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        while True:
+            rows = await self.fetchmany(self._cursor.arraysize)
+            if not rows:
+                return
+            for row in rows:
+                yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class ProfiledConnection:
+    """Drop-in wrapper around aiosqlite.Connection that profiles every statement."""
+
+    def __init__(self, connection: aiosqlite.Connection, query_profiler: QueryProfiler = profiler):
+        self._connection = connection
+        self._profiler = query_profiler
+
+    @property
+    def row_factory(self):
+        return self._connection.row_factory
+
+    @row_factory.setter
+    def row_factory(self, factory):
+        self._connection.row_factory = factory
+
+    async def execute(self, sql: str, parameters=None) -> ProfiledCursor:
+        entry = self._profiler._entry(sql)
+        started = time.perf_counter()
+        if parameters is None:
+            cursor = await self._connection.execute(sql)
+        else:
+            cursor = await self._connection.execute(sql, parameters)
+        elapsed = time.perf_counter() - started
+        entry.calls += 1
+        entry.total_time += elapsed
+        if _verb(sql) not in _READS and cursor.rowcount > 0:
+            entry.rows += cursor.rowcount
+        await self._check_slow(sql, parameters, entry, elapsed)
+        return ProfiledCursor(cursor, self, sql, parameters, entry)
+
+    async def executemany(self, sql: str, parameters) -> aiosqlite.Cursor:
+        entry = self._profiler._entry(sql)
+        started = time.perf_counter()
+        cursor = await self._connection.executemany(sql, parameters)
+        elapsed = time.perf_counter() - started
+        entry.calls += 1
+        entry.total_time += elapsed
+        if cursor.rowcount > 0:
+            entry.rows += cursor.rowcount
+        return cursor
+
+    async def commit(self):
+        entry = self._profiler._entry("COMMIT")
+        started = time.perf_counter()
+        await self._connection.commit()
+        elapsed = time.perf_counter() - started
+        entry.calls += 1
+        entry.total_time += elapsed
+        await self._check_slow("COMMIT", None, entry, elapsed)
+
+    async def _check_slow(self, sql: str, parameters, entry: QueryStats, elapsed: float):
+        """Log a slow statement; its plan is captured once per fingerprint."""
+        if elapsed > entry.max_time:
+            entry.max_time = elapsed
+        if elapsed < self._profiler.slow_threshold:
+            return
+        if entry.plan is None and _verb(sql) in _EXPLAINABLE:
+            try:
+                cur = await self._connection.execute(f"EXPLAIN QUERY PLAN {sql}", parameters or ())
+                entry.plan = [row[-1] for row in await cur.fetchall()]
+            except Exception as e:
+                entry.plan = [f"(EXPLAIN failed: {e})"]
+        logger.warning(f"Slow query {elapsed * 1000:.1f} ms: {fingerprint(sql)} | plan: {'; '.join(entry.plan or [])}")
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
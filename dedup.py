@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+import config
+import database
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDeduplicator(BaseMiddleware):
+    """Outer update middleware that drops updates which were already handled.
+
+    After a crash, polling can deliver the last batch of updates again (the offset
+    is only confirmed by the next getUpdates call). Every update's id, and the id of
+    its callback query, is remembered before any handler runs, so a redelivered
+    update is skipped even after a restart.
+
+    The newest `capacity` keys are kept in a set (with a deque giving them a ring
+    order): a repeated update is recognised with one set lookup. New keys are
+    written to the processed_updates table in one batch every `flush_interval`
+    seconds rather than per update, and the ring is loaded from it at startup.
+    Updates handled in the last `flush_interval` before a crash can therefore
+    still be redelivered once.
+    """
+
+    def __init__(self, capacity: int = config.DEDUP_MEMORY, flush_interval: float = config.DEDUP_FLUSH_SECONDS):
+        self.capacity = capacity
+        self.flush_interval = flush_interval
+        self._seen = set()
+        self._order = deque()
+        self._pending = []  # keys not written to the database yet
+        self._task = None
+
+    async def load(self):
+        """Fill the in-memory ring from the database (call after database.init_db)."""
+        for key in await database.recent_processed_updates(self.capacity):
+            self._remember(key)
+
+    def start(self):
+        """Start writing remembered keys to the database periodically (call from the running loop)."""
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the periodic writer and write what is still pending."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def flush(self):
+        if not self._pending:
+            return
+        keys, self._pending = self._pending, []
+        try:
+            await database.mark_updates_processed(keys, int(time.time()))
+        except Exception:
+            logger.exception(f"Failed to record {len(keys)} processed update keys")
+            self._pending[:0] = keys
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def _remember(self, key: str):
+        if len(self._order) >= self.capacity:
+            self._seen.discard(self._order.popleft())
+        self._order.append(key)
+        self._seen.add(key)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        keys = [f"u{event.update_id}"]
+        if event.callback_query is not None:
+            keys.append(f"c{event.callback_query.id}")
+        seen = self._seen
+        if any(key in seen for key in keys):
+            logger.info(f"Skipping duplicate update {event.update_id}")
+            return None
+        for key in keys:
+            self._remember(key)
+        self._pending.extend(keys)
+        return await handler(event, data)
+
+
+deduplicator = UpdateDeduplicator()
@@ -0,0 +1,93 @@
+import asyncio
+import csv
+import logging
+import os
+import tempfile
+
+import database
+from formatting import status_label
+
+try:
+    import openpyxl
+except ImportError:  # XLSX export is optional
+    openpyxl = None
+
+logger = logging.getLogger(__name__)
+
+# Bookings are read from the database in batches and each batch is written to a
+# temp file in a worker thread, so memory use does not depend on history size
+# and the event loop never blocks on disk I/O.
+
+BATCH_SIZE = 500
+FORMATS = ("csv", "xlsx")
+XLSX_AVAILABLE = openpyxl is not None
+
+HEADER = ("ID", "Статус", "Статус (код)", "Дата", "Время", "ID клиента", "Имя", "Username",
+          "Телефон", "Вопросов", "Сумма", "История", "Участники", "Вопросы")
+
+
+def _export_row(row: tuple) -> tuple:
+    booking_id, status, *rest = row
+    return (booking_id, status_label(status), status, *rest)
+
+
+class _CsvWriter:
+    def __init__(self, path: str):
+        # utf-8-sig so that Excel detects the encoding of Cyrillic text
+        self._file = open(path, "w", newline="", encoding="utf-8-sig")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(HEADER)
+
+    def write(self, rows: list):
+        self._writer.writerows(_export_row(row) for row in rows)
+
+    def close(self):
+        self._file.close()
+
+
+class _XlsxWriter:
+    def __init__(self, path: str):
+        # write_only mode streams rows instead of keeping the sheet in memory
+        self._path = path
+        self._book = openpyxl.Workbook(write_only=True)
+        self._sheet = self._book.create_sheet("Записи")
+        self._sheet.append(HEADER)
+
+    def write(self, rows: list):
+        for row in rows:
+            self._sheet.append(_export_row(row))
+
+    def close(self):
+        self._book.save(self._path)
+
+
+async def export_bookings(fmt: str = "csv") -> tuple:
+    """Write all bookings to a temp file; return (path, row count). The caller deletes the file."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if fmt == "xlsx" and not XLSX_AVAILABLE:
+        raise RuntimeError("openpyxl is not installed")
+    fd, path = tempfile.mkstemp(prefix="bookings_", suffix=f".{fmt}")
+    os.close(fd)
+    writer_cls = _XlsxWriter if fmt == "xlsx" else _CsvWriter
+    count = 0
+    try:
+        writer = await asyncio.to_thread(writer_cls, path)
+        try:
+            async for rows in database.iter_bookings_export(BATCH_SIZE):
+                await asyncio.to_thread(writer.write, rows)
+                count += len(rows)
+        finally:
+            await asyncio.to_thread(writer.close)
+    except BaseException:
+        await asyncio.to_thread(remove_export, path)
+        raise
+    logger.info(f"Exported {count} bookings to {fmt}")
+    return path, count
+
+
+def remove_export(path: str):
+    try:
+        os.remove(path)
+    except OSError as e:
+        logger.warning(f"Failed to remove export file {path}: {e}")
@@ -0,0 +1,20 @@
+from typing import Optional
+
+from aiogram.filters import BaseFilter
+from aiogram.types import Chat, TelegramObject, User
+
+import config
+
+
+class IsAdmin(BaseFilter):
+    """Passes updates sent by a bot admin (config.ADMIN_ID_SET, reloadable at runtime)."""
+
+    async def __call__(self, event: TelegramObject, event_from_user: Optional[User] = None) -> bool:
+        return event_from_user is not None and event_from_user.id in config.ADMIN_ID_SET
+
+
+class InAdminGroup(BaseFilter):
+    """Passes updates from the admin notification group (config.ADMIN_GROUP_ID)."""
+
+    async def __call__(self, event: TelegramObject, event_chat: Optional[Chat] = None) -> bool:
+        return event_chat is not None and config.ADMIN_GROUP_ID is not None and event_chat.id == config.ADMIN_GROUP_ID
@@ -0,0 +1,91 @@
+import html
+from datetime import date
+from enum import Enum
+from functools import lru_cache
+from typing import Iterable, Optional, Union
+
+import config
+
+# Display helpers shared by the booking lists in user and admin handlers.
+
+
+class BookingStatus(str, Enum):
+    """Booking statuses; members compare equal to the raw DB strings."""
+    CREATED = config.STATUS_CREATED
+    WAITING_PAYMENT = config.STATUS_WAITING_PAYMENT
+    CHECKING = config.STATUS_CHECKING
+    CONFIRMED = config.STATUS_CONFIRMED
+    REJECTED = config.STATUS_REJECTED
+    CANCELLED = config.STATUS_CANCELLED
+
+
+# Keyed by the raw status strings stored in the DB, so rows need no conversion
+STATUS_LABELS = {
+    BookingStatus.CREATED.value: "Создана",
+    BookingStatus.WAITING_PAYMENT.value: "Ожидает оплаты",
+    BookingStatus.CHECKING.value: "На подтверждении",
+    BookingStatus.CONFIRMED.value: "Подтверждена",
+    BookingStatus.REJECTED.value: "Отклонена",
+    BookingStatus.CANCELLED.value: "Отменена",
+}
+
+# Client-facing variant: a confirmed booking can only be cancelled by an admin
+CLIENT_STATUS_LABELS = {
+    **STATUS_LABELS,
+    BookingStatus.CONFIRMED.value: "Подтверждена (отменить можно через администратора)",
+}
+
+NO_DATE = "Дата не указана"
+NO_TIME = "Время не указано"
+
+
+def status_label(status: str, labels: dict = STATUS_LABELS) -> str:
+    """Russian label for a status; unknown statuses are shown as is."""
+    return labels.get(status, status)
+
+
+@lru_cache(maxsize=4096)
+def display_date(value: Union[date, str, None], default: str = "") -> str:
+    """DD.MM.YYYY for a date or an ISO string; `default` if empty, the raw value if unparseable."""
+    if not value:
+        return default
+    if isinstance(value, str):
+        try:
+            value = date.fromisoformat(value)
+        except ValueError:
+            return value
+    return value.strftime("%d.%m.%Y")
+
+
+def format_duration(seconds: float) -> str:
+    """Short Russian duration: "45 сек", "12 мин", "3 ч 5 мин", "2 дн 4 ч"."""
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds} сек"
+    minutes = seconds // 60
+    if minutes < 60:
+        return f"{minutes} мин"
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f"{hours} ч {minutes} мин" if minutes else f"{hours} ч"
+    days, hours = divmod(hours, 24)
+    return f"{days} дн {hours} ч" if hours else f"{days} дн"
+
+
+def format_booking_rows(records: Iterable, *, with_user: bool = False, with_id: bool = False,
+                        labels: Optional[dict] = None) -> list:
+    """Render a page of BookingSummary rows as "- [#id] date time — [user —] status" lines."""
+    labels = labels or STATUS_LABELS
+    day = display_date
+    if with_id:
+        records = list(records)
+        return [f"- #{r.id} {line[2:]}"
+                for r, line in zip(records, format_booking_rows(records, with_user=with_user, labels=labels))]
+    if with_user:
+        escape = html.escape
+        return [
+            f"- {day(r.date, NO_DATE)} {r.time or NO_TIME} — {escape(r.user_name or '')} "
+            f"(@{escape(r.username or '')}) — {status_label(r.status, labels)}"
+            for r in records
+        ]
+    return [f"- {day(r.date, NO_DATE)} {r.time or NO_TIME} — {status_label(r.status, labels)}" for r in records]
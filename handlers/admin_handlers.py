@@ -1,32 +1,55 @@
+import asyncio
+import html
+import itertools
 import logging
+from collections import OrderedDict
 from datetime import datetime, timedelta
 
-from aiogram import Router
-from aiogram import F
-from aiogram.types import Message, CallbackQuery
+from aiogram import Router, F
+from aiogram.types import Message, CallbackQuery, BufferedInputFile, FSInputFile
 import admin_keyboard as keyboards
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
 
+import broadcast
+import callback_data as cb
 import config
 import database
+import db_profiler
+import export
+import leader
+import local_time
+import loop_monitor
+import outbox
+import message_chunker
+from filters import IsAdmin
+from formatting import display_date, format_booking_rows, format_duration, status_label
+from routing import CallbackRoutes, TextRoutes
+from scheduler import wake_waitlist
 from states import AdminState
 
+logger = logging.getLogger(__name__)
+
 router = Router()
+# Everything in this router is admin-only: other users' updates are rejected
+# by one set lookup before any handler filter runs.
+router.message.filter(IsAdmin())
+router.callback_query.filter(IsAdmin())
+
+# Admin buttons and commands are dict-routed (see routing.py)
+callbacks = CallbackRoutes()
+callbacks.attach(router.callback_query)
+commands = TextRoutes()
+commands.attach(router.message)
 
 # Admin main menu handler
-@router.message(F.text == "/admin")
+@commands("/admin")
 async def admin_menu_cmd(message: Message):
-    if not is_admin(message.from_user.id):
-        return
     await message.answer("Админ-панель:", reply_markup=keyboards.admin_main_ilkb)
 
 # Callback handler to return to admin main menu
-@router.callback_query(F.data == "admin|menu")
+@callbacks(cb.AdminMenu, action="menu")
 async def admin_menu_cb(callback: CallbackQuery):
-    if not is_admin(callback.from_user.id):
-        await callback.answer()
-        return
     await callback.message.edit_text("Админ-панель:")
     await callback.message.edit_reply_markup(reply_markup=keyboards.admin_main_ilkb)
     await callback.answer()
@@ -35,17 +58,12 @@ async def admin_menu_cb(callback: CallbackQuery):
 
 def _dates_for_page(offset_weeks: int):
     """Return list of 7 ISO dates starting today + offset_weeks*7."""
-    start = datetime.now() + timedelta(days=offset_weeks * 7)
-    return [(start + timedelta(days=i)).strftime("%Y-%m-%d") for i in range(7)]
+    start = local_time.today() + timedelta(days=offset_weeks * 7)
+    return [(start + timedelta(days=i)).isoformat() for i in range(7)]
 
-@router.callback_query(F.data.startswith("admin|schedule|"))
-async def admin_schedule_open(callback: CallbackQuery):
-    if not is_admin(callback.from_user.id):
-        await callback.answer(); return
-    try:
-        offset = int(callback.data.split("|")[2])
-    except Exception:
-        offset = 0
+@callbacks(cb.AdminMenu, action="schedule")
+async def admin_schedule_open(callback: CallbackQuery, callback_data: cb.AdminMenu):
+    offset = callback_data.page or 0
     dates = _dates_for_page(offset)
     dates_kb = keyboards.build_dates_ilkb(dates)
     nav_kb = keyboards.build_nav_row_for_dates(offset)
@@ -57,9 +75,8 @@ async def admin_schedule_open(callback: CallbackQuery):
 
 # Helper function to show the date screen (extracted from admin_pick_date)
 async def show_date_screen(callback: CallbackQuery, date_iso: str):
-    cur = await database.db.execute("SELECT time, is_taken FROM slots WHERE date=? ORDER BY time", (date_iso,))
-    rows = await cur.fetchall()
-    times = [(r["time"], r["is_taken"]) for r in rows]
+    slots = await database.get_slots_for_date(date_iso)
+    times = [(slot.time, slot.is_taken) for slot in slots]
 
     manage_kb = keyboards.build_times_manage_ilkb(date_iso, times)
 
@@ -78,11 +95,11 @@ async def show_date_screen(callback: CallbackQuery, date_iso: str):
     inline_keyboard = manage_kb.inline_keyboard[:]
     if add_row_kb:
         inline_keyboard += add_row_kb.inline_keyboard
-    inline_keyboard += [[InlineKeyboardButton(text="⬅️ К датам", callback_data="admin|schedule|0")]]
+    inline_keyboard += [[InlineKeyboardButton(text="⬅️ К датам", callback_data=cb.AdminMenu(action="schedule", page=0).pack())]]
     inline_keyboard += keyboards.admin_back_menu_ilkb().inline_keyboard
     final_kb = InlineKeyboardMarkup(inline_keyboard=inline_keyboard)
 
-    human_date = datetime.strptime(date_iso, "%Y-%m-%d").strftime("%d.%m.%Y")
+    human_date = display_date(date_iso)
     lines = [f"Дата: <b>{human_date}</b>", "Текущие слоты:"]
     if times:
         for t, taken in times:
@@ -95,28 +112,24 @@ async def show_date_screen(callback: CallbackQuery, date_iso: str):
     await callback.message.edit_reply_markup(reply_markup=final_kb)
 
 
-@router.callback_query(F.data.startswith("sched_date|"))
-async def admin_pick_date(callback: CallbackQuery):
-    if not is_admin(callback.from_user.id):
-        await callback.answer(); return
-    date_iso = callback.data.split("|", 1)[1]
+@callbacks(cb.ScheduleDate)
+async def admin_pick_date(callback: CallbackQuery, callback_data: cb.ScheduleDate):
+    date_iso = callback_data.date
     await show_date_screen(callback, date_iso)
     await callback.answer()
 
-@router.callback_query(F.data.startswith("addslot|"))
-async def admin_addslot_cb(callback: CallbackQuery):
-    if not is_admin(callback.from_user.id):
-        await callback.answer(); return
-    _, date_iso, time_str = callback.data.split("|", 2)
+@callbacks(cb.AddSlot)
+async def admin_addslot_cb(callback: CallbackQuery, callback_data: cb.AddSlot):
+    date_iso, time_str = callback_data.date, callback_data.time
     ok = await database.add_slot(date_iso, time_str)
+    if ok:
+        wake_waitlist(date_iso)
     await callback.answer("Добавлено" if ok else "Уже существует", show_alert=False)
     await show_date_screen(callback, date_iso)
 
-@router.callback_query(F.data.startswith("delslot|"))
-async def admin_delslot_cb(callback: CallbackQuery):
-    if not is_admin(callback.from_user.id):
-        await callback.answer(); return
-    _, date_iso, time_str = callback.data.split("|", 2)
+@callbacks(cb.DeleteSlot)
+async def admin_delslot_cb(callback: CallbackQuery, callback_data: cb.DeleteSlot):
+    date_iso, time_str = callback_data.date, callback_data.time
     res = await database.remove_slot(date_iso, time_str)
     if res == 1:
         msg = "Удалено"
@@ -133,39 +146,26 @@ async def admin_delslot_cb(callback: CallbackQuery):
     await callback.answer(msg, show_alert=alert)
     await show_date_screen(callback, date_iso)
 
-@router.callback_query(F.data == "admin|price")
+@callbacks(cb.AdminMenu, action="price")
 async def admin_price_menu(callback: CallbackQuery):
-    if not is_admin(callback.from_user.id):
-        await callback.answer(); return
     current = await database.get_price()
     await callback.message.edit_text(f"Текущая стоимость вопроса: <b>{current} ₽</b>")
     await callback.message.edit_reply_markup(reply_markup=keyboards.build_price_menu_ilkb(current))
     await callback.answer()
 
-@router.callback_query(F.data.startswith("price|"))
-async def admin_price_change(callback: CallbackQuery):
-    if not is_admin(callback.from_user.id):
-        await callback.answer(); return
-    _, action, step_str = callback.data.split("|", 2)
-    try:
-        step = int(step_str)
-    except Exception:
-        step = 50
+@callbacks(cb.PriceStep)
+async def admin_price_change(callback: CallbackQuery, callback_data: cb.PriceStep):
+    action, step = callback_data.action, callback_data.step
     current = await database.get_price()
     new_price = current + step if action == "inc" else max(0, current - step)
-    await database.db.execute("UPDATE settings SET value=? WHERE key='price_per_question'", (str(new_price),))
-    await database.db.commit()
+    await database.set_price(new_price)
     await callback.message.edit_text(f"Текущая стоимость вопроса: <b>{new_price} ₽</b>")
     await callback.message.edit_reply_markup(reply_markup=keyboards.build_price_menu_ilkb(new_price))
     await callback.answer("Цена обновлена")
 
-@router.callback_query(F.data.startswith("admin|bookings"))
-async def admin_bookings_cb(callback: CallbackQuery):
-    if not is_admin(callback.from_user.id):
-        await callback.answer(); return
-    # Разбираем страницу из callback.data, по умолчанию 0
-    parts = callback.data.split("|")
-    page = int(parts[2]) if len(parts) > 2 else 0
+@callbacks(cb.AdminMenu, action="bookings")
+async def admin_bookings_cb(callback: CallbackQuery, callback_data: cb.AdminMenu):
+    page = callback_data.page or 0
     page_size = 20
     records = await database.get_all_bookings()
     if not records:
@@ -179,38 +179,14 @@ async def admin_bookings_cb(callback: CallbackQuery):
     end = start + page_size
     slice_records = records[start:end]
     lines = [f"Список записей (стр. {page+1}/{total_pages}):"]
-    for rec in slice_records:
-        date_raw = rec["date"]
-        time_raw = rec["time"]
-        if date_raw:
-            try:
-                date_disp = datetime.strptime(date_raw, "%Y-%m-%d").strftime("%d.%m.%Y")
-            except ValueError:
-                date_disp = date_raw
-        else:
-            date_disp = "Дата не указана"
-        time_disp = time_raw if time_raw else "Время не указано"
-        status = rec["status"]
-        if status == config.STATUS_WAITING_PAYMENT:
-            st = "Ожидает оплаты"
-        elif status == config.STATUS_CHECKING:
-            st = "На подтверждении"
-        elif status == config.STATUS_CONFIRMED:
-            st = "Подтверждена"
-        elif status == config.STATUS_REJECTED:
-            st = "Отклонена"
-        elif status == config.STATUS_CANCELLED:
-            st = "Отменена"
-        else:
-            st = status
-        lines.append(f"- {date_disp} {time_disp} — {rec['user_name'] or ''} (@{rec['username'] or ''}) — {st}")
+    lines += format_booking_rows(slice_records, with_user=True)
     text = "\n".join(lines)
     # Кнопки навигации
     buttons = []
     if page > 0:
-        buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"admin|bookings|{page-1}"))
+        buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=cb.AdminMenu(action="bookings", page=page - 1).pack()))
     if page < total_pages - 1:
-        buttons.append(InlineKeyboardButton(text="➡️ Далее", callback_data=f"admin|bookings|{page+1}"))
+        buttons.append(InlineKeyboardButton(text="➡️ Далее", callback_data=cb.AdminMenu(action="bookings", page=page + 1).pack()))
     nav_kb = InlineKeyboardMarkup(inline_keyboard=[buttons] if buttons else [])
     # Добавляем кнопку назад в меню администратора
     final_kb = InlineKeyboardMarkup(
@@ -220,10 +196,8 @@ async def admin_bookings_cb(callback: CallbackQuery):
     await callback.message.edit_reply_markup(reply_markup=final_kb)
     await callback.answer()
 
-@router.callback_query(F.data == "admin|unlock")
+@callbacks(cb.AdminMenu, action="unlock")
 async def admin_unlock_hint(callback: CallbackQuery):
-    if not is_admin(callback.from_user.id):
-        await callback.answer(); return
     hint = ("Разблокировка слота: используйте команду\n"
             "<code>/unlockslot ДД.ММ.ГГГГ ЧЧ:ММ</code>\n"
             "Позже можно добавить здесь выбор даты/времени.")
@@ -231,39 +205,90 @@ async def admin_unlock_hint(callback: CallbackQuery):
     await callback.message.edit_reply_markup(reply_markup=keyboards.admin_back_menu_ilkb())
     await callback.answer()
 
-# Helper to check if a user is admin
-def is_admin(user_id: int) -> bool:
-    return user_id in config.ADMIN_IDS
+# Locked slots in the schedule keyboard are not actionable
+@callbacks(cb.Noop)
+async def noop_cb(callback: CallbackQuery):
+    await callback.answer()
+
+def _parse_slot(text: str):
+    """"ДД.ММ.ГГГГ ЧЧ:ММ [ID таролога]" -> (YYYY-MM-DD, HH:MM, reader id); ValueError if malformed."""
+    parts = text.split()
+    if len(parts) not in (2, 3):
+        raise ValueError(text)
+    date_iso = datetime.strptime(parts[0], "%d.%m.%Y").strftime("%Y-%m-%d")
+    time_fmt = datetime.strptime(parts[1], "%H:%M").strftime("%H:%M")
+    reader_id = int(parts[2]) if len(parts) == 3 else config.DEFAULT_READER_ID
+    return date_iso, time_fmt, reader_id
+
+def _slot_label(date_iso: str, time_fmt: str, reader_id: int) -> str:
+    label = f"{display_date(date_iso)} {time_fmt}"
+    if reader_id != config.DEFAULT_READER_ID:
+        label += f" (таролог #{reader_id})"
+    return label
+
+# Admin: readers. Each has their own slots; clients pick one or "any" when several are active
+@commands("/readers")
+async def readers_command(message: Message):
+    parts = message.text.split(maxsplit=2)
+    action = parts[1].lower() if len(parts) > 1 else None
+    if action == "add" and len(parts) == 3:
+        reader_id = await database.add_reader(parts[2].strip())
+        await message.answer(f"Таролог #{reader_id} добавлен. Слоты: /addslot ДД.ММ.ГГГГ ЧЧ:ММ {reader_id}")
+        return
+    if action in ("on", "off") and len(parts) == 3 and parts[2].strip().isdigit():
+        if await database.set_reader_active(int(parts[2]), action == "on"):
+            await message.answer("Таролог снова принимает записи." if action == "on"
+                                 else "Свободные слоты таролога скрыты от клиентов, записи сохранены.")
+        else:
+            await message.answer("Таролог не найден.")
+        return
+    if action is not None:
+        await message.answer("Использование: /readers, /readers add Имя, /readers on|off ID")
+        return
+    lines = ["Тарологи:"]
+    for reader in await database.get_readers(active_only=False):
+        lines.append(f"#{reader.id} {html.escape(reader.name)}" + ("" if reader.active else " — выключен"))
+    lines += ["", "Добавить: /readers add Имя", "Скрыть или вернуть: /readers off ID, /readers on ID",
+              f"Без ID слоты команд относятся к тарологу #{config.DEFAULT_READER_ID}."]
+    await message.answer("\n".join(lines))
 
 # Admin: view current schedule
-@router.message(lambda msg: msg.text and msg.text.startswith('/schedule'))
+async def _schedule_lines(first_batch: list, batches, reader_names: dict):
+    yield "Расписание:"
+    current_date = None
+    batch = first_batch
+    try:
+        while batch:
+            for row in batch:
+                if current_date != row.date:
+                    current_date = row.date
+                    yield ""
+                    yield f"{display_date(current_date)}:"
+                line = f"  {row.time} — {'занято' if row.is_taken == 1 else 'свободно'}"
+                if len(reader_names) > 1:
+                    line += f" — {html.escape(reader_names.get(row.reader_id, f'#{row.reader_id}'))}"
+                yield line
+            batch = await anext(batches, None)
+    finally:
+        await batches.aclose()
+    yield ""
+    yield "Добавить слот: /addslot DD.MM.YYYY HH:MM [ID таролога]"
+    yield "Удалить слот: /delslot DD.MM.YYYY HH:MM [ID таролога] (только свободные)"
+
+@commands("/schedule")
 async def schedule_command(message: Message):
-    if not is_admin(message.from_user.id):
-        return
-    slots = await database.get_all_slots()
-    if not slots or len(slots) == 0:
+    # Long schedules go out as several messages (see message_chunker); /stop interrupts
+    batches = database.iter_all_slots()
+    first_batch = await anext(batches, None)
+    if not first_batch:
         await message.answer("Расписание пусто. Добавьте слоты через /addslot.")
-    else:
-        schedule_text = "Расписание:\n"
-        current_date = None
-        for row in slots:
-            date = row["date"]
-            time = row["time"]
-            taken = row["is_taken"] == 1
-            if current_date != date:
-                current_date = date
-                date_display = datetime.strptime(date, "%Y-%m-%d").strftime("%d.%m.%Y")
-                schedule_text += f"\n{date_display}:\n"
-            status_text = "занято" if taken else "свободно"
-            schedule_text += f"  {time} — {status_text}\n"
-        schedule_text += "\nДобавить слот: /addslot DD.MM.YYYY HH:MM\nУдалить слот: /delslot DD.MM.YYYY HH:MM (только свободные)\n"
-        await message.answer(schedule_text)
+        return
+    reader_names = {r.id: r.name for r in await database.get_readers(active_only=False)}
+    await message_chunker.send_lines(message, _schedule_lines(first_batch, batches, reader_names))
 
 # Admin: add a slot (optionally with arguments)
-@router.message(lambda msg: msg.text and msg.text.startswith('/addslot'))
+@commands("/addslot")
 async def addslot_command(message: Message, state: FSMContext):
-    if not is_admin(message.from_user.id):
-        return
     parts = message.text.split(maxsplit=1)
     slot_info = parts[1] if len(parts) > 1 else None
     if not slot_info:
@@ -271,48 +296,38 @@ async def addslot_command(message: Message, state: FSMContext):
         await state.set_state(AdminState.adding_slot)
     else:
         try:
-            date_str, time_str = slot_info.split()
-            date_obj = datetime.strptime(date_str, "%d.%m.%Y")
-            date_iso = date_obj.strftime("%Y-%m-%d")
-            time_obj = datetime.strptime(time_str, "%H:%M")
-            time_fmt = time_obj.strftime("%H:%M")
+            date_iso, time_fmt, reader_id = _parse_slot(slot_info)
         except Exception:
-            await message.answer("Неверный формат. Используйте: /addslot ДД.ММ.ГГГГ ЧЧ:ММ")
+            await message.answer("Неверный формат. Используйте: /addslot ДД.ММ.ГГГГ ЧЧ:ММ [ID таролога]")
             return
-        success = await database.add_slot(date_iso, time_fmt)
+        success = await database.add_slot(date_iso, time_fmt, reader_id)
         if success:
-            await message.answer(f"Слот {date_str} {time_fmt} добавлен в расписание.")
+            wake_waitlist(date_iso)
+            await message.answer(f"Слот {_slot_label(date_iso, time_fmt, reader_id)} добавлен в расписание.")
         else:
-            await message.answer("Не удалось добавить слот. Возможно, такой слот уже существует.")
+            await message.answer("Не удалось добавить слот. Возможно, такой слот уже существует или нет такого таролога.")
 
-# State: waiting for slot date/time (interactive add slot)
-@router.message(AdminState.adding_slot)
+# State: waiting for slot date/time (interactive add slot).
+# /cancel is left to the client router's cancel handler (it may run after this one).
+@router.message(AdminState.adding_slot, F.text.lower() != "/cancel")
 async def adding_slot_state(message: Message, state: FSMContext):
-    if not is_admin(message.from_user.id):
-        await state.clear()
-        return
     text = message.text.strip()
     try:
-        date_str, time_str = text.split()
-        date_obj = datetime.strptime(date_str, "%d.%m.%Y")
-        date_iso = date_obj.strftime("%Y-%m-%d")
-        time_obj = datetime.strptime(time_str, "%H:%M")
-        time_fmt = time_obj.strftime("%H:%M")
+        date_iso, time_fmt, reader_id = _parse_slot(text)
     except Exception:
-        await message.answer("Неверный формат. Введите в формате ДД.ММ.ГГГГ ЧЧ:ММ или /cancel для отмены.")
+        await message.answer("Неверный формат. Введите в формате ДД.ММ.ГГГГ ЧЧ:ММ [ID таролога] или /cancel для отмены.")
         return
-    success = await database.add_slot(date_iso, time_fmt)
+    success = await database.add_slot(date_iso, time_fmt, reader_id)
     if success:
-        await message.answer(f"Слот {date_str} {time_fmt} добавлен.")
+        wake_waitlist(date_iso)
+        await message.answer(f"Слот {_slot_label(date_iso, time_fmt, reader_id)} добавлен.")
     else:
         await message.answer("Не удалось добавить слот. Возможно, он уже существует или данные некорректны.")
     await state.clear()
 
 # Admin: remove a slot
-@router.message(lambda msg: msg.text and msg.text.startswith('/delslot'))
+@commands("/delslot")
 async def delslot_command(message: Message, state: FSMContext):
-    if not is_admin(message.from_user.id):
-        return
     parts = message.text.split(maxsplit=1)
     slot_info = parts[1] if len(parts) > 1 else None
     if not slot_info:
@@ -320,17 +335,13 @@ async def delslot_command(message: Message, state: FSMContext):
         await state.set_state(AdminState.deleting_slot)
     else:
         try:
-            date_str, time_str = slot_info.split()
-            date_obj = datetime.strptime(date_str, "%d.%m.%Y")
-            date_iso = date_obj.strftime("%Y-%m-%d")
-            time_obj = datetime.strptime(time_str, "%H:%M")
-            time_fmt = time_obj.strftime("%H:%M")
+            date_iso, time_fmt, reader_id = _parse_slot(slot_info)
         except Exception:
-            await message.answer("Неверный формат. Используйте: /delslot ДД.ММ.ГГГГ ЧЧ:ММ")
+            await message.answer("Неверный формат. Используйте: /delslot ДД.ММ.ГГГГ ЧЧ:ММ [ID таролога]")
             return
-        result = await database.remove_slot(date_iso, time_fmt)
+        result = await database.remove_slot(date_iso, time_fmt, reader_id)
         if result == 1:
-            await message.answer(f"Слот {date_str} {time_fmt} удалён.")
+            await message.answer(f"Слот {_slot_label(date_iso, time_fmt, reader_id)} удалён.")
         elif result == 0:
             await message.answer("Слот не найден.")
         elif result == -1:
@@ -339,24 +350,17 @@ async def delslot_command(message: Message, state: FSMContext):
             await message.answer("Ошибка при удалении слота.")
 
 # State: waiting for slot date/time (interactive delete slot)
-@router.message(AdminState.deleting_slot)
+@router.message(AdminState.deleting_slot, F.text.lower() != "/cancel")
 async def deleting_slot_state(message: Message, state: FSMContext):
-    if not is_admin(message.from_user.id):
-        await state.clear()
-        return
     text = message.text.strip()
     try:
-        date_str, time_str = text.split()
-        date_obj = datetime.strptime(date_str, "%d.%m.%Y")
-        date_iso = date_obj.strftime("%Y-%m-%d")
-        time_obj = datetime.strptime(time_str, "%H:%M")
-        time_fmt = time_obj.strftime("%H:%M")
+        date_iso, time_fmt, reader_id = _parse_slot(text)
     except Exception:
         await message.answer("Неверный формат. Попробуйте снова или /cancel для отмены.")
         return
-    result = await database.remove_slot(date_iso, time_fmt)
+    result = await database.remove_slot(date_iso, time_fmt, reader_id)
     if result == 1:
-        await message.answer(f"Слот {date_str} {time_fmt} удалён.")
+        await message.answer(f"Слот {_slot_label(date_iso, time_fmt, reader_id)} удалён.")
     elif result == 0:
         await message.answer("Слот не найден или уже удалён.")
     elif result == -1:
@@ -366,10 +370,8 @@ async def deleting_slot_state(message: Message, state: FSMContext):
     await state.clear()
 
 # Admin: change price per question
-@router.message(lambda msg: msg.text and msg.text.startswith('/price'))
+@commands("/price")
 async def price_command(message: Message):
-    if not is_admin(message.from_user.id):
-        return
     parts = message.text.split()
     if len(parts) == 1:
         current_price = await database.get_price()
@@ -380,55 +382,301 @@ async def price_command(message: Message):
         except:
             await message.answer("Пожалуйста, укажите новую цену числом.")
             return
-        await database.db.execute("UPDATE settings SET value=? WHERE key='price_per_question'", (str(new_price),))
-        await database.db.commit()
-        logging.info(f"Admin changed price to {new_price}")
+        await database.set_price(new_price)
+        logger.info(f"Admin changed price to {new_price}", extra={"user_id": message.from_user.id})
         await message.answer(f"Цена за вопрос изменена на {new_price} ₽.")
 
 # Admin: list all bookings (summary)
-@router.message(lambda msg: msg.text and msg.text.startswith('/bookings'))
+async def _booking_lines(first_batch: list, batches):
+    yield "Список записей:"
+    batch = first_batch
+    try:
+        while batch:
+            for line in format_booking_rows(batch, with_user=True):
+                yield line
+            batch = await anext(batches, None)
+    finally:
+        await batches.aclose()
+
+@commands("/bookings")
 async def bookings_command(message: Message):
-    if not is_admin(message.from_user.id):
-        return
-    records = await database.get_all_bookings()
-    if not records or len(records) == 0:
+    batches = database.iter_all_bookings()
+    first_batch = await anext(batches, None)
+    if not first_batch:
         await message.answer("Записей не найдено.")
+        return
+    await message_chunker.send_lines(message, _booking_lines(first_batch, batches))
+
+# Admin: stop a long listing that is still being sent
+@commands("/stop")
+async def stop_command(message: Message):
+    if message_chunker.stop(message.chat.id):
+        await message.answer("Отправка списка остановлена.")
     else:
-        text_lines = ["Список записей:"]
-        for rec in records:
-            date_raw = rec["date"]
-            time_raw = rec["time"]
-            status = rec["status"]
-            name = rec["user_name"] or "<имя>"
-            username = rec["username"] or ""
-            if date_raw:
-                try:
-                    date_display = datetime.strptime(date_raw, "%Y-%m-%d").strftime("%d.%m.%Y")
-                except ValueError:
-                    date_display = date_raw
-            else:
-                date_display = "Дата не указана"
-            time_display = time_raw if time_raw else "Время не указано"
-            if status == config.STATUS_WAITING_PAYMENT:
-                status_text = "Ожидает оплаты"
-            elif status == config.STATUS_CHECKING:
-                status_text = "На подтверждении"
-            elif status == config.STATUS_CONFIRMED:
-                status_text = "Подтверждена"
-            elif status == config.STATUS_REJECTED:
-                status_text = "Отклонена"
-            elif status == config.STATUS_CANCELLED:
-                status_text = "Отменена"
-            else:
-                status_text = status
-            text_lines.append(f"- {date_display} {time_display} — {name} (@{username}) — {status_text}")
-        await message.answer("\n".join(text_lines))
+        await message.answer("Сейчас ничего не отправляется.")
+
+def _percent(part: int, whole: int) -> str:
+    return f"{part * 100 / whole:.1f}%" if whole else "—"
+
+# Longest /stats N period in days; a larger N would overflow the date arithmetic
+STATS_MAX_DAYS = 3660
+
+def _stats_range(args: list):
+    """(date_from, date_to) as dates for /stats arguments: none (30 days), N days (at most STATS_MAX_DAYS), or two dates."""
+    today = local_time.today()
+    if not args:
+        return today - timedelta(days=29), today
+    if len(args) == 1 and args[0].isdigit() and int(args[0]) > 0:
+        return today - timedelta(days=min(int(args[0]), STATS_MAX_DAYS) - 1), today
+    if len(args) == 2:
+        date_from = datetime.strptime(args[0], "%d.%m.%Y").date()
+        date_to = datetime.strptime(args[1], "%d.%m.%Y").date()
+        if date_from <= date_to:
+            return date_from, date_to
+    raise ValueError("bad /stats arguments")
+
+# Admin: booking analytics from the daily aggregates (/stats [N | ДД.ММ.ГГГГ ДД.ММ.ГГГГ | rebuild])
+@commands("/stats")
+async def stats_command(message: Message):
+    args = message.text.split()[1:]
+    if args == ["rebuild"]:
+        added = await database.rebuild_daily_stats()
+        await message.answer(f"Статистика восстановлена по истории за {added} дн. "
+                             "Дни, за которые она уже собрана, не изменены.")
+        return
+    try:
+        date_from, date_to = _stats_range(args)
+    except ValueError:
+        await message.answer("Использование: /stats, /stats 7 (дней) или /stats ДД.ММ.ГГГГ ДД.ММ.ГГГГ\n"
+                             "Восстановить дни без статистики по истории: /stats rebuild")
+        return
+    days = await database.get_daily_stats(date_from.isoformat(), date_to.isoformat())
+    created = sum(d.created for d in days)
+    checking = sum(d.checking for d in days)
+    confirmed = sum(d.confirmed for d in days)
+    cancelled = sum(d.cancelled for d in days)
+    timed_out = sum(d.timed_out for d in days)
+    confirm_samples = sum(d.confirm_samples for d in days)
+    avg_confirm = (format_duration(sum(d.confirm_seconds for d in days) / confirm_samples)
+                   if confirm_samples else "—")
+    lines = [
+        f"<b>Статистика за {display_date(date_from)} — {display_date(date_to)}</b>",
+        f"Создано записей: {created}",
+        f"Отправлено чеков: {checking} ({_percent(checking, created)})",
+        f"Подтверждено: {confirmed} (конверсия {_percent(confirmed, created)})",
+        f"Отклонено: {sum(d.rejected for d in days)}",
+        f"Отменено: {cancelled}, из них по таймауту оплаты: {timed_out} ({_percent(timed_out, created)})",
+        f"Выручка: {sum(d.revenue for d in days)} ₽",
+        f"Среднее время до подтверждения: {avg_confirm}",
+    ]
+    if days:
+        lines += ["", "По дням:"]
+        lines += [f"- {display_date(d.day)}: создано {d.created}, подтв. {d.confirmed}, выручка {d.revenue} ₽"
+                  for d in days]
+    await message_chunker.send_lines(message, lines)
+
+# Admin: download all bookings as a file (/export, /export xlsx)
+@commands("/export")
+async def export_command(message: Message):
+    parts = message.text.split()
+    fmt = parts[1].lower() if len(parts) > 1 else "csv"
+    if fmt not in export.FORMATS:
+        await message.answer("Использование: /export [csv|xlsx]")
+        return
+    if fmt == "xlsx" and not export.XLSX_AVAILABLE:
+        await message.answer("XLSX недоступен (не установлен openpyxl), выгружаю CSV.")
+        fmt = "csv"
+    try:
+        path, count = await export.export_bookings(fmt)
+    except Exception as e:
+        logger.error(f"Bookings export failed: {e}", extra={"user_id": message.from_user.id})
+        await message.answer("Не удалось сформировать выгрузку.")
+        return
+    try:
+        filename = f"bookings_{datetime.now():%Y%m%d_%H%M}.{fmt}"
+        await message.answer_document(FSInputFile(path, filename=filename), caption=f"Записей: {count}")
+    finally:
+        await asyncio.to_thread(export.remove_export, path)
+
+# Admin: message every user (/broadcast ТЕКСТ, /broadcast stop)
+@commands("/broadcast")
+async def broadcast_command(message: Message):
+    parts = message.html_text.split(maxsplit=1)
+    text = parts[1].strip() if len(parts) > 1 else ""
+    running_list = await database.get_running_broadcasts()
+    running = running_list[0].id if running_list else None
+    if text == "stop":
+        if running is not None and await broadcast.stop(running):
+            await message.answer(f"Рассылка #{running} будет остановлена.")
+        else:
+            await message.answer("Сейчас нет активной рассылки.")
+        return
+    if not text:
+        await message.answer("Использование: /broadcast ТЕКСТ (форматирование сохраняется)\n"
+                             "Остановить текущую рассылку: /broadcast stop")
+        return
+    if running is not None:
+        await message.answer(f"Уже идёт рассылка #{running}. Остановить: /broadcast stop")
+        return
+    broadcast_id = await database.create_broadcast(text, message.from_user.id)
+    await message.answer("Предпросмотр рассылки:")
+    await message.answer(text, reply_markup=keyboards.broadcast_confirm_ilkb(broadcast_id))
+
+@callbacks(cb.BroadcastAction, action="send")
+async def broadcast_send_cb(callback: CallbackQuery, callback_data: cb.BroadcastAction):
+    broadcast_id = callback_data.broadcast_id
+    if await database.get_running_broadcasts():
+        await callback.answer("Уже идёт другая рассылка.", show_alert=True)
+        return
+    # The preview message becomes the progress report
+    if not await database.start_broadcast(broadcast_id, callback.message.chat.id, callback.message.message_id):
+        await callback.answer("Рассылка уже запущена или отменена.", show_alert=True)
+        return
+    logger.info(f"Broadcast {broadcast_id} started", extra={"user_id": callback.from_user.id})
+    await callback.message.edit_text(broadcast.progress_text(await database.get_broadcast(broadcast_id)))
+    if leader.elector.is_leader:
+        broadcast.start(broadcast_id)  # otherwise the leader picks it up within seconds
+    await callback.answer("Рассылка запущена")
+
+@callbacks(cb.BroadcastAction, action="cancel")
+async def broadcast_cancel_cb(callback: CallbackQuery, callback_data: cb.BroadcastAction):
+    await database.delete_broadcast_draft(callback_data.broadcast_id)
+    await callback.message.edit_text("Рассылка отменена.")
+    await callback.answer()
+
+# Admin: database query statistics (/dbstats, /dbstats reset)
+@commands("/dbstats")
+async def dbstats_command(message: Message):
+    parts = message.text.split()
+    if len(parts) > 1 and parts[1] == "reset":
+        db_profiler.profiler.reset()
+        await message.answer("Статистика запросов сброшена.")
+        return
+    top = db_profiler.profiler.top(10)
+    if not top:
+        await message.answer("Статистика запросов пока пуста.")
+        return
+    text = "<b>Запросы по суммарному времени:</b>"
+    for sql, stats in top:
+        avg_ms = stats.total_time / stats.calls * 1000 if stats.calls else 0.0
+        entry = (
+            f"\n\n<code>{html.escape(sql[:300])}</code>\n"
+            f"вызовов: {stats.calls}, всего: {stats.total_time * 1000:.1f} мс, "
+            f"сред.: {avg_ms:.2f} мс, макс.: {stats.max_time * 1000:.1f} мс, строк: {stats.rows}"
+        )
+        if stats.plan:
+            entry += f"\nплан: {html.escape('; '.join(stats.plan))}"
+        if len(text) + len(entry) > 4000:
+            break
+        text += entry
+    await message.answer(text)
+
+# Admin: full-text search over clients and bookings (/find ТЕКСТ)
+FIND_PAGE_SIZE = 10
+# search_id -> query text, for the page buttons of recent /find results
+_searches = OrderedDict()
+_search_ids = itertools.count(1)
+_SEARCHES_KEPT = 200
+
+def _snippet(text: str) -> str:
+    """HTML for an FTS snippet: escaped, with the matched words in bold."""
+    return html.escape(text).replace(database.SNIPPET_START, "<b>").replace(database.SNIPPET_END, "</b>")
+
+async def _find_page(search_id: int, page: int):
+    """(text, keyboard) of one page of results for a remembered query."""
+    query = _searches[search_id]
+    total, results = await database.search_bookings(query, FIND_PAGE_SIZE, page * FIND_PAGE_SIZE)
+    if not total:
+        return f"По запросу «{html.escape(query)}» ничего не найдено.", None
+    total_pages = (total + FIND_PAGE_SIZE - 1) // FIND_PAGE_SIZE
+    lines = [f"Поиск «{html.escape(query)}»: найдено {total} (стр. {page + 1}/{total_pages})"]
+    records = [record for record, _ in results]
+    for line, (_, snippet) in zip(format_booking_rows(records, with_user=True, with_id=True), results):
+        lines.append(line)
+        lines.append(f"    {_snippet(snippet)}")
+    return "\n".join(lines), keyboards.find_pages_ilkb(search_id, page, total_pages)
+
+@commands("/find")
+async def find_command(message: Message):
+    parts = message.text.split(maxsplit=1)
+    query = parts[1].strip() if len(parts) > 1 else ""
+    if not database.SEARCH_AVAILABLE:
+        await message.answer("Поиск недоступен: SQLite собран без FTS5.")
+        return
+    if not database.search_query(query):
+        await message.answer("Использование: /find ТЕКСТ (имя, @username, телефон или слова из истории и вопросов)")
+        return
+    search_id = next(_search_ids)
+    _searches[search_id] = query
+    while len(_searches) > _SEARCHES_KEPT:
+        _searches.popitem(last=False)
+    text, markup = await _find_page(search_id, 0)
+    await message.answer(text, reply_markup=markup)
+
+@callbacks(cb.FindPage)
+async def find_page_cb(callback: CallbackQuery, callback_data: cb.FindPage):
+    if callback_data.search_id not in _searches:
+        await callback.answer("Результаты устарели, повторите /find.", show_alert=True)
+        return
+    text, markup = await _find_page(callback_data.search_id, max(callback_data.page, 0))
+    await callback.message.edit_text(text, reply_markup=markup)
+    await callback.answer()
+
+# Admin: sampling profile of the running bot (/profile [секунд])
+@commands("/profile")
+async def profile_command(message: Message):
+    parts = message.text.split()
+    try:
+        seconds = int(parts[1]) if len(parts) > 1 else 10
+    except ValueError:
+        seconds = 0
+    if not 1 <= seconds <= config.PROFILE_MAX_SECONDS:
+        await message.answer(f"Использование: /profile [секунд], от 1 до {config.PROFILE_MAX_SECONDS} (по умолчанию 10)")
+        return
+    monitor = loop_monitor.monitor
+    await message.answer(f"Снимаю профиль, {seconds} сек...")
+    stacks = await monitor.profile(seconds)
+    if stacks is None:
+        await message.answer("Профиль уже снимается, попробуйте позже.")
+        return
+    caption = (f"Сэмплов: {sum(stacks.values())}. Макс. задержка цикла: {monitor.max_lag * 1000:.0f} мс, "
+               f"задержек больше {config.LOOP_LAG_WARN_MS:.0f} мс: {monitor.stalls}.\n"
+               "Формат folded stacks: flamegraph.pl, speedscope или inferno.")
+    filename = f"profile_{datetime.now():%Y%m%d_%H%M%S}.folded"
+    await message.answer_document(BufferedInputFile(loop_monitor.folded(stacks), filename=filename), caption=caption)
+
+# Admin: re-read ADMIN_IDS from .env without restarting the bot
+@commands("/reload_admins")
+async def reload_admins_command(message: Message):
+    admins = config.reload_admins()
+    logger.info(f"Admin list reloaded: {len(admins)} admin(s)", extra={"user_id": message.from_user.id})
+    await message.answer(f"Список администраторов обновлён: {len(admins)}.")
+
+# Admin: status history of a booking from the event log (/history <id>)
+@commands("/history")
+async def history_command(message: Message):
+    parts = message.text.split()
+    if len(parts) != 2 or not parts[1].lstrip("#").isdigit():
+        await message.answer("Использование: /history НОМЕР_ЗАПИСИ")
+        return
+    booking_id = int(parts[1].lstrip("#"))
+    events = await database.get_booking_events(booking_id)
+    if not events:
+        await message.answer(f"Для записи #{booking_id} нет истории.")
+        return
+    lines = [f"История записи #{booking_id}:"]
+    for event in events:
+        when = local_time.from_epoch(event.created_at).strftime("%d.%m.%Y %H:%M")
+        change = status_label(event.new_status)
+        if event.old_status:
+            change = f"{status_label(event.old_status)} → {change}"
+        actor = f"<code>{event.actor}</code>" if event.actor is not None else "бот"
+        lines.append(f"- {when}: {change} ({actor})")
+    await message_chunker.send_lines(message, lines)
 
 # Admin: unlock a slot manually (cancel booking if needed)
-@router.message(lambda msg: msg.text and msg.text.startswith('/unlockslot'))
+@commands("/unlockslot")
 async def unlockslot_command(message: Message, state: FSMContext):
-    if not is_admin(message.from_user.id):
-        return
     parts = message.text.split(maxsplit=1)
     slot_info = parts[1] if len(parts) > 1 else None
     if not slot_info:
@@ -436,147 +684,93 @@ async def unlockslot_command(message: Message, state: FSMContext):
         await state.set_state(AdminState.unlocking_slot)
     else:
         try:
-            date_str, time_str = slot_info.split()
-            date_obj = datetime.strptime(date_str, "%d.%m.%Y")
-            date_iso = date_obj.strftime("%Y-%m-%d")
-            time_obj = datetime.strptime(time_str, "%H:%M")
-            time_fmt = time_obj.strftime("%H:%M")
+            date_iso, time_fmt, reader_id = _parse_slot(slot_info)
         except Exception:
-            await message.answer("Неверный формат. Используйте: /unlockslot ДД.ММ.ГГГГ ЧЧ:ММ")
+            await message.answer("Неверный формат. Используйте: /unlockslot ДД.ММ.ГГГГ ЧЧ:ММ [ID таролога]")
             return
-        await handle_unlock(date_iso, time_fmt, message)
+        await handle_unlock(date_iso, time_fmt, message, reader_id)
 
 # State: waiting for slot date/time (interactive unlock slot)
-@router.message(AdminState.unlocking_slot)
+@router.message(AdminState.unlocking_slot, F.text.lower() != "/cancel")
 async def unlocking_slot_state(message: Message, state: FSMContext):
-    if not is_admin(message.from_user.id):
-        await state.clear()
-        return
     text = message.text.strip()
     try:
-        date_str, time_str = text.split()
-        date_obj = datetime.strptime(date_str, "%d.%m.%Y")
-        date_iso = date_obj.strftime("%Y-%m-%d")
-        time_obj = datetime.strptime(time_str, "%H:%M")
-        time_fmt = time_obj.strftime("%H:%M")
+        date_iso, time_fmt, reader_id = _parse_slot(text)
     except Exception:
         await message.answer("Неверный формат. Попробуйте снова или /cancel для отмены.")
         return
-    await handle_unlock(date_iso, time_fmt, message)
+    await handle_unlock(date_iso, time_fmt, message, reader_id)
     await state.clear()
 
-async def handle_unlock(date_iso: str, time_fmt: str, message: Message):
-    """Helper to unlock a slot given date (YYYY-MM-DD) and time (HH:MM)."""
-    cur = await database.db.execute("SELECT id, is_taken FROM slots WHERE date=? AND time=?", (date_iso, time_fmt))
-    slot = await cur.fetchone()
+async def handle_unlock(date_iso: str, time_fmt: str, message: Message, reader_id: int = config.DEFAULT_READER_ID):
+    """Helper to unlock a reader's slot given date (YYYY-MM-DD) and time (HH:MM)."""
+    slot = await database.get_slot_by_datetime(date_iso, time_fmt, reader_id)
     if slot is None:
         await message.answer("Слот не найден.")
         return
-    slot_id = slot["id"]
-    if slot["is_taken"] == 0:
+    slot_id = slot.id
+    if slot.is_taken == 0:
         await message.answer("Слот уже свободен.")
         return
     # Slot is taken, find active booking for this slot
-    cur_b = await database.db.execute(
-        "SELECT id, status, user_id, admin_message_id FROM bookings WHERE slot_id=? AND status NOT IN (?, ?)",
-        (slot_id, config.STATUS_CANCELLED, config.STATUS_REJECTED)
-    )
-    booking = await cur_b.fetchone()
+    booking = await database.get_active_booking_for_slot(slot_id)
     if booking is None:
         # No active booking but slot marked taken - free it
-        await database.db.execute("UPDATE slots SET is_taken=0 WHERE id=?", (slot_id,))
-        await database.db.commit()
+        await database.release_slot(slot_id)
+        wake_waitlist(date_iso)
         await message.answer("Слот разблокирован.")
-        logging.info(f"Slot {slot_id} unlocked (no active booking found).")
+        logger.info(f"Slot {slot_id} unlocked (no active booking found).", extra={"slot_id": slot_id})
         return
-    booking_id = booking["id"]
-    status = booking["status"]
-    user_id = booking["user_id"]
-    admin_msg_id = booking["admin_message_id"]
+    booking_id = booking.id
+    status = booking.status
+    user_id = booking.user_id
+    admin_msg_id = booking.admin_message_id
     if status == config.STATUS_WAITING_PAYMENT:
         # Cancel booking and free slot
-        await database.update_booking_status(booking_id, config.STATUS_CANCELLED)
-        await database.db.execute("UPDATE slots SET is_taken=0 WHERE id=?", (slot_id,))
-        await database.db.commit()
-        from scheduler import scheduler
-        try:
-            scheduler.remove_job(f"unlock_{booking_id}")
-        except:
-            pass
-        # Notify user
-        try:
-            await config.bot.send_message(user_id, "Ваша запись была отменена администратором (истек лимит времени оплаты).")
-        except Exception as e:
-            logging.error(f"Failed to notify user about unlock: {e}")
+        await database.release_booking(booking_id, config.STATUS_CANCELLED, slot_id, actor=message.from_user.id, notify=[
+            outbox.message(user_id, "Ваша запись была отменена администратором (истек лимит времени оплаты)."),
+        ])
+        outbox.wake()
+        wake_waitlist(date_iso)
         await message.answer("Слот разблокирован. Бронирование отменено (оплата не поступила).")
     elif status == config.STATUS_CHECKING:
         # Payment was sent but not confirmed yet – reject it
-        await database.update_booking_status(booking_id, config.STATUS_REJECTED)
-        await database.db.execute("UPDATE slots SET is_taken=0 WHERE id=?", (slot_id,))
-        await database.db.commit()
-        try:
-            await config.bot.send_message(user_id, "Оплата не подтверждена, ваша запись отклонена. Слот освобожден.")
-        except Exception as e:
-            logging.error(f"Failed to notify user about rejection: {e}")
-        if admin_msg_id:
-            try:
-                await config.bot.edit_message_text(chat_id=config.ADMIN_GROUP_ID, message_id=admin_msg_id,
-                                                  text=f"Запись #{booking_id} отклонена (разблокирована администратором).")
-            except Exception as e:
-                logging.error(f"Failed to edit admin message: {e}")
+        await database.release_booking(booking_id, config.STATUS_REJECTED, slot_id, actor=message.from_user.id, notify=[
+            outbox.message(user_id, "Оплата не подтверждена, ваша запись отклонена. Слот освобожден."),
+            admin_msg_id and outbox.to_admin_group(
+                f"Запись #{booking_id} отклонена (разблокирована администратором).", admin_msg_id),
+        ])
+        outbox.wake()
+        wake_waitlist(date_iso)
         await message.answer("Слот разблокирован. Запись отклонена.")
     elif status == config.STATUS_CONFIRMED:
         # Booking was confirmed – cancel it
-        await database.update_booking_status(booking_id, config.STATUS_CANCELLED)
-        await database.db.execute("UPDATE slots SET is_taken=0 WHERE id=?", (slot_id,))
-        await database.db.commit()
-        try:
-            await config.bot.send_message(user_id, f"Ваша подтвержденная запись на {datetime.strptime(date_iso, '%Y-%m-%d').strftime('%d.%m.%Y')} {time_fmt} отменена администратором.")
-        except Exception as e:
-            logging.error(f"Failed to notify user of admin cancellation: {e}")
-        if admin_msg_id:
-            try:
-                await config.bot.edit_message_text(chat_id=config.ADMIN_GROUP_ID, message_id=admin_msg_id,
-                                                  text=f"Запись #{booking_id} отменена администратором.")
-            except Exception as e:
-                logging.error(f"Failed to edit admin message for cancel: {e}")
+        await database.release_booking(booking_id, config.STATUS_CANCELLED, slot_id, actor=message.from_user.id, notify=[
+            outbox.message(user_id, f"Ваша подтвержденная запись на {display_date(date_iso)} {time_fmt} отменена администратором."),
+            admin_msg_id and outbox.to_admin_group(f"Запись #{booking_id} отменена администратором.", admin_msg_id),
+        ])
+        outbox.wake()
+        wake_waitlist(date_iso)
         await message.answer("Слот разблокирован. Подтвержденная запись отменена.")
     else:
         await message.answer("Запись уже отменена.")
         
 # Admin: confirm payment (from inline button in admin group)
-@router.callback_query(lambda c: c.data and c.data.startswith('confirm|'))
-async def confirm_payment(callback: CallbackQuery):
-    if not is_admin(callback.from_user.id):
-        await callback.answer()
-        return
-    try:
-        booking_id = int(callback.data.split('|')[1])
-    except:
-        await callback.answer()
-        return
+@callbacks(cb.ConfirmPayment)
+async def confirm_payment(callback: CallbackQuery, callback_data: cb.ConfirmPayment):
+    booking_id = callback_data.booking_id
     details = await database.get_booking_details(booking_id)
-    if not details or details["status"] != config.STATUS_CHECKING:
+    if not details or details.status != config.STATUS_CHECKING:
         await callback.answer("Не удалось подтвердить (статус изменился).", show_alert=True)
         return
-    # Mark as confirmed
-    await database.update_booking_status(booking_id, config.STATUS_CONFIRMED)
-    # Cancel any pending unlock job
-    from scheduler import scheduler
-    try:
-        scheduler.remove_job(f"unlock_{booking_id}")
-    except:
-        pass
-    user_id = details["user_id"]
-    date = details["date"]; time = details["time"]
-    date_disp = datetime.strptime(date, "%Y-%m-%d").strftime("%d.%m.%Y")
-    # Notify user
-    try:
-        await config.bot.send_message(user_id, f"Ваша запись подтверждена, расклад будет отправлен {date_disp} с 13:00 до 18:00 (МСК).")
-    except Exception as e:
-        logging.error(f"Failed to notify user {user_id} of confirmation: {e}")
+    # Mark as confirmed; the user is notified through the outbox
+    date_disp = display_date(details.date)
+    await database.update_booking_status(booking_id, config.STATUS_CONFIRMED, actor=callback.from_user.id, notify=[
+        outbox.message(details.user_id, f"Ваша запись подтверждена, расклад будет отправлен {date_disp} с 13:00 до 18:00 (МСК)."),
+    ])
+    outbox.wake()
     # Update admin group's message text
-    if details["admin_message_id"]:
+    if details.admin_message_id:
         try:
             text = callback.message.text or ""
             if "Статус:" in text:
@@ -585,54 +779,38 @@ async def confirm_payment(callback: CallbackQuery):
                 new_text = text + "\nСтатус: Подтверждена"
             await callback.message.edit_text(new_text)
         except Exception as e:
-            logging.error(f"Failed to edit admin group message text: {e}")
+            logger.error(f"Failed to edit admin group message text: {e}")
     await callback.answer("✅ Подтверждено")
 
 # Admin: reject payment (from inline button in admin group)
-@router.callback_query(lambda c: c.data and c.data.startswith('reject|'))
-async def reject_payment(callback: CallbackQuery):
-    if not is_admin(callback.from_user.id):
-        await callback.answer()
-        return
-    try:
-        booking_id = int(callback.data.split('|')[1])
-    except:
-        await callback.answer()
-        return
+@callbacks(cb.RejectPayment)
+async def reject_payment(callback: CallbackQuery, callback_data: cb.RejectPayment):
+    booking_id = callback_data.booking_id
     details = await database.get_booking_details(booking_id)
-    if not details or details["status"] != config.STATUS_CHECKING:
+    if not details or details.status != config.STATUS_CHECKING:
         await callback.answer("Не удалось отклонить (статус изменился).", show_alert=True)
         return
-    # Temporary debug log for details keys
-    logging.debug(f"reject_payment details keys: {list(details.keys())}")
-    # Mark as rejected and free slot
-    await database.update_booking_status(booking_id, config.STATUS_REJECTED)
-    slot_id = details["slot_id"] if "slot_id" in details.keys() else None
+    slot_id = details.slot_id
     if not slot_id:
         # Попробуем найти слот по дате и времени, если slot_id не передан
-        cur = await database.db.execute(
-            "SELECT id FROM slots WHERE date=? AND time=?",
-            (details["date"], details["time"])
-        )
-        row = await cur.fetchone()
-        slot_id = row["id"] if row else None
-    if slot_id:
-        await database.db.execute("UPDATE slots SET is_taken=0 WHERE id=?", (slot_id,))
-        await database.db.commit()
-    else:
-        logging.error(f"reject_payment: slot_id not found in details for booking {booking_id}")
+        slot = None
+        if details.date:
+            slot = await database.get_slot_by_datetime(details.date.isoformat(), details.time,
+                                                       details.reader_id or config.DEFAULT_READER_ID)
+        slot_id = slot.id if slot else None
+    # Mark as rejected and free slot; the user is notified through the outbox
+    await database.release_booking(booking_id, config.STATUS_REJECTED, slot_id, actor=callback.from_user.id, notify=[
+        outbox.message(details.user_id, "Ваш платеж не подтвержден. Запись отклонена, слот освобожден. Вы можете записаться снова."),
+    ])
+    outbox.wake()
+    if not slot_id:
+        logger.error(f"reject_payment: slot_id not found in details for booking {booking_id}", extra={"booking_id": booking_id})
         await callback.answer("Ошибка: слот не найден для этой записи.", show_alert=True)
         return
-    user_id = details["user_id"]
-    date = details["date"]; time = details["time"]
-    date_disp = datetime.strptime(date, "%Y-%m-%d").strftime("%d.%m.%Y")
-    # Notify user
-    try:
-        await config.bot.send_message(user_id, "Ваш платеж не подтвержден. Запись отклонена, слот освобожден. Вы можете записаться снова.")
-    except Exception as e:
-        logging.error(f"Failed to notify user {user_id} of rejection: {e}")
+    if details.date:
+        wake_waitlist(details.date.isoformat())
     # Update admin group's message text
-    if details["admin_message_id"]:
+    if details.admin_message_id:
         try:
             text = callback.message.text or ""
             if "Статус:" in text:
@@ -641,5 +819,5 @@ async def reject_payment(callback: CallbackQuery):
                 new_text = text + "\nСтатус: Отклонена"
             await callback.message.edit_text(new_text)
         except Exception as e:
-            logging.error(f"Failed to edit admin group message text on reject: {e}")
+            logger.error(f"Failed to edit admin group message text on reject: {e}")
     await callback.answer("❌ Отклонено", show_alert=False)
@@ -1,23 +1,38 @@
 import re
-import json
+import html
 import logging
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery, InputMediaPhoto
 from aiogram.fsm.context import FSMContext
 
+import callback_data as cb
 import config
 import database
 import keyboards
+import local_time
 import bot_texts
+import outbox
 import spreads_data
+from formatting import CLIENT_STATUS_LABELS, display_date, format_booking_rows
+from routing import CallbackRoutes, TextRoutes
+from scheduler import wake_waitlist
 from states import BookingState, ChooseQuestionState
 
+logger = logging.getLogger(__name__)
+
 router = Router()
 
+# Buttons and menu texts are routed through dict tables (see routing.py);
+# they are checked before the FSM state handlers below.
+callbacks = CallbackRoutes()
+callbacks.attach(router.callback_query)
+texts = TextRoutes()
+texts.attach(router.message)
+
 # Cancel command handler to abort the booking process
-@router.message(F.text.lower() == "/cancel")
+@texts("/cancel")
 async def cancel_command(message: Message, state: FSMContext):
     current_state = await state.get_state()
     if current_state is None:
@@ -30,33 +45,25 @@ async def cancel_command(message: Message, state: FSMContext):
             booking_id = data["booking_id"]
             record = await database.get_booking_by_id(booking_id)
             if record:
-                status = record["status"]
+                status = record.status
                 if status in (config.STATUS_WAITING_PAYMENT, config.STATUS_CHECKING):
-                    # Cancel booking in DB and free slot
-                    slot_id = record["slot_id"]
-                    await database.update_booking_status(booking_id, config.STATUS_CANCELLED)
-                    await database.db.execute("UPDATE slots SET is_taken=0 WHERE id=?", (slot_id,))
-                    await database.db.commit()
-                    logging.info(f"Booking {booking_id} cancelled by user via /cancel")
-                    cancelled = True
-                    # Notify admin group if a payment was pending or booking confirmed
-                    admin_msg_id = record["admin_message_id"]
-                    if admin_msg_id:
-                        # Edit admin's message to note cancellation
-                        try:
-                            await config.bot.edit_message_text(chat_id=config.ADMIN_GROUP_ID, message_id=admin_msg_id,
-                                                              text=f"Запись #{booking_id} отменена пользователем.")
-                        except Exception as e:
-                            logging.error(f"Failed to edit admin message for cancellation: {e}")
+                    # Cancel booking in DB and free slot; notify the admin group through the outbox:
+                    # edit the review message if the receipt was sent, otherwise post a note
+                    user = message.from_user
+                    if record.admin_message_id:
+                        notice = outbox.to_admin_group(f"Запись #{booking_id} отменена пользователем.",
+                                                       record.admin_message_id)
                     else:
-                        # If no admin message existed (cancelled before payment sent), inform admin group
-                        try:
-                            if config.ADMIN_GROUP_ID:
-                                user = message.from_user
-                                await config.bot.send_message(config.ADMIN_GROUP_ID,
-                                    f"Пользователь {user.full_name} (@{user.username}) отменил запись #{booking_id}.")
-                        except Exception as e:
-                            logging.error(f"Failed to notify admin of cancellation: {e}")
+                        notice = outbox.to_admin_group(
+                            f"Пользователь {html.escape(user.full_name)} (@{user.username}) отменил запись #{booking_id}.")
+                    await database.release_booking(booking_id, config.STATUS_CANCELLED, record.slot_id,
+                                                   actor=user.id, notify=[notice])
+                    outbox.wake()
+                    if record.slot_id and record.date:
+                        wake_waitlist(record.date.isoformat())
+                    logger.info(f"Booking {booking_id} cancelled by user via /cancel",
+                                extra={"booking_id": booking_id, "user_id": message.from_user.id})
+                    cancelled = True
         await state.clear()
         if cancelled:
             await message.answer("Запись отменена.", reply_markup=keyboards.main_menu_kb)
@@ -64,7 +71,7 @@ async def cancel_command(message: Message, state: FSMContext):
             await message.answer("Процесс отменен. Возвращаемся в главное меню.", reply_markup=keyboards.main_menu_kb)
 
 # Start command /start - greeting and main menu
-@router.message(F.text == "/start")
+@texts("/start")
 async def start_command(message: Message, state: FSMContext):
     user = message.from_user
     # Register or update user in database
@@ -77,13 +84,13 @@ async def start_command(message: Message, state: FSMContext):
     await message.answer(bot_texts.welcome_text(price), reply_markup=keyboards.main_menu_kb, parse_mode="HTML")
 
 # Help menu
-@router.message(F.text == "ℹ Помощь")
+@texts("ℹ Помощь")
 async def help_command(message: Message):
     await message.answer(bot_texts.help_text(), reply_markup=keyboards.main_menu_kb, parse_mode="HTML")
 
 
 # --- Выбрать вопрос / готовый расклад ---
-@router.message(F.text == "📋 Выбрать вопрос / расклад")
+@texts("📋 Выбрать вопрос / расклад")
 async def choose_question_or_spread(message: Message, state: FSMContext):
     await state.clear()
     await message.answer(
@@ -93,10 +100,9 @@ async def choose_question_or_spread(message: Message, state: FSMContext):
     )
 
 
-@router.callback_query(F.data == "spread_type|questions")
-@router.callback_query(F.data == "spread_type|ready")
-async def spread_type_callback(callback: CallbackQuery, state: FSMContext):
-    if callback.data == "spread_type|questions":
+@callbacks(cb.SpreadType)
+async def spread_type_callback(callback: CallbackQuery, callback_data: cb.SpreadType):
+    if callback_data.kind == "questions":
         await callback.message.edit_text(
             "Выберите категорию вопросов. Затем вам будет показан нумерованный список — напишите номера нужных вопросов через запятую (например: 1, 5, 10).\n\n"
             f"Стоимость одного вопроса из списка — <b>{spreads_data.QUESTION_PRICE}₽</b>.",
@@ -111,9 +117,9 @@ async def spread_type_callback(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("ready_cat|"))
-async def ready_category_callback(callback: CallbackQuery, state: FSMContext):
-    cat = callback.data.split("|", 1)[1]
+@callbacks(cb.ReadyCategory)
+async def ready_category_callback(callback: CallbackQuery, callback_data: cb.ReadyCategory):
+    cat = callback_data.category
     spreads = spreads_data.get_ready_spreads_by_category(cat)
     if not spreads:
         await callback.answer("Нет раскладов в этой категории.", show_alert=True)
@@ -127,9 +133,9 @@ async def ready_category_callback(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("ready|"))
-async def show_ready_spread_callback(callback: CallbackQuery, state: FSMContext):
-    spread_id = callback.data.split("|", 1)[1]
+@callbacks(cb.ReadySpread)
+async def show_ready_spread_callback(callback: CallbackQuery, callback_data: cb.ReadySpread):
+    spread_id = callback_data.spread_id
     spread = spreads_data.get_ready_spread_by_id(spread_id)
     if not spread:
         await callback.answer("Расклад не найден.", show_alert=True)
@@ -142,21 +148,16 @@ async def show_ready_spread_callback(callback: CallbackQuery, state: FSMContext)
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("book_ready|"))
-async def book_with_ready_spread_callback(callback: CallbackQuery, state: FSMContext):
-    spread_id = callback.data.split("|", 1)[1]
+@callbacks(cb.BookReady)
+async def book_with_ready_spread_callback(callback: CallbackQuery, state: FSMContext, callback_data: cb.BookReady):
+    spread_id = callback_data.spread_id
     spread = spreads_data.get_ready_spread_by_id(spread_id)
     if not spread:
         await callback.answer("Расклад не найден.", show_alert=True)
         return
-    questions_text = "\n".join(spread["questions"])
     await state.clear()
     await state.set_state(BookingState.story)
-    await state.update_data(
-        prefilled_questions=questions_text,
-        prefilled_num_questions=len(spread["questions"]),
-        prefilled_amount=spread["price"],
-    )
+    await state.update_data(questions_ref=spreads_data.ready_ref(spread_id))
     try:
         await callback.message.edit_reply_markup(reply_markup=None)
     except Exception:
@@ -169,34 +170,80 @@ async def book_with_ready_spread_callback(callback: CallbackQuery, state: FSMCon
     await callback.answer()
 
 
-@router.callback_query(F.data.startswith("qcat|"))
-async def question_category_callback(callback: CallbackQuery, state: FSMContext):
-    cat_id = callback.data.split("|", 1)[1]
-    questions = spreads_data.get_category_questions(cat_id)
-    title = spreads_data.get_category_title(cat_id)
-    if not questions:
+def _selection_mask(data: dict, cat_id: str) -> int:
+    """Selected-questions bitmask stored in FSM data for the category (0 if none)."""
+    ref = data.get("selected_ref")
+    if ref and ref[0] == "qcat" and ref[1] == cat_id:
+        return ref[2]
+    return 0
+
+
+def _question_page_kb(cat_id: str, page: int, mask: int):
+    count, _ = spreads_data.question_ref_totals(spreads_data.category_ref(cat_id, mask))
+    return keyboards.kb_question_page(cat_id, page, spreads_data.page_selection_bits(mask, page), count)
+
+
+async def _show_question_page(callback: CallbackQuery, cat_id: str, page: int, mask: int):
+    # Page texts are prerendered in spreads_data; keyboards are cached in keyboards
+    text = spreads_data.get_category_page_text(cat_id, page)
+    kb = _question_page_kb(cat_id, page, mask)
+    try:
+        await callback.message.edit_text(text, reply_markup=kb)
+    except Exception:
+        await callback.message.answer(text, reply_markup=kb)
+
+
+@callbacks(cb.QuestionCategory)
+async def question_category_callback(callback: CallbackQuery, state: FSMContext, callback_data: cb.QuestionCategory):
+    cat_id = callback_data.category
+    if not spreads_data.get_category_page_count(cat_id):
         await callback.answer("Категория не найдена.", show_alert=True)
         return
-    lines = [f"{title}", "", "Напишите номера нужных вопросов через запятую (например: 1, 5, 10):", ""]
-    for i, q in enumerate(questions, 1):
-        lines.append(f"{i}. {q}")
-    text = "\n".join(lines)
-    if len(text) > 4000:
-        text = "\n".join(lines[:3] + [f"{i}. {q}" for i, q in enumerate(questions[:50], 1)])
-        text += "\n\n... (показаны первые 50). Напишите номера через запятую."
     await state.set_state(ChooseQuestionState.enter_numbers)
-    await state.update_data(question_category_id=cat_id, question_list=questions)
+    await state.update_data(question_category_id=cat_id, selected_ref=None)
+    await _show_question_page(callback, cat_id, 0, 0)
+    await callback.answer()
+
+
+@callbacks(cb.QuestionPage)
+async def question_page_callback(callback: CallbackQuery, state: FSMContext, callback_data: cb.QuestionPage):
+    cat_id, page = callback_data.category, callback_data.page
+    if not spreads_data.get_category_page_text(cat_id, page):
+        await callback.answer("Страница не найдена.", show_alert=True)
+        return
+    data = await state.get_data()
+    await _show_question_page(callback, cat_id, page, _selection_mask(data, cat_id))
+    await callback.answer()
+
+
+@callbacks(cb.QuestionToggle)
+async def question_toggle_callback(callback: CallbackQuery, state: FSMContext, callback_data: cb.QuestionToggle):
+    cat_id, page, number = callback_data.category, callback_data.page, callback_data.number
+    if not 1 <= number <= len(spreads_data.get_category_questions(cat_id)):
+        await callback.answer()
+        return
+    current_state = await state.get_state()
+    if current_state not in (None, ChooseQuestionState.enter_numbers.state):
+        # The user has already moved on to the booking steps
+        await callback.answer("Выбор вопросов уже завершён.")
+        return
+    data = await state.get_data()
+    mask = _selection_mask(data, cat_id) ^ (1 << (number - 1))
+    if current_state is None:
+        await state.set_state(ChooseQuestionState.enter_numbers)
+    await state.update_data(question_category_id=cat_id, selected_ref=spreads_data.category_ref(cat_id, mask))
     try:
-        await callback.message.edit_text(text)
+        await callback.message.edit_reply_markup(reply_markup=_question_page_kb(cat_id, page, mask))
     except Exception:
-        await callback.message.answer(text)
+        pass
     await callback.answer()
 
 
 @router.message(ChooseQuestionState.enter_numbers, F.text)
 async def receive_question_numbers(message: Message, state: FSMContext):
     data = await state.get_data()
-    questions = data.get("question_list", [])
+    cat_id = data.get("question_category_id")
+    questions = spreads_data.get_category_questions(cat_id)
     if not questions:
         await message.answer("Ошибка: список вопросов не найден. Начните заново из меню «Выбрать вопрос / расклад».", reply_markup=keyboards.main_menu_kb)
         await state.clear()
@@ -219,40 +266,31 @@ async def receive_question_numbers(message: Message, state: FSMContext):
             f"Не удалось разобрать номера. Введите числа от 1 до {len(questions)} через запятую (например: 1, 5, 10)."
         )
         return
-    selected = [questions[i - 1] for i in indices]
-    amount = len(selected) * spreads_data.QUESTION_PRICE
-    await state.update_data(
-        selected_questions="\n".join(selected),
-        selected_num_questions=len(selected),
-        selected_amount=amount,
-    )
+    ref = spreads_data.category_ref(cat_id, spreads_data.encode_selection(indices))
+    count, amount = spreads_data.question_ref_totals(ref)
+    await state.update_data(selected_ref=ref)
     summary = (
-        f"Выбрано вопросов: <b>{len(selected)}</b>. Сумма: <b>{amount}₽</b>.\n\n"
+        f"Выбрано вопросов: <b>{count}</b>. Сумма: <b>{amount}₽</b>.\n\n"
         "Нажмите кнопку ниже, чтобы записаться с этими вопросами (далее: ситуация, участники, фото, контакт, дата и время)."
     )
     await message.answer(
         summary,
-        reply_markup=keyboards.kb_after_question_selection(len(selected), amount),
+        reply_markup=keyboards.kb_after_question_selection(count, amount),
         parse_mode="HTML"
     )
 
 
-@router.callback_query(F.data == "book_custom")
+@callbacks(cb.BookCustom)
 async def book_with_custom_questions_callback(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
-    questions_text = data.get("selected_questions")
-    num = data.get("selected_num_questions", 0)
-    amount = data.get("selected_amount", 0)
-    if not questions_text or num <= 0:
+    ref = data.get("selected_ref")
+    num, amount = spreads_data.question_ref_totals(ref)
+    if num <= 0:
         await callback.answer("Сначала выберите вопросы (напишите номера через запятую).", show_alert=True)
         return
     await state.clear()
     await state.set_state(BookingState.story)
-    await state.update_data(
-        prefilled_questions=questions_text,
-        prefilled_num_questions=num,
-        prefilled_amount=amount,
-    )
+    await state.update_data(questions_ref=ref)
     try:
         await callback.message.edit_reply_markup(reply_markup=None)
     except Exception:
@@ -266,7 +304,7 @@ async def book_with_custom_questions_callback(callback: CallbackQuery, state: FS
 
 
 # Begin booking process when user selects "📅 Записаться"
-@router.message(F.text == "📅 Записаться")
+@texts("📅 Записаться")
 async def book_appointment(message: Message, state: FSMContext):
     await state.clear()
     await message.answer("Пожалуйста, опишите вашу ситуацию (краткая история).", reply_markup=None)
@@ -313,11 +351,10 @@ async def receive_photos(message: Message, state: FSMContext):
             await message.answer("Вы не отправили ни одной фотографии. Пожалуйста, отправьте хотя бы одно фото участника.")
             return
         # Если вопросы уже выбраны (готовый расклад или список) — переходим сразу к сумме и телефону
-        prefilled = data.get("prefilled_questions")
-        if prefilled:
-            num_questions = data.get("prefilled_num_questions", 0)
-            amount = data.get("prefilled_amount", 0)
-            await state.update_data(questions=prefilled, num_questions=num_questions, amount=amount)
+        ref = data.get("questions_ref")
+        if ref:
+            num_questions, amount = spreads_data.question_ref_totals(ref)
+            await state.update_data(num_questions=num_questions, amount=amount)
             await message.answer(bot_texts.price_summary(num_questions, amount), parse_mode="HTML")
             await message.answer("Теперь отправьте свой номер телефона для связи.", reply_markup=keyboards.contact_kb)
             await state.set_state(BookingState.phone)
@@ -375,52 +412,99 @@ async def receive_phone(message: Message, state: FSMContext):
     # Save phone and update user record
     user = message.from_user
     await database.update_user_phone(user.id, phone_number)
-    await state.update_data(phone=phone_number)
+    await state.update_data(phone=phone_number, reader_id=None)
+    # Several readers: let the client pick one (or any) before the dates
+    readers = await database.get_readers()
+    if len(readers) > 1:
+        await message.answer("Выберите таролога:", reply_markup=keyboards.kb_readers(readers))
+        await state.set_state(BookingState.select_reader)
+        return
     # Show available dates
     free_dates = await database.get_free_dates()
     if not free_dates:
-        await message.answer("Извините, сейчас нет доступных дат для записи. Попробуйте позже.", reply_markup=keyboards.main_menu_kb)
-        await state.clear()
+        await _offer_waitlist(message, state)
         return
-    from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-
-    date_buttons = []
-    for date_str in free_dates:
-        try:
-            dt = datetime.strptime(date_str, "%Y-%m-%d")
-            display = dt.strftime("%d.%m.%Y")
-        except:
-            display = date_str
-        date_buttons.append([InlineKeyboardButton(text=display, callback_data=f"date|{date_str}")])
-
-    date_kb = InlineKeyboardMarkup(inline_keyboard=date_buttons)
+    date_kb = keyboards.kb_dates(free_dates)
     await message.answer("Выберите дату:", reply_markup=date_kb)
     await state.set_state(BookingState.select_date)
 
-# State: waiting for date selection (inline button)
-@router.callback_query(BookingState.select_date)
-async def select_date_callback(callback: CallbackQuery, state: FSMContext):
-    data = callback.data
-    if not data or not data.startswith("date|"):
+# State: waiting for reader selection (inline button); reader_id None in the FSM means any reader
+@callbacks(cb.PickReader, state=BookingState.select_reader)
+async def select_reader_callback(callback: CallbackQuery, state: FSMContext, callback_data: cb.PickReader):
+    reader_id = callback_data.reader_id or None
+    free_dates = await database.get_free_dates(reader_id)
+    if not free_dates:
+        if reader_id is not None and await database.get_free_dates():
+            await callback.answer("У этого таролога нет свободного времени, выберите другого.", show_alert=True)
+            return
+        await callback.message.edit_text("Нет доступных слотов для записи на текущий момент.")
+        await _offer_waitlist(callback.message, state)
+        await callback.answer()
+        return
+    await state.update_data(reader_id=reader_id)
+    await callback.message.edit_text("Выберите дату:", reply_markup=keyboards.kb_dates(free_dates))
+    await state.set_state(BookingState.select_date)
+    await callback.answer()
+
+async def _offer_waitlist(message: Message, state: FSMContext):
+    """No free dates: keep the filled-in booking data and offer the waitlist."""
+    await state.set_state(BookingState.select_date)
+    await message.answer("Извините, сейчас нет доступных дат для записи. Ваши ответы сохранены.",
+                         reply_markup=keyboards.main_menu_kb)
+    await message.answer("Встаньте в лист ожидания — мы напишем, как только освободится время.",
+                         reply_markup=keyboards.kb_waitlist_join())
+
+# Waitlist: subscribe to the next days (offered when there are no free dates)
+@callbacks(cb.WaitlistJoin)
+async def waitlist_join_callback(callback: CallbackQuery, callback_data: cb.WaitlistJoin):
+    today = local_time.today()
+    dates = [(today + timedelta(days=i)).isoformat() for i in range(max(1, min(callback_data.days, 60)))]
+    await database.join_waitlist(callback.from_user.id, dates)
+    await callback.message.edit_text(
+        f"Вы в листе ожидания на {display_date(dates[0])} — {display_date(dates[-1])}. "
+        "Как только освободится время, придёт уведомление.")
+    await callback.answer()
+    # A slot may have been freed while the user was deciding
+    for free_date in await database.get_free_dates():
+        if free_date <= dates[-1]:
+            wake_waitlist(free_date)
+
+# Waitlist offer: continue the saved booking with the freed date
+@callbacks(cb.WaitlistBook)
+async def waitlist_book_callback(callback: CallbackQuery, state: FSMContext, callback_data: cb.WaitlistBook):
+    current_state = await state.get_state()
+    if current_state in (BookingState.payment_info.state, BookingState.waiting_receipt.state):
+        await callback.answer("Сначала завершите текущую запись.", show_alert=True)
+        return
+    data = await state.get_data()
+    if not data.get("phone"):
         await callback.answer()
+        await callback.message.answer("Данные записи не сохранились. Нажмите «📅 Записаться», чтобы заполнить их заново.",
+                                      reply_markup=keyboards.main_menu_kb)
         return
-    selected_date = data.split("|", 1)[1]
-    free_times = await database.get_free_times(selected_date)
+    # The waitlist is per date, not per reader: offer the freed time of any reader
+    await state.update_data(reader_id=None)
+    await state.set_state(BookingState.select_date)
+    await select_date_callback(callback, state, cb.PickDate(date=callback_data.date))
+
+@callbacks(cb.WaitlistLeave)
+async def waitlist_leave_callback(callback: CallbackQuery):
+    await database.leave_waitlist(callback.from_user.id)
+    await callback.message.edit_text("Вы больше не в листе ожидания.")
+    await callback.answer()
+
+# State: waiting for date selection (inline button)
+@callbacks(cb.PickDate, state=BookingState.select_date)
+async def select_date_callback(callback: CallbackQuery, state: FSMContext, callback_data: cb.PickDate):
+    selected_date = callback_data.date
+    reader_id = (await state.get_data()).get("reader_id")
+    free_times = await database.get_free_times(selected_date, reader_id)
     if not free_times:
         # No times available for that date (possibly taken just now)
         await callback.answer("Нет доступного времени на эту дату.", show_alert=True)
-        free_dates = await database.get_free_dates()
+        free_dates = await database.get_free_dates(reader_id)
         if free_dates:
-            from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-            date_buttons = []
-            for date_str in free_dates:
-                try:
-                    dt = datetime.strptime(date_str, "%Y-%m-%d")
-                    display = dt.strftime("%d.%m.%Y")
-                except:
-                    display = date_str
-                date_buttons.append([InlineKeyboardButton(text=display, callback_data=f"date|{date_str}")])
-            date_kb = InlineKeyboardMarkup(inline_keyboard=date_buttons)
+            date_kb = keyboards.kb_dates(free_dates)
             try:
                 await callback.message.edit_text("Выберите дату:", reply_markup=date_kb)
             except:
@@ -428,18 +512,18 @@ async def select_date_callback(callback: CallbackQuery, state: FSMContext):
             # Remain in select_date state
         else:
             await callback.message.edit_text("Нет доступных слотов для записи на текущий момент.")
-            await state.clear()
+            await _offer_waitlist(callback.message, state)
         await callback.answer()
         return
     # List available times for selected date
     from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
     time_buttons = [
-        [InlineKeyboardButton(text=time, callback_data=f"time|{slot_id}")]
+        [InlineKeyboardButton(text=time, callback_data=cb.PickTime(slot_id=slot_id).pack())]
         for slot_id, time in free_times
     ]
     time_kb = InlineKeyboardMarkup(inline_keyboard=time_buttons)
     try:
-        await callback.message.edit_text(f"Дата {datetime.strptime(selected_date, '%Y-%m-%d').strftime('%d.%m.%Y')} выбрана. Выберите время:", reply_markup=time_kb)
+        await callback.message.edit_text(f"Дата {display_date(selected_date)} выбрана. Выберите время:", reply_markup=time_kb)
     except:
         await callback.message.answer("Выберите время:", reply_markup=time_kb)
     await state.update_data(selected_date=selected_date)
@@ -447,33 +531,30 @@ async def select_date_callback(callback: CallbackQuery, state: FSMContext):
     await callback.answer()
 
 # State: waiting for time selection (inline button)
-@router.callback_query(BookingState.select_time)
-async def select_time_callback(callback: CallbackQuery, state: FSMContext):
-    data = callback.data
-    if not data or not data.startswith("time|"):
-        await callback.answer()
-        return
-    try:
-        slot_id = int(data.split("|", 1)[1])
-    except:
-        await callback.answer()
-        return
+@callbacks(cb.PickTime, state=BookingState.select_time)
+async def select_time_callback(callback: CallbackQuery, state: FSMContext, callback_data: cb.PickTime):
+    slot_id = callback_data.slot_id
     fsm_data = await state.get_data()
     story = fsm_data.get("story")
     participants = fsm_data.get("participants")
     photos = fsm_data.get("photos", [])
     questions = fsm_data.get("questions")
+    if fsm_data.get("questions_ref"):
+        # Questions picked from the catalog are stored by reference; resolve the text now
+        questions = spreads_data.resolve_questions(fsm_data["questions_ref"])
     num_questions = fsm_data.get("num_questions", 0)
     amount = fsm_data.get("amount", 0)
     user_id = callback.from_user.id
-    booking_id = await database.reserve_slot_and_create_booking(user_id, slot_id, story, participants, photos, questions, num_questions, amount)
+    reader_id = fsm_data.get("reader_id")
+    booking_id = await database.reserve_slot_and_create_booking(user_id, slot_id, story, participants, photos, questions, num_questions, amount,
+                                                                any_reader=reader_id is None)
     if not booking_id:
         # If slot just got taken by someone else
-        free_times = await database.get_free_times(fsm_data.get("selected_date"))
+        free_times = await database.get_free_times(fsm_data.get("selected_date"), reader_id)
         if free_times:
             from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
             time_buttons = [
-                [InlineKeyboardButton(text=t, callback_data=f"time|{sid}")]
+                [InlineKeyboardButton(text=t, callback_data=cb.PickTime(slot_id=sid).pack())]
                 for sid, t in free_times
             ]
             time_kb = InlineKeyboardMarkup(inline_keyboard=time_buttons)
@@ -485,23 +566,14 @@ async def select_time_callback(callback: CallbackQuery, state: FSMContext):
             return
         else:
             # If no times left on that date, go back to date selection
-            free_dates = await database.get_free_dates()
+            free_dates = await database.get_free_dates(reader_id)
             if free_dates:
-                from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-                date_buttons = []
-                for date_str in free_dates:
-                    try:
-                        dt = datetime.strptime(date_str, "%Y-%m-%d")
-                        display = dt.strftime("%d.%m.%Y")
-                    except:
-                        display = date_str
-                    date_buttons.append([InlineKeyboardButton(text=display, callback_data=f"date|{date_str}")])
-                date_kb = InlineKeyboardMarkup(inline_keyboard=date_buttons)
+                date_kb = keyboards.kb_dates(free_dates)
                 await callback.message.edit_text("Выберите дату:", reply_markup=date_kb)
                 await state.set_state(BookingState.select_date)
             else:
                 await callback.message.edit_text("Свободные слоты отсутствуют.")
-                await state.clear()
+                await _offer_waitlist(callback.message, state)
             await callback.answer("Выбранное время уже занято.", show_alert=True)
             return
     # Slot reserved and booking created
@@ -512,25 +584,17 @@ async def select_time_callback(callback: CallbackQuery, state: FSMContext):
     except:
         pass
     # Compose payment instructions
-    slot_cur = await database.db.execute("SELECT date, time FROM slots WHERE id=?", (slot_id,))
-    slot_row = await slot_cur.fetchone()
-    if slot_row:
-        date_obj = datetime.strptime(slot_row['date'], "%Y-%m-%d")
-        date_disp = date_obj.strftime("%d.%m.%Y")
-        time_str = slot_row['time']
+    slot = await database.get_slot(slot_id)
+    if slot:
+        date_disp = display_date(slot.date)
+        time_str = slot.time
     else:
         date_disp = fsm_data.get('selected_date')
         time_str = ""
     await callback.message.answer(bot_texts.payment_instructions(amount, date_disp, time_str), parse_mode="HTML")
     await callback.message.answer("УКАЖИТЕ ОТ КОГО ПЕРЕВОД и номер карты, на которую был сделан перевод (например: От Анны Гавриловны К., карта: (номер карты)).")
     await state.set_state(BookingState.payment_info)
-    # Schedule auto-unlock job in 15 minutes
-    from scheduler import scheduler, unlock_timeout
-    run_time = datetime.now() + timedelta(minutes=15)
-    try:
-        scheduler.add_job(unlock_timeout, "date", run_date=run_time, args=[booking_id], id=f"unlock_{booking_id}")
-    except Exception as e:
-        logging.error(f"Failed to schedule unlock job: {e}")
+    # Unpaid bookings are cancelled by the expire_unpaid_bookings job (see scheduler.py)
     await callback.answer()
 
 # State: waiting for payment info
@@ -556,38 +620,30 @@ async def receive_receipt(message: Message, state: FSMContext):
         await state.clear()
         return
     record = await database.get_booking_by_id(booking_id)
-    if not record or record["status"] != config.STATUS_WAITING_PAYMENT:
+    if not record or record.status != config.STATUS_WAITING_PAYMENT:
         await message.answer("Время ожидания истекло или запись уже отменена.", reply_markup=keyboards.main_menu_kb)
         await state.clear()
         return
     # Update status to "CHECKING" (awaiting admin confirmation)
-    await database.update_booking_status(booking_id, config.STATUS_CHECKING)
-    # Cancel the scheduled unlock job
-    from scheduler import scheduler
-    try:
-        scheduler.remove_job(f"unlock_{booking_id}")
-    except Exception as e:
-        logging.warning(f"Unlock job removal failed or not found: {e}")
+    await database.update_booking_status(booking_id, config.STATUS_CHECKING, actor=message.from_user.id)
     # Notify admin group with booking details
     details = await database.get_booking_details(booking_id)
     if details:
-        user_name = details["user_name"] or ""
-        username = details["username"] or ""
-        phone = details["phone"] or ""
-        story = details["story"] or ""
-        participants = details["participants"] or ""
-        questions = details["questions"] or ""
-        date = details["date"] or ""
-        time = details["time"] or ""
-        num_q = details["num_questions"]
-        amount = details["amount"]
-        photos_json = details["photos"]
-        participant_photos = []
-        if photos_json:
-            try:
-                participant_photos = json.loads(photos_json)
-            except:
-                participant_photos = []
+        user_name = details.user_name or ""
+        username = details.username or ""
+        phone = details.phone or ""
+        story = details.story or ""
+        participants = details.participants or ""
+        questions = details.questions or ""
+        date_disp = display_date(details.date)
+        time = details.time or ""
+        num_q = details.num_questions
+        amount = details.amount
+        participant_photos = details.photos
+        # With several readers the admins need to know whose session it is
+        reader_line = ""
+        if details.reader_name and len(await database.get_readers(active_only=False)) > 1:
+            reader_line = f"🔮 <b>Таролог:</b> {html.escape(details.reader_name)}\n"
         # Send participants' photos to admin group
         try:
             if participant_photos:
@@ -601,13 +657,13 @@ async def receive_receipt(message: Message, state: FSMContext):
         except Exception as e:
             # Handle possible supergroup migration: extract new chat id and retry once
             err_text = str(e)
-            logging.error(f"Failed to send participant photos to admin group: {err_text}")
+            logger.error(f"Failed to send participant photos to admin group: {err_text}")
             m = re.search(r"-100\d+", err_text)
             if m:
                 try:
                     new_id = int(m.group())
                     config.ADMIN_GROUP_ID = new_id
-                    logging.info(f"Detected admin group migration. Updating ADMIN_GROUP_ID to {new_id} and retrying media group send.")
+                    logger.info(f"Detected admin group migration. Updating ADMIN_GROUP_ID to {new_id} and retrying media group send.")
                     if participant_photos:
                         media_group = []
                         for idx, pid in enumerate(participant_photos):
@@ -617,7 +673,7 @@ async def receive_receipt(message: Message, state: FSMContext):
                                 media_group.append(InputMediaPhoto(media=pid))
                         await config.bot.send_media_group(chat_id=config.ADMIN_GROUP_ID, media=media_group)
                 except Exception as e2:
-                    logging.error(f"Retry after migration failed: {e2}")
+                    logger.error(f"Retry after migration failed: {e2}")
         # Send payment receipt photo
         try:
             receipt_file_id = message.photo[-1].file_id
@@ -626,18 +682,18 @@ async def receive_receipt(message: Message, state: FSMContext):
             await config.bot.send_photo(chat_id=config.ADMIN_GROUP_ID, photo=receipt_file_id, caption=caption)
         except Exception as e:
             err_text = str(e)
-            logging.error(f"Failed to send receipt photo to admin group: {err_text}")
+            logger.error(f"Failed to send receipt photo to admin group: {err_text}")
             m = re.search(r"-100\d+", err_text)
             if m:
                 try:
                     new_id = int(m.group())
                     config.ADMIN_GROUP_ID = new_id
-                    logging.info(f"Detected admin group migration. Updating ADMIN_GROUP_ID to {new_id} and retrying receipt send.")
+                    logger.info(f"Detected admin group migration. Updating ADMIN_GROUP_ID to {new_id} and retrying receipt send.")
                     payment_info = data.get("payment_info", "")
                     caption = f"Чек от @{username or user_name}\n{payment_info}" if payment_info else f"Чек от @{username or user_name}"
                     await config.bot.send_photo(chat_id=config.ADMIN_GROUP_ID, photo=receipt_file_id, caption=caption)
                 except Exception as e2:
-                    logging.error(f"Retry after migration (receipt) failed: {e2}")
+                    logger.error(f"Retry after migration (receipt) failed: {e2}")
         # Send booking details text with inline confirm/reject buttons
         details_text = (
             f"📌 <b>Запись #{booking_id}</b>\n\n"
@@ -647,15 +703,16 @@ async def receive_receipt(message: Message, state: FSMContext):
             f"👥 <b>Участники:</b>\n{participants}\n\n"
             f"❓ <b>Количество вопросов:</b> {num_q}\n"
             f"💬 <b>Вопросы:</b>\n{questions}\n\n"
-            f"📅 <b>Дата:</b> {datetime.strptime(date, '%Y-%m-%d').strftime('%d.%m.%Y')}  ⏰ <b>Время:</b> {time}\n"
+            f"📅 <b>Дата:</b> {date_disp}  ⏰ <b>Время:</b> {time}\n"
+            f"{reader_line}"
             f"💵 <b>Сумма:</b> {amount} ₽\n"
             f"⏳ <b>Статус:</b> Ожидает подтверждения оплаты"
         )
         from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
         admin_kb = InlineKeyboardMarkup(inline_keyboard=[
             [
-                InlineKeyboardButton(text="✅ Подтвердить чек", callback_data=f"confirm|{booking_id}"),
-                InlineKeyboardButton(text="❌ Отклонить", callback_data=f"reject|{booking_id}")
+                InlineKeyboardButton(text="✅ Подтвердить чек", callback_data=cb.ConfirmPayment(booking_id=booking_id).pack()),
+                InlineKeyboardButton(text="❌ Отклонить", callback_data=cb.RejectPayment(booking_id=booking_id).pack())
             ]
         ])
         try:
@@ -668,13 +725,13 @@ async def receive_receipt(message: Message, state: FSMContext):
             await database.set_booking_admin_message_id(booking_id, sent_msg.message_id)
         except Exception as e:
             err_text = str(e)
-            logging.error(f"Failed to send booking details to admin group: {err_text}")
+            logger.error(f"Failed to send booking details to admin group: {err_text}")
             m = re.search(r"-100\d+", err_text)
             if m:
                 try:
                     new_id = int(m.group())
                     config.ADMIN_GROUP_ID = new_id
-                    logging.info(f"Detected admin group migration. Updating ADMIN_GROUP_ID to {new_id} and retrying details send.")
+                    logger.info(f"Detected admin group migration. Updating ADMIN_GROUP_ID to {new_id} and retrying details send.")
                     sent_msg = await config.bot.send_message(
                         chat_id=config.ADMIN_GROUP_ID,
                         text=details_text,
@@ -683,13 +740,13 @@ async def receive_receipt(message: Message, state: FSMContext):
                     )
                     await database.set_booking_admin_message_id(booking_id, sent_msg.message_id)
                 except Exception as e2:
-                    logging.error(f"Retry after migration (details) failed: {e2}")
+                    logger.error(f"Retry after migration (details) failed: {e2}")
     # Acknowledge user
     await message.answer("Чек получен. Ожидайте подтверждения администрации.", reply_markup=keyboards.main_menu_kb)
     await state.clear()
 
 # List the user's bookings and provide cancel options
-@router.message(F.text == "📋 Мои записи")
+@texts("📋 Мои записи")
 async def list_bookings(message: Message):
     user_id = message.from_user.id
     records = await database.get_user_bookings(user_id)
@@ -697,73 +754,42 @@ async def list_bookings(message: Message):
         await message.answer("У вас нет активных записей.", reply_markup=keyboards.main_menu_kb)
     else:
         text_lines = ["Ваши записи:"]
+        text_lines += format_booking_rows(records, labels=CLIENT_STATUS_LABELS)
         from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-        buttons = []
-        for rec in records:
-            status = rec["status"]
-            date = rec["date"]
-            time = rec["time"]
-            cancel_allowed = status in (config.STATUS_WAITING_PAYMENT, config.STATUS_CHECKING)
-            # Map status to Russian text
-            if status == config.STATUS_WAITING_PAYMENT:
-                status_text = "Ожидает оплаты"
-            elif status == config.STATUS_CHECKING:
-                status_text = "На подтверждении"
-            elif status == config.STATUS_CONFIRMED:
-                status_text = "Подтверждена"
-                if not cancel_allowed:
-                    status_text += " (отменить можно через администратора)"
-            else:
-                status_text = status
-            date_display = datetime.strptime(date, "%Y-%m-%d").strftime("%d.%m.%Y")
-            text_lines.append(f"- {date_display} {time} — {status_text}")
-            if cancel_allowed:
-                buttons.append([InlineKeyboardButton(text=f"Отменить {date_display} {time}", callback_data=f"cancel|{rec['id']}")])
+        buttons = [
+            [InlineKeyboardButton(text=f"Отменить {display_date(rec.date)} {rec.time}",
+                                  callback_data=cb.CancelBooking(booking_id=rec.id).pack())]
+            for rec in records
+            if rec.status in (config.STATUS_WAITING_PAYMENT, config.STATUS_CHECKING)
+        ]
         cancel_kb = InlineKeyboardMarkup(inline_keyboard=buttons) if buttons else None
         await message.answer("\n".join(text_lines), reply_markup=cancel_kb)
 
 # Handle inline cancel button for a specific booking
-@router.callback_query(F.data.startswith("cancel|"))
-async def cancel_booking_callback(callback: CallbackQuery, state: FSMContext):
-    try:
-        booking_id = int(callback.data.split("|", 1)[1])
-    except:
-        await callback.answer()
-        return
+@callbacks(cb.CancelBooking)
+async def cancel_booking_callback(callback: CallbackQuery, callback_data: cb.CancelBooking):
+    booking_id = callback_data.booking_id
     record = await database.get_booking_by_id(booking_id)
-    if record is None or record["user_id"] != callback.from_user.id:
+    if record is None or record.user_id != callback.from_user.id:
         await callback.answer("Ошибка или запись не найдена.", show_alert=True)
         return
-    status = record["status"]
+    status = record.status
     if status == config.STATUS_CONFIRMED:
         await callback.answer("Подтвержденную запись может отменить только администратор.", show_alert=True)
         return
     if status in (config.STATUS_WAITING_PAYMENT, config.STATUS_CHECKING):
-        await database.update_booking_status(booking_id, config.STATUS_CANCELLED)
-        await database.db.execute("UPDATE slots SET is_taken=0 WHERE id=?", (record["slot_id"],))
-        await database.db.commit()
-        logging.info(f"Booking {booking_id} cancelled by user via inline button")
-        # Remove scheduled unlock job (if any)
-        from scheduler import scheduler
-        try:
-            scheduler.remove_job(f"unlock_{booking_id}")
-        except:
-            pass
-        # Notify admin group
-        admin_msg_id = record["admin_message_id"]
-        if admin_msg_id:
-            try:
-                await config.bot.edit_message_text(chat_id=config.ADMIN_GROUP_ID, message_id=admin_msg_id,
-                                                  text=f"Запись #{booking_id} отменена пользователем.")
-            except Exception as e:
-                logging.error(f"Failed to edit admin message on user cancel: {e}")
+        # Notify admin group (through the outbox, committed with the cancellation)
+        if record.admin_message_id:
+            notice = outbox.to_admin_group(f"Запись #{booking_id} отменена пользователем.", record.admin_message_id)
         else:
-            try:
-                if config.ADMIN_GROUP_ID:
-                    await config.bot.send_message(config.ADMIN_GROUP_ID,
-                        f"Запись #{booking_id} отменена пользователем (до оплаты).")
-            except Exception as e:
-                logging.error(f"Failed to notify admin group of cancellation: {e}")
+            notice = outbox.to_admin_group(f"Запись #{booking_id} отменена пользователем (до оплаты).")
+        await database.release_booking(booking_id, config.STATUS_CANCELLED, record.slot_id,
+                                       actor=callback.from_user.id, notify=[notice])
+        outbox.wake()
+        logger.info(f"Booking {booking_id} cancelled by user via inline button",
+                    extra={"booking_id": booking_id, "user_id": callback.from_user.id})
+        if record.slot_id and record.date:
+            wake_waitlist(record.date.isoformat())
         # Update the list message by removing inline keyboard
         try:
             await callback.message.edit_reply_markup(reply_markup=None)
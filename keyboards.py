@@ -1,5 +1,9 @@
+from functools import lru_cache
+
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 
+import callback_data as cb
+
 # Main menu keyboard for client
 main_menu_kb = ReplyKeyboardMarkup(
     keyboard=[
@@ -17,16 +21,16 @@ main_menu_kb = ReplyKeyboardMarkup(
 def kb_choose_type():
     """Выбор: собрать свой (вопросы) или готовый расклад."""
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📝 Выбрать вопросы из списка", callback_data="spread_type|questions")],
-        [InlineKeyboardButton(text="📦 Готовый расклад", callback_data="spread_type|ready")],
+        [InlineKeyboardButton(text="📝 Выбрать вопросы из списка", callback_data=cb.SpreadType(kind="questions").pack())],
+        [InlineKeyboardButton(text="📦 Готовый расклад", callback_data=cb.SpreadType(kind="ready").pack())],
     ])
 
 
 def kb_ready_category():
     """Категории готовых раскладов: Отношения / Общие."""
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="💕 Отношения", callback_data="ready_cat|relations")],
-        [InlineKeyboardButton(text="📌 Общие", callback_data="ready_cat|general")],
+        [InlineKeyboardButton(text="💕 Отношения", callback_data=cb.ReadyCategory(category="relations").pack())],
+        [InlineKeyboardButton(text="📌 Общие", callback_data=cb.ReadyCategory(category="general").pack())],
     ])
 
 
@@ -37,7 +41,7 @@ def kb_ready_spreads(spreads: list):
         # callback_data до 64 байт; id короткий
         buttons.append([InlineKeyboardButton(
             text=f"{s['name']} — {s['price']}₽",
-            callback_data=f"ready|{s['id']}"
+            callback_data=cb.ReadySpread(spread_id=s['id']).pack()
         )])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
@@ -45,7 +49,7 @@ def kb_ready_spreads(spreads: list):
 def kb_after_ready_spread(spread_id: str):
     """После показа расклада: записаться с этим раскладом."""
     return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="📅 Записаться с этим раскладом", callback_data=f"book_ready|{spread_id}")],
+        [InlineKeyboardButton(text="📅 Записаться с этим раскладом", callback_data=cb.BookReady(spread_id=spread_id).pack())],
     ])
 
 
@@ -62,11 +66,77 @@ def kb_question_categories():
     for cid in QUESTION_CATEGORIES.keys():
         buttons.append([InlineKeyboardButton(
             text=labels.get(cid, cid),
-            callback_data=f"qcat|{cid}"
+            callback_data=cb.QuestionCategory(category=cid).pack()
         )])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+@lru_cache(maxsize=1024)
+def kb_question_page(category_id: str, page: int, page_bits: int, selected_count: int):
+    """Страница вопросов категории: номера-переключатели (✅ — выбран), листание и запись.
+    page_bits — биты выбора только этой страницы, поэтому готовые клавиатуры берутся из кэша."""
+    from spreads_data import QUESTIONS_PAGE_SIZE, QUESTION_PRICE, get_category_questions, get_category_page_count
+    total = len(get_category_questions(category_id))
+    page_count = get_category_page_count(category_id)
+    start = page * QUESTIONS_PAGE_SIZE
+    buttons = []
+    row = []
+    for i, n in enumerate(range(start + 1, min(start + QUESTIONS_PAGE_SIZE, total) + 1)):
+        text = f"✅ {n}" if page_bits >> i & 1 else str(n)
+        row.append(InlineKeyboardButton(text=text, callback_data=cb.QuestionToggle(category=category_id, page=page, number=n).pack()))
+        if len(row) == 5:
+            buttons.append(row)
+            row = []
+    if row:
+        buttons.append(row)
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=cb.QuestionPage(category=category_id, page=page - 1).pack()))
+    if page < page_count - 1:
+        nav.append(InlineKeyboardButton(text="Далее ➡️", callback_data=cb.QuestionPage(category=category_id, page=page + 1).pack()))
+    if nav:
+        buttons.append(nav)
+    if selected_count:
+        buttons.append([InlineKeyboardButton(
+            text=f"📅 Записаться с выбранными ({selected_count} вопр. — {selected_count * QUESTION_PRICE}₽)",
+            callback_data=cb.BookCustom().pack()
+        )])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
+
+def kb_readers(readers: list):
+    """Выбор таролога перед датой; «Любой» показывает свободное время всех."""
+    rows = [[InlineKeyboardButton(text="✨ Любой", callback_data=cb.PickReader(reader_id=0).pack())]]
+    rows += [[InlineKeyboardButton(text=f"🔮 {r.name}", callback_data=cb.PickReader(reader_id=r.id).pack())]
+             for r in readers]
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def kb_dates(free_dates: list):
+    """Свободные даты для записи (ISO-строки), по одной кнопке в ряд."""
+    from formatting import display_date
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=display_date(d), callback_data=cb.PickDate(date=d).pack())]
+        for d in free_dates
+    ])
+
+
+def kb_waitlist_join():
+    """Нет свободных дат: встать в лист ожидания на ближайшие дни."""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔔 Ждать слот в ближайшие 7 дней", callback_data=cb.WaitlistJoin(days=7).pack())],
+        [InlineKeyboardButton(text="🔔 Ждать слот в ближайшие 30 дней", callback_data=cb.WaitlistJoin(days=30).pack())],
+    ])
+
+
+def kb_waitlist_offer(date_iso: str):
+    """Уведомление из листа ожидания: перейти к выбору времени или отписаться."""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🕐 Выбрать время", callback_data=cb.WaitlistBook(date=date_iso).pack())],
+        [InlineKeyboardButton(text="Больше не ждать", callback_data=cb.WaitlistLeave().pack())],
+    ])
+
+
 def kb_after_question_selection(count: int, amount: int):
     """После ввода номеров вопросов: записаться с выбранными (не используем callback, просто кнопка в сообщении или текст)."""
     # Можно было бы inline "Записаться", но тогда нужен callback с сохранением в state.
@@ -75,7 +145,7 @@ def kb_after_question_selection(count: int, amount: int):
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(
             text=f"📅 Записаться с выбранными ({count} вопр. — {amount}₽)",
-            callback_data="book_custom"
+            callback_data=cb.BookCustom().pack()
         )],
     ])
 
@@ -0,0 +1,90 @@
+import asyncio
+import functools
+import logging
+import os
+import socket
+import time
+import uuid
+
+import config
+import database
+
+logger = logging.getLogger(__name__)
+
+
+class LeaderElector:
+    """Leader election between bot processes through a lease row in the shared database.
+
+    Every instance tries to take or renew the lease every ttl/3 seconds. The
+    holder stays leader while it keeps renewing; when it dies the lease expires
+    and the next instance to try takes it over, so a new leader appears within
+    about `ttl` seconds. A leader that cannot renew (database errors) steps down
+    once its last lease has run out.
+    """
+
+    def __init__(self, name: str, ttl: float):
+        self.name = name
+        self.ttl = ttl
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self._expires_at = 0.0
+        self._task = None
+        self._on_elected = None
+        self._on_demoted = None
+
+    async def _tick(self):
+        now = time.time()
+        try:
+            held = await database.acquire_lease(self.name, self.instance_id, now, now + self.ttl)
+            if held:
+                self._expires_at = now + self.ttl
+        except Exception as e:
+            logger.warning(f"Lease {self.name} renewal failed: {e}")
+            held = self.is_leader and now < self._expires_at
+        if held == self.is_leader:
+            return
+        self.is_leader = held
+        logger.info(f"Instance {self.instance_id} {'is now' if held else 'is no longer'} the {self.name} leader")
+        callback = self._on_elected if held else self._on_demoted
+        if callback is not None:
+            try:
+                await callback()
+            except Exception as e:
+                logger.exception(f"Leader {'election' if held else 'demotion'} callback failed: {e}")
+
+    async def _run(self):
+        while True:
+            await self._tick()
+            await asyncio.sleep(self.ttl / 3)
+
+    async def start(self, on_elected=None, on_demoted=None):
+        """Try to become leader right away, then keep the lease in the background."""
+        self._on_elected = on_elected
+        self._on_demoted = on_demoted
+        await self._tick()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop renewing and hand the lease over immediately (graceful shutdown)."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self.is_leader:
+            self.is_leader = False
+            try:
+                await database.release_lease(self.name, self.instance_id)
+            except Exception as e:
+                logger.warning(f"Failed to release lease {self.name}: {e}")
+
+
+# Lease for scheduler jobs that must run in one process only
+elector = LeaderElector("scheduler", config.LEADER_LEASE_SECONDS)
+
+
+def leader_only(job):
+    """Decorator for scheduler jobs: run only in the instance holding the lease."""
+    @functools.wraps(job)
+    async def wrapper(*args, **kwargs):
+        if elector.is_leader:
+            return await job(*args, **kwargs)
+    return wrapper
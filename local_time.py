@@ -0,0 +1,47 @@
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+import config
+
+# Slot dates and times are wall-clock values in config.TIMEZONE (Moscow by
+# default, as the texts say "МСК"), whatever the server's own timezone is.
+# Instants are stored as UTC epoch seconds (slots.starts_at, bookings.starts_at).
+
+TZ = ZoneInfo(config.TIMEZONE)
+
+
+def now() -> datetime:
+    return datetime.now(TZ)
+
+
+def today() -> date:
+    return now().date()
+
+
+def today_iso() -> str:
+    return today().isoformat()
+
+
+def day_start(day: date) -> int:
+    """Epoch seconds of local midnight at the start of `day`."""
+    return int(datetime.combine(day, time(), TZ).timestamp())
+
+
+def days_ago_start(days: int) -> int:
+    """Epoch seconds of local midnight `days` days before today."""
+    return day_start(today() - timedelta(days=days))
+
+
+@lru_cache(maxsize=4096)
+def starts_at(date_iso: Optional[str], time_str: Optional[str]) -> Optional[int]:
+    """Epoch seconds of a slot given as YYYY-MM-DD and HH:MM local time; None if either is malformed."""
+    try:
+        return int(datetime.combine(date.fromisoformat(date_iso), time.fromisoformat(time_str), TZ).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+
+def from_epoch(ts: int) -> datetime:
+    return datetime.fromtimestamp(ts, TZ)
@@ -0,0 +1,93 @@
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+
+import config
+
+# Record attributes (passed via `extra=`) that are copied into the JSON line
+CONTEXT_FIELDS = ("booking_id", "user_id", "slot_id")
+
+
+class JsonFormatter(logging.Formatter):
+    """Format a record as a single-line JSON object (one record per line)."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                payload[field] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False)
+
+
+class TracebackQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that keeps a record's traceback apart from its message.
+
+    The stock prepare() appends the formatted traceback to msg and clears
+    exc_info and exc_text, so JsonFormatter would never see it. Here the
+    traceback is still formatted on the logging side (no frames stay referenced
+    from the queue) but kept in exc_text for the formatters in the listener.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+def _build_file_handler() -> logging.Handler:
+    """Rotating file handler: by time if LOG_ROTATE_WHEN is set, otherwise by size."""
+    if config.LOG_ROTATE_WHEN:
+        handler = logging.handlers.TimedRotatingFileHandler(
+            config.LOG_FILE, when=config.LOG_ROTATE_WHEN,
+            backupCount=config.LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            config.LOG_FILE, maxBytes=config.LOG_MAX_BYTES,
+            backupCount=config.LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+    handler.setFormatter(JsonFormatter())
+    return handler
+
+
+def setup_logging() -> logging.handlers.QueueListener:
+    """Configure logging so that the event loop only enqueues records.
+
+    File and console output are done by a QueueListener thread. Returns the
+    started listener; call `stop()` on shutdown to flush pending records.
+    """
+    log_queue = queue.SimpleQueue()
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(name)s: %(message)s"))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(TracebackQueueHandler(log_queue))
+    root.setLevel(config.LOG_LEVEL)
+    # Per-subsystem overrides (logger names are module paths, e.g. "database")
+    for name, level in config.LOG_LEVELS.items():
+        logging.getLogger(name).setLevel(level)
+
+    listener = logging.handlers.QueueListener(
+        log_queue, _build_file_handler(), console_handler, respect_handler_level=True
+    )
+    listener.start()
+    return listener
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Tells a blocked event loop apart from slow I/O. A heartbeat task measures how
+# late its sleeps wake up (scheduling delay); a watchdog thread notices a
+# heartbeat that stopped and logs the loop thread's stack together with the
+# handler that was running. The same thread-side stack sampling backs /profile.
+
+# Heartbeat period; the measured lag is the delay beyond it
+HEARTBEAT_INTERVAL = 0.1
+# Deepest stack logged for a stall
+STALL_STACK_DEPTH = 15
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def _folded_stack(frame) -> str:
+    """Root-to-leaf "func (file:line);..." line of a frame, the flamegraph input format."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class HandlerTracker(BaseMiddleware):
+    """Inner middleware noting which handler each running task is in (see LoopMonitor.active_handler)."""
+
+    def __init__(self, monitor: "LoopMonitor"):
+        self.monitor = monitor
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        # Dict-routed handlers (routing.py) all share one dispatch callback; name the route's target
+        route = data.get("route")
+        target = route.handler if route is not None else data.get("handler")
+        name = getattr(getattr(target, "callback", None), "__qualname__", "?")
+        task = asyncio.current_task()
+        active = self.monitor.active
+        active[task] = name
+        try:
+            return await handler(event, data)
+        finally:
+            active.pop(task, None)
+
+
+class LoopMonitor:
+    """Event loop lag statistics, stall reports and on-demand stack sampling."""
+
+    def __init__(self, warn_ms: float):
+        self.warn = warn_ms / 1000
+        self.active = {}  # asyncio task -> handler name
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._loop = None
+        self._loop_thread = None
+        self._beat = time.monotonic()
+        self._task = None
+        self._profiling = threading.Lock()
+
+    def start(self):
+        """Start the heartbeat task and the watchdog thread (call from the running loop)."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._task = asyncio.create_task(self._heartbeat())
+        threading.Thread(target=self._watchdog, name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def reset(self):
+        self.max_lag = 0.0
+        self.stalls = 0
+
+    def active_handler(self) -> Optional[str]:
+        """Handler of the task the loop is running right now (safe to call from another thread)."""
+        task = asyncio.current_task(self._loop)
+        return self.active.get(task) if task is not None else None
+
+    async def _heartbeat(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            now = time.monotonic()
+            self._beat = now
+            lag = now - started - HEARTBEAT_INTERVAL
+            if lag > self.max_lag:
+                self.max_lag = lag
+            if lag >= self.warn:
+                self.stalls += 1
+                logger.warning(f"Event loop lag {lag * 1000:.0f} ms")
+
+    def _watchdog(self):
+        """Thread: when the heartbeat is overdue, log where the loop thread is stuck (once per stall)."""
+        reported = None
+        while self._task is not None:
+            time.sleep(self.warn / 2)
+            beat = self._beat
+            if beat == reported or time.monotonic() - beat < HEARTBEAT_INTERVAL + self.warn:
+                continue
+            reported = beat
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame, limit=STALL_STACK_DEPTH)) if frame else ""
+            logger.warning(f"Event loop blocked for over {self.warn * 1000:.0f} ms "
+                           f"in handler {self.active_handler() or '-'}:\n{stack}")
+
+    def _sample(self, seconds: float, interval: float) -> Counter:
+        stacks = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                stacks[_folded_stack(frame)] += 1
+            time.sleep(interval)
+        return stacks
+
+    async def profile(self, seconds: float, interval: float = 0.005) -> Optional[Counter]:
+        """Sample the loop thread's stack for `seconds` from a worker thread; lag statistics
+        restart with it. Returns folded stack -> sample count, or None if another profile is running."""
+        if not self._profiling.acquire(blocking=False):
+            return None
+        self.reset()
+        try:
+            return await asyncio.to_thread(self._sample, seconds, interval)
+        finally:
+            self._profiling.release()
+
+
+def folded(stacks: Counter) -> bytes:
+    """Collapsed-stack text ("a;b;c 12" per line) for flamegraph.pl, speedscope or inferno."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common()).encode()
+
+
+monitor = LoopMonitor(config.LOOP_LAG_WARN_MS)
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+from contextlib import suppress
+from typing import AsyncIterable, Iterable, Union
+
+from aiogram.types import Message
+
+import config
+
+logger = logging.getLogger(__name__)
+
+# Telegram rejects messages over 4096 characters; keep a margin for entities
+CHUNK_LIMIT = 4000
+# Chunks prepared ahead of the sender; bounds memory for very long listings
+QUEUE_SIZE = 2
+
+# chat_id -> stop event of the listing currently being sent there
+_active = {}
+
+
+class TextChunker:
+    """Accumulates lines and emits texts of at most `limit` characters.
+
+    Texts are split at line boundaries; a single line longer than the limit is
+    cut into pieces.
+    """
+
+    def __init__(self, limit: int = CHUNK_LIMIT):
+        self.limit = limit
+        self._lines = []
+        self._size = 0
+
+    def add(self, line: str) -> list:
+        """Append a line; return the chunks completed by it (usually none)."""
+        chunks = []
+        pieces = [line[i:i + self.limit] for i in range(0, len(line), self.limit)] or [""]
+        for piece in pieces:
+            size = len(piece) + (1 if self._lines else 0)
+            if self._size + size > self.limit:
+                chunks.append(self.flush())
+                size = len(piece)
+            self._lines.append(piece)
+            self._size += size
+        return chunks
+
+    def flush(self) -> str:
+        text = "\n".join(self._lines)
+        self._lines = []
+        self._size = 0
+        return text
+
+
+async def _iterate(lines: Union[Iterable, AsyncIterable]):
+    if hasattr(lines, "__aiter__"):
+        async for line in lines:
+            yield line
+    else:
+        for line in lines:
+            yield line
+
+
+def stop(chat_id: int) -> bool:
+    """Stop the listing being sent to chat_id; False if there is none."""
+    event = _active.get(chat_id)
+    if event is None:
+        return False
+    event.set()
+    return True
+
+
+async def send_lines(message: Message, lines: Union[Iterable, AsyncIterable],
+                     interval: float = None, limit: int = CHUNK_LIMIT) -> int:
+    """Send lines to message's chat as a series of messages under the length limit.
+
+    Chunks are produced while earlier ones are being sent and go out at most one
+    per `interval` seconds. Sending stops early after stop(chat_id) or when a new
+    listing starts in the same chat. Returns the number of messages sent.
+    """
+    if interval is None:
+        interval = config.LISTING_SEND_INTERVAL
+    chat_id = message.chat.id
+    stop(chat_id)  # a new listing replaces the one still being sent
+    stopped = _active[chat_id] = asyncio.Event()
+    queue = asyncio.Queue()
+    ahead = asyncio.Semaphore(QUEUE_SIZE)
+
+    async def produce():
+        chunker = TextChunker(limit)
+        try:
+            async for line in _iterate(lines):
+                if stopped.is_set():
+                    return
+                for chunk in chunker.add(line):
+                    await ahead.acquire()
+                    queue.put_nowait(chunk)
+            queue.put_nowait(chunker.flush())
+        finally:
+            # Close DB-backed generators (and their cursors) right away on stop
+            if hasattr(lines, "aclose"):
+                await lines.aclose()
+
+    producer = asyncio.create_task(produce())
+    # End-of-listing marker, also queued if the producer fails or is cancelled
+    producer.add_done_callback(lambda _: queue.put_nowait(None))
+    sent = 0
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is None or stopped.is_set():
+                break
+            ahead.release()
+            if not chunk.strip():
+                continue
+            if sent:
+                # Pace the messages; wake up immediately on stop
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(stopped.wait(), interval)
+                if stopped.is_set():
+                    break
+            await message.answer(chunk)
+            sent += 1
+        if producer.done() and not producer.cancelled() and producer.exception():
+            raise producer.exception()
+    finally:
+        producer.cancel()
+        with suppress(asyncio.CancelledError):
+            await producer
+        if _active.get(chat_id) is stopped:
+            del _active[chat_id]
+    if stopped.is_set():
+        logger.info(f"Listing stopped after {sent} message(s)", extra={"user_id": chat_id})
+    return sent
@@ -0,0 +1,185 @@
+import json
+from dataclasses import dataclass
+from datetime import date
+from functools import lru_cache
+from typing import Optional
+
+# Lightweight row objects returned by database.py.
+# Rows are decoded straight from the sqlite3 tuple by the *_row factories below
+# (set as cursor.row_factory), so dates and photo JSON are parsed exactly once,
+# at the database boundary. Each factory expects the columns in field order.
+
+
+@lru_cache(maxsize=1024)
+def _date(value: Optional[str]) -> Optional[date]:
+    """Parse an ISO date (YYYY-MM-DD); empty or malformed values become None."""
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def _photos(value: Optional[str]) -> list:
+    """Decode the JSON array of photo file_ids stored in bookings.photos."""
+    if not value:
+        return []
+    try:
+        return json.loads(value)
+    except ValueError:
+        return []
+
+
+@dataclass(slots=True)
+class Reader:
+    id: int
+    name: str
+    active: int
+
+
+@dataclass(slots=True)
+class Slot:
+    id: int
+    date: Optional[date]
+    time: str
+    is_taken: int
+    reader_id: int
+
+
+@dataclass(slots=True)
+class Booking:
+    """Compact booking state (no text payload) used for status checks and transitions."""
+    id: int
+    user_id: int
+    slot_id: Optional[int]
+    status: str
+    admin_message_id: Optional[int]
+    date: Optional[date]
+    time: Optional[str]
+
+
+@dataclass(slots=True)
+class BookingDetails:
+    """Booking joined with its user and slot (date/time fall back to the cached values)."""
+    id: int
+    status: str
+    num_questions: int
+    amount: int
+    story: Optional[str]
+    participants: Optional[str]
+    questions: Optional[str]
+    photos: list
+    admin_message_id: Optional[int]
+    user_name: Optional[str]
+    username: Optional[str]
+    phone: Optional[str]
+    date: Optional[date]
+    time: Optional[str]
+    user_id: int
+    slot_id: Optional[int]
+    reader_id: Optional[int]
+    reader_name: Optional[str]
+
+
+@dataclass(slots=True)
+class BookingSummary:
+    """Short booking line for lists; user fields are only set in admin listings."""
+    id: int
+    status: str
+    date: Optional[date]
+    time: Optional[str]
+    user_name: Optional[str] = None
+    username: Optional[str] = None
+
+
+@dataclass(slots=True)
+class DailyStats:
+    """One day of booking aggregates (see database._bump_daily_stats)."""
+    day: date
+    created: int
+    checking: int
+    confirmed: int
+    rejected: int
+    cancelled: int
+    timed_out: int
+    revenue: int
+    confirm_seconds: int
+    confirm_samples: int
+
+
+@dataclass(slots=True)
+class BookingEvent:
+    """One status transition from the booking_events log; actor is None for the bot itself."""
+    id: int
+    booking_id: int
+    old_status: Optional[str]
+    new_status: str
+    actor: Optional[int]
+    created_at: int
+
+
+@dataclass(slots=True)
+class Broadcast:
+    id: int
+    text: str
+    created_by: Optional[int]
+    status: str
+    total: int
+    last_user_id: int
+    sent: int
+    failed: int
+    blocked: int
+    status_chat_id: Optional[int]
+    status_message_id: Optional[int]
+
+
+@dataclass(slots=True)
+class OutboxItem:
+    """Pending notification; edit_message_id is set when an existing message is to be edited."""
+    id: int
+    chat_id: int
+    edit_message_id: Optional[int]
+    text: str
+    attempts: int
+
+
+def reader_row(cursor, row) -> Reader:
+    return Reader(row[0], row[1], row[2])
+
+
+def slot_row(cursor, row) -> Slot:
+    return Slot(row[0], _date(row[1]), row[2], row[3], row[4])
+
+
+def booking_row(cursor, row) -> Booking:
+    return Booking(row[0], row[1], row[2], row[3], row[4], _date(row[5]), row[6])
+
+
+def booking_details_row(cursor, row) -> BookingDetails:
+    return BookingDetails(
+        row[0], row[1], row[2], row[3], row[4], row[5], row[6], _photos(row[7]),
+        row[8], row[9], row[10], row[11], _date(row[12]), row[13], row[14], row[15], row[16], row[17]
+    )
+
+
+def booking_summary_row(cursor, row) -> BookingSummary:
+    if len(row) > 4:
+        return BookingSummary(row[0], row[1], _date(row[2]), row[3], row[4], row[5])
+    return BookingSummary(row[0], row[1], _date(row[2]), row[3])
+
+
+def booking_event_row(cursor, row) -> BookingEvent:
+    return BookingEvent(row[0], row[1], row[2], row[3], row[4], row[5])
+
+
+def broadcast_row(cursor, row) -> Broadcast:
+    return Broadcast(*row)
+
+
+def outbox_row(cursor, row) -> OutboxItem:
+    return OutboxItem(row[0], row[1], row[2], row[3], row[4])
+
+
+def daily_stats_row(cursor, row) -> DailyStats:
+    return DailyStats(_date(row[0]), *row[1:])
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+import config
+import database
+from leader import elector
+from rate_limiter import send_limiter
+
+logger = logging.getLogger(__name__)
+
+# Booking notifications are written to the outbox table in the same transaction
+# as the status change (see database.release_booking / update_booking_status) and
+# delivered from here, so a crash or a Telegram error after the commit cannot
+# lose them. Delivery runs in the leader process only.
+
+BATCH_SIZE = 50
+# Seconds between checks when nothing wakes the dispatcher up
+POLL_INTERVAL = 2.0
+MAX_ATTEMPTS = 8
+# Retry delays grow as RETRY_BASE * 2**attempts seconds, capped at RETRY_MAX
+RETRY_BASE = 5
+RETRY_MAX = 600
+
+_wakeup = asyncio.Event()
+
+
+def message(chat_id: int, text: str) -> tuple:
+    """A notification for database.release_booking/update_booking_status(notify=[...])."""
+    return (chat_id, None, text)
+
+
+def edit(chat_id: int, message_id: int, text: str) -> tuple:
+    """A notification that replaces the text of an already sent message."""
+    return (chat_id, message_id, text)
+
+
+def to_admin_group(text: str, edit_message_id: int = None):
+    """Message (or edit) in the admin group; None when no group is configured."""
+    if not config.ADMIN_GROUP_ID:
+        return None
+    if edit_message_id:
+        return edit(config.ADMIN_GROUP_ID, edit_message_id, text)
+    return message(config.ADMIN_GROUP_ID, text)
+
+
+def wake():
+    """Deliver new notifications now instead of at the next poll (call after the commit)."""
+    _wakeup.set()
+
+
+async def _deliver(item) -> str:
+    """Send one outbox row: "sent", "dead" (will never succeed) or "retry"."""
+    await send_limiter.acquire()
+    try:
+        if item.edit_message_id:
+            await config.bot.edit_message_text(item.text, chat_id=item.chat_id, message_id=item.edit_message_id)
+        else:
+            await config.bot.send_message(item.chat_id, item.text)
+        return "sent"
+    except TelegramRetryAfter as e:
+        await asyncio.sleep(e.retry_after)
+        return "retry"
+    except (TelegramForbiddenError, TelegramBadRequest) as e:
+        logger.warning(f"Outbox message {item.id} to {item.chat_id} dropped: {e}")
+        return "dead"
+    except Exception as e:
+        logger.warning(f"Outbox message {item.id} to {item.chat_id} failed (attempt {item.attempts + 1}): {e}")
+        return "retry"
+
+
+async def deliver_batch() -> int:
+    """Deliver one batch of due notifications; returns how many rows were handled."""
+    items = await database.get_due_outbox(time.time(), BATCH_SIZE)
+    done, dead, retry = [], [], []
+    # chat_id -> next attempt of its failed message; later messages to that chat wait for it
+    failed_chats = {}
+    for item in items:
+        if item.chat_id in failed_chats:
+            retry.append((item.id, failed_chats[item.chat_id], 0))
+            continue
+        result = await _deliver(item)
+        if result == "sent":
+            done.append(item.id)
+        elif result == "dead" or item.attempts + 1 >= MAX_ATTEMPTS:
+            dead.append(item.id)
+        else:
+            next_at = time.time() + min(RETRY_BASE * 2 ** item.attempts, RETRY_MAX)
+            failed_chats[item.chat_id] = next_at
+            retry.append((item.id, next_at, 1))
+    await database.finish_outbox(done, dead, retry)
+    return len(items)
+
+
+async def run_dispatcher():
+    """Background loop: deliver pending notifications while this process is the leader."""
+    while True:
+        handled = 0
+        if elector.is_leader:
+            try:
+                handled = await deliver_batch()
+            except Exception as e:
+                logger.exception(f"Outbox delivery failed: {e}")
+        if handled == BATCH_SIZE:
+            continue  # more are probably waiting
+        try:
+            await asyncio.wait_for(_wakeup.wait(), POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
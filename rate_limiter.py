@@ -0,0 +1,35 @@
+import asyncio
+import time
+
+import config
+
+
+class TokenBucket:
+    """Lets through `rate` operations per second on average, with bursts of up to `capacity`.
+
+    Waiters are served in arrival order; acquire() sleeps until a token is free.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+# Shared by background senders (reminders etc.) so together they stay under Telegram's limits
+send_limiter = TokenBucket(config.SEND_RATE)
@@ -0,0 +1,132 @@
+import logging
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.dispatcher.event.telegram import TelegramEventObserver
+from aiogram.filters.callback_data import CallbackData
+from aiogram.fsm.state import State
+from aiogram.types import CallbackQuery, Message
+
+from callback_data import SEP
+
+logger = logging.getLogger(__name__)
+
+# aiogram checks a router's handlers one by one and runs every filter until one
+# matches. The tables below register a single handler per router whose filter
+# finds the target with one dict lookup, so routing cost does not grow with
+# the number of buttons and commands.
+
+
+@dataclass(slots=True)
+class Route:
+    handler: CallableObject
+    codec: Optional[type] = None
+    state: Optional[str] = None
+
+
+def unpack(codec: type, data: str) -> CallbackData:
+    """Decode callback data; missing trailing optional fields (old buttons) are padded."""
+    missing = len(codec.model_fields) - data.count(SEP)
+    if missing > 0:
+        data += SEP * missing
+    return codec.unpack(data)
+
+
+class CallbackRoutes:
+    """Prefix -> handler table for callback queries.
+
+    Routes are keyed by the CallbackData prefix; `action` narrows a route to data
+    whose first field matches (e.g. "admin|price"), `state` to one FSM state.
+    """
+
+    def __init__(self):
+        self._routes = {}
+
+    def attach(self, observer: TelegramEventObserver):
+        observer.register(self._dispatch, self._match)
+
+    def __call__(self, codec: type, *, action: Optional[str] = None, state: Optional[State] = None):
+        key = codec.__prefix__ if action is None else (codec.__prefix__, action)
+
+        def decorator(func: Callable):
+            if key in self._routes:
+                raise ValueError(f"Callback route {key!r} is already registered")
+            self._routes[key] = Route(CallableObject(func), codec, state.state if state else None)
+            return func
+        return decorator
+
+    def resolve(self, data: str, raw_state: Optional[str] = None) -> Optional[Route]:
+        prefix, _, rest = data.partition(SEP)
+        route = self._routes.get((prefix, rest.partition(SEP)[0])) or self._routes.get(prefix)
+        if route is None or (route.state is not None and route.state != raw_state):
+            return None
+        return route
+
+    async def _match(self, callback: CallbackQuery, raw_state: Optional[str] = None):
+        if not callback.data:
+            return False
+        route = self.resolve(callback.data, raw_state)
+        if route is None:
+            return False
+        try:
+            decoded = unpack(route.codec, callback.data)
+        except (TypeError, ValueError):
+            logger.debug(f"Undecodable callback data {callback.data!r}")
+            decoded = None
+        return {"route": route, "callback_data": decoded}
+
+    @staticmethod
+    async def _dispatch(callback: CallbackQuery, route: Route, callback_data, **kwargs):
+        if callback_data is None:
+            # Stale or malformed button: stop the spinner and ignore it
+            await callback.answer()
+            return
+        return await route.handler.call(callback, callback_data=callback_data, **kwargs)
+
+
+class TextRoutes:
+    """Exact-text and /command -> handler table for messages.
+
+    Commands match on the first word, case-insensitively and without @botname.
+    """
+
+    def __init__(self):
+        self._routes = {}
+
+    def attach(self, observer: TelegramEventObserver):
+        observer.register(self._dispatch, self._match)
+
+    def __call__(self, *texts: str):
+        def decorator(func: Callable):
+            route = Route(CallableObject(func))
+            for text in texts:
+                key = text.lower() if text.startswith("/") else text
+                if key in self._routes:
+                    raise ValueError(f"Text route {key!r} is already registered")
+                self._routes[key] = route
+            return func
+        return decorator
+
+    def commands(self) -> list:
+        """Registered /commands, in registration order."""
+        return [key for key in self._routes if key.startswith("/")]
+
+    def resolve(self, text: str) -> Optional[Route]:
+        route = self._routes.get(text)
+        if route is None and text[:1] == "/":
+            command = text.split(None, 1)[0].partition("@")[0].lower()
+            route = self._routes.get(command)
+        return route
+
+    async def _match(self, message: Message):
+        if not message.text:
+            return False
+        route = self.resolve(message.text)
+        if route is None:
+            return False
+        return {"route": route}
+
+    @staticmethod
+    async def _dispatch(message: Message, route: Route, **kwargs):
+        return await route.handler.call(message, **kwargs)
@@ -1,39 +1,176 @@
 import asyncio
 import logging
+import time
 from datetime import datetime, timedelta
 
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
+import bot_texts
+import broadcast
 import config
 import database
+import keyboards
+import local_time
+import outbox
+from formatting import display_date
+from leader import leader_only
+from rate_limiter import send_limiter
 
+logger = logging.getLogger(__name__)
+
+# Runs in every bot process. Periodic jobs are wrapped in @leader_only so that
+# with several processes on one database they run once, in the lease holder.
 scheduler = AsyncIOScheduler()
 
+@leader_only
+async def expire_unpaid_bookings():
+    """Job: cancel bookings left unpaid for PAYMENT_TIMEOUT_MINUTES.
+    The deadline is checked in the database, so it survives restarts and works for bookings made in any process."""
+    try:
+        deadline = int(time.time()) - config.PAYMENT_TIMEOUT_MINUTES * 60
+        for booking_id in await database.get_expired_unpaid_bookings(deadline):
+            await unlock_timeout(booking_id)
+    except Exception as e:
+        logger.exception(f"Error in expire_unpaid_bookings job: {e}")
+
+@leader_only
+async def resume_broadcasts():
+    """Job: send broadcasts started from any process (or interrupted by a restart) from the leader."""
+    try:
+        await broadcast.resume_all()
+    except Exception as e:
+        logger.exception(f"Error in resume_broadcasts job: {e}")
+
 async def unlock_timeout(booking_id: int):
-    """Job: unlock a reserved slot if payment was not completed in time."""
+    """Unlock a reserved slot if payment was not completed in time."""
     try:
         record = await database.get_booking_by_id(booking_id)
         if record is None:
             return
-        status = record["status"]
+        status = record.status
         if status == config.STATUS_WAITING_PAYMENT:
             # Cancel the booking and free the slot
-            slot_id = record["slot_id"]
-            user_id = record["user_id"]
-            await database.update_booking_status(booking_id, config.STATUS_CANCELLED)
-            await database.db.execute("UPDATE slots SET is_taken=0 WHERE id=?", (slot_id,))
-            await database.db.commit()
-            logging.info(f"Auto-unlocked slot {slot_id} for booking {booking_id} (payment timeout)")
-            # Notify user
+            slot_id = record.slot_id
+            user_id = record.user_id
+            # The user and the admin group are notified through the outbox
+            await database.release_booking(booking_id, config.STATUS_CANCELLED, slot_id, timed_out=True, notify=[
+                outbox.message(user_id, "Истекло время ожидания оплаты, ваша запись отменена."),
+                outbox.to_admin_group(f"Запись #{booking_id} автоматически отменена (не оплачена вовремя)."),
+            ])
+            outbox.wake()
+            if slot_id and record.date:
+                wake_waitlist(record.date.isoformat())
+            logger.info(f"Auto-unlocked slot {slot_id} for booking {booking_id} (payment timeout)",
+                        extra={"booking_id": booking_id, "user_id": user_id, "slot_id": slot_id})
+    except Exception as e:
+        logger.exception(f"Error in unlock_timeout job for booking {booking_id}: {e}", extra={"booking_id": booking_id})
+
+@leader_only
+async def backfill_daily_stats():
+    """Job: build daily_stats from existing bookings once, when the table is new."""
+    try:
+        if await database.daily_stats_missing():
+            await database.rebuild_daily_stats()
+    except Exception as e:
+        logger.exception(f"Error in backfill_daily_stats job: {e}")
+
+@leader_only
+async def archive_and_compact():
+    """Nightly job: archive old finished bookings, prune past slots, release free pages."""
+    try:
+        if config.ARCHIVE_AFTER_DAYS > 0:
+            await database.archive_old_bookings(config.ARCHIVE_AFTER_DAYS, config.ARCHIVE_DB_PATH)
+        await database.prune_past_slots()
+        await database.prune_waitlist()
+        await database.prune_outbox()
+        await database.prune_processed_updates(int(time.time()) - config.DEDUP_TTL_HOURS * 3600)
+        freed = await database.incremental_vacuum()
+        logger.info(f"Retention job done, {freed} free page(s) released")
+    except Exception as e:
+        logger.exception(f"Error in archive_and_compact job: {e}")
+
+@leader_only
+async def send_reminders():
+    """Job (every REMINDER_SWEEP_SECONDS): send due session reminders and mark them in one batch."""
+    try:
+        now = int(time.time())
+        today_iso = local_time.today_iso()
+        due = await database.get_due_reminders(now, config.REMINDER_BATCH)
+        updates = []
+        for booking_id, user_id, date_iso, time_str, starts_at, stage in due:
+            if starts_at <= now:
+                # Session already started (bot was down) - nothing to remind about
+                updates.append((database.REMINDER_HOUR, booking_id))
+                continue
+            new_stage = database.REMINDER_HOUR if starts_at - now <= 3600 else database.REMINDER_DAY
+            await send_limiter.acquire()
             try:
-                await config.bot.send_message(user_id, "Истекло время ожидания оплаты, ваша запись отменена.")
+                await config.bot.send_message(user_id, bot_texts.session_reminder(
+                    display_date(date_iso), time_str, new_stage == database.REMINDER_HOUR, date_iso == today_iso))
+            except TelegramForbiddenError:
+                logger.info(f"Reminder not delivered, bot blocked by user {user_id}",
+                            extra={"booking_id": booking_id, "user_id": user_id})
+            except TelegramRetryAfter as e:
+                # Flood control: stop this pass, the rest is picked up next time
+                logger.warning(f"Flood control while sending reminders, retry in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+                break
             except Exception as e:
-                logging.error(f"Failed to send timeout message to user {user_id}: {e}")
-            # Notify admins (in admin group)
+                logger.error(f"Failed to send reminder to user {user_id}: {e}",
+                             extra={"booking_id": booking_id, "user_id": user_id})
+                continue
+            updates.append((new_stage, booking_id))
+        await database.mark_reminders_sent(updates)
+        if updates:
+            logger.info(f"Reminder sweep: {len(updates)} booking(s) updated")
+    except Exception as e:
+        logger.exception(f"Error in send_reminders job: {e}")
+
+@leader_only
+async def sweep_waitlist():
+    """Job (every WAITLIST_SWEEP_SECONDS): offer free slots on every date someone is still waiting for.
+    Catches offers whose wake_waitlist job was lost (restart, failover) and holds that ran out."""
+    try:
+        for date_iso in await database.get_waitlist_dates_to_offer():
+            await notify_waitlist(date_iso)
+    except Exception as e:
+        logger.exception(f"Error in sweep_waitlist job: {e}")
+
+def wake_waitlist(date_iso: str):
+    """A slot on date_iso has become free: run notify_waitlist for that date right away.
+    Only a fast path in this process; sweep_waitlist makes sure the offer happens anyway."""
+    scheduler.add_job(notify_waitlist, "date", run_date=datetime.now(), args=[date_iso],
+                      id=f"waitlist_{date_iso}", replace_existing=True)
+
+async def notify_waitlist(date_iso: str):
+    """Job: offer free slots on a date to waitlisted users in FIFO order.
+
+    Each free slot is offered to one user at a time; while their hold
+    (WAITLIST_HOLD_MINUTES) lasts the next user in line is not notified. The job
+    re-schedules itself for when the oldest hold runs out. Only the subscribers
+    of this date are read, through idx_waitlist_date. Users are claimed in the
+    database before sending, so concurrent runs for a date never offer twice.
+    """
+    try:
+        now = datetime.now()
+        hold = timedelta(minutes=config.WAITLIST_HOLD_MINUTES)
+        user_ids, holds, oldest_hold = await database.claim_waitlist_offers(
+            date_iso, int(now.timestamp()), int(hold.total_seconds()))
+        text = bot_texts.waitlist_offer(display_date(date_iso), config.WAITLIST_HOLD_MINUTES)
+        for user_id in user_ids:
+            await send_limiter.acquire()
             try:
-                if config.ADMIN_GROUP_ID:
-                    await config.bot.send_message(config.ADMIN_GROUP_ID, f"Запись #{booking_id} автоматически отменена (не оплачена вовремя).")
+                await config.bot.send_message(user_id, text, reply_markup=keyboards.kb_waitlist_offer(date_iso))
             except Exception as e:
-                logging.error(f"Failed to notify admin group about timeout: {e}")
+                # Blocked bot etc.: the user is still marked, so the slot moves on to the next one after the hold
+                logger.error(f"Failed to send waitlist offer to user {user_id}: {e}", extra={"user_id": user_id})
+        if user_ids or holds:
+            # Come back when the oldest hold expires, in case its slot is still free
+            first_hold = datetime.fromtimestamp(oldest_hold) if holds else now
+            scheduler.add_job(notify_waitlist, "date", run_date=first_hold + hold, args=[date_iso],
+                              id=f"waitlist_{date_iso}", replace_existing=True)
+        if user_ids:
+            logger.info(f"Waitlist: offered {date_iso} to {len(user_ids)} user(s)")
     except Exception as e:
-        logging.exception(f"Error in unlock_timeout job for booking {booking_id}: {e}")
\ No newline at end of file
+        logger.exception(f"Error in notify_waitlist job for {date_iso}: {e}")
@@ -389,3 +389,100 @@ def format_ready_spread_text(spread: dict) -> str:
     lines.append("")
     lines.append(f"ЦЕНА: {spread['price']}₽")
     return "\n".join(lines)
+
+
+# --- ССЫЛКИ НА ВЫБРАННЫЕ ВОПРОСЫ (компактное состояние FSM) ---
+# В состоянии пользователя хранится не текст вопросов, а ссылка на каталог:
+#   ["ready", spread_id]            — готовый расклад
+#   ["qcat", category_id, mask]     — вопросы категории; бит i маски = вопрос №(i + 1)
+# Текст вопросов собирается только при создании записи (resolve_questions).
+
+def encode_selection(numbers) -> int:
+    """Номера вопросов (с 1) -> битовая маска."""
+    mask = 0
+    for n in numbers:
+        mask |= 1 << (n - 1)
+    return mask
+
+def decode_selection(mask: int) -> list:
+    """Битовая маска -> отсортированный список номеров вопросов (с 1)."""
+    numbers = []
+    n = 1
+    while mask:
+        if mask & 1:
+            numbers.append(n)
+        mask >>= 1
+        n += 1
+    return numbers
+
+def ready_ref(spread_id: str) -> list:
+    return ["ready", spread_id]
+
+def category_ref(category_id: str, mask: int) -> list:
+    return ["qcat", category_id, mask]
+
+def _selected_questions(category_id: str, mask: int) -> list:
+    questions = get_category_questions(category_id)
+    return [questions[n - 1] for n in decode_selection(mask) if n <= len(questions)]
+
+def question_ref_totals(ref) -> tuple:
+    """(количество вопросов, сумма к оплате) по ссылке; (0, 0) если ссылка неизвестна."""
+    if ref and ref[0] == "ready":
+        spread = get_ready_spread_by_id(ref[1])
+        if spread:
+            return len(spread["questions"]), spread["price"]
+    elif ref and ref[0] == "qcat":
+        total = len(get_category_questions(ref[1]))
+        count = (ref[2] & ((1 << total) - 1)).bit_count()
+        return count, count * QUESTION_PRICE
+    return 0, 0
+
+def resolve_questions(ref) -> str:
+    """Текст вопросов (каждый с новой строки) по ссылке."""
+    if ref and ref[0] == "ready":
+        spread = get_ready_spread_by_id(ref[1])
+        return "\n".join(spread["questions"]) if spread else ""
+    if ref and ref[0] == "qcat":
+        return "\n".join(_selected_questions(ref[1], ref[2]))
+    return ""
+
+
+# --- СТРАНИЦЫ СПИСКА ВОПРОСОВ ---
+# Тексты страниц собираются один раз при импорте; перелистывание — только чтение из словаря.
+QUESTIONS_PAGE_SIZE = 10
+
+def _render_category_pages(category_id: str) -> list:
+    cat = QUESTION_CATEGORIES[category_id]
+    questions = cat["questions"]
+    page_count = max(1, (len(questions) + QUESTIONS_PAGE_SIZE - 1) // QUESTIONS_PAGE_SIZE)
+    pages = []
+    for page in range(page_count):
+        start = page * QUESTIONS_PAGE_SIZE
+        lines = [
+            cat["title"],
+            "",
+            "Нажмите на номер вопроса, чтобы выбрать его, или напишите номера через запятую (например: 1, 5, 10):",
+            "",
+        ]
+        for n, q in enumerate(questions[start:start + QUESTIONS_PAGE_SIZE], start + 1):
+            lines.append(f"{n}. {q}")
+        if page_count > 1:
+            lines += ["", f"Стр. {page + 1}/{page_count}"]
+        pages.append("\n".join(lines))
+    return pages
+
+_CATEGORY_PAGES = {cid: _render_category_pages(cid) for cid in QUESTION_CATEGORIES}
+
+def get_category_page_count(category_id: str) -> int:
+    return len(_CATEGORY_PAGES.get(category_id, ()))
+
+def get_category_page_text(category_id: str, page: int) -> str:
+    """Готовый текст страницы категории ("" если категории или страницы нет)."""
+    pages = _CATEGORY_PAGES.get(category_id)
+    if not pages or not 0 <= page < len(pages):
+        return ""
+    return pages[page]
+
+def page_selection_bits(mask: int, page: int) -> int:
+    """Биты маски выбора, относящиеся к вопросам страницы."""
+    return (mask >> (page * QUESTIONS_PAGE_SIZE)) & ((1 << QUESTIONS_PAGE_SIZE) - 1)
@@ -6,6 +6,7 @@ class BookingState(StatesGroup):
     photos = State()
     questions = State()
     phone = State()
+    select_reader = State()
     select_date = State()
     select_time = State()
     waiting_receipt = State()